@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Time to turn a large JSON-RPC response into snapshots
+
+usage: python benchmarks/decode.py [photosets] [photos per set] [repeat]
+
+Compares the two-step path (json.loads to plain dicts, then
+ResponseObject.build) with decoding straight into snapshots through
+DecodeHook, on a LoadGroupHierarchy-shaped payload with every photo
+included, and with a lazy build that only reads photoset titles and
+photo counts.
+"""
+import gc
+import json
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from zenapi import _zapi
+from snapshot_memory import hierarchy
+
+def best(fn, repeat):
+    times = []
+    for i in xrange(repeat):
+        gc.collect()
+        t0 = time()
+        fn()
+        times.append(time() - t0)
+    return min(times)
+
+def main(nsets=50, nphotos=1000, repeat=3):
+    body = json.dumps({'result':hierarchy(nsets, nphotos), 'error':None,
+                       'id':1})
+    print '%i photos, %.1f MB of JSON'%(nsets*nphotos, len(body)/1e6)
+    plain = best(lambda: json.loads(body), repeat)
+    print 'json.loads alone:        %.2fs'%plain
+    twostep = best(lambda: _zapi.ResponseObject.build(
+        json.loads(body)['result']), repeat)
+    print 'json.loads + build:      %.2fs'%twostep
+    if hasattr(_zapi, 'DecodeHook'):
+        single = best(lambda: json.loads(
+            body, object_hook=_zapi.DecodeHook)['result'], repeat)
+        print 'single pass (DecodeHook): %.2fs (%.1fx faster)'%(
+            single, twostep/single)
+    def lazy():
+        root = _zapi.ResponseObject.build(json.loads(body)['result'], lazy=True)
+        return [(e.Title, len(e.Photos)) for e in root.Elements]
+    print 'lazy build, titles only:  %.2fs'%best(lazy, repeat)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+"""Local stand-in for the Zenfolio JSON-RPC API, for offline benchmarks
+
+usage: python benchmarks/fakeserver.py [options]
+
+Serves a synthetic account (a root group holding --groups groups of
+--sets photosets of --photos photos each) on 127.0.0.1, with HTTP/1.1
+keep-alive:
+
+  POST /api/1.8/zfapi.asmx       the JSON-RPC methods ZenConnection uses
+  POST /upload/<photoset id>     photo uploads (returns the new photo id)
+  GET  /img/<photo id>[-size].jpg  --image-bytes bytes of image data
+  GET  /redirect/<n>/<path>      302 to /redirect/<n-1>/<path>, then /<path>
+
+Point zenapi at it with
+  _zapi.API_URL = _zapi.API_SSL_URL = 'http://127.0.0.1:<port>/api/1.8/zfapi.asmx'
+Prints 'listening on http://127.0.0.1:<port>' once ready.
+"""
+import BaseHTTPServer
+import SocketServer
+import json
+import optparse
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import urlparse
+
+sys.path.insert(0, os.path.dirname(__file__))
+from snapshot_memory import date, photo
+
+API_PATH = '/api/1.8/zfapi.asmx'
+TOKEN = 'fake-token'
+
+class RpcFault(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+class Account(object):
+    """Synthetic hierarchy; objects are generated from their Ids on demand
+
+    Group ids are 1 (root) and 2.., photoset ids 1000.., photo ids
+    100000000 + n, numbered in order down the tree.
+    """
+
+    def __init__(self, groups=10, sets=10, photos=100, image_bytes=100000,
+                 host='127.0.0.1'):
+        self.groups = groups
+        self.sets = sets
+        self.photos = photos
+        self.image = os.urandom(image_bytes)
+        self.host = host
+        self.nsets = groups*sets
+        self.nphotos = self.nsets*photos
+        self._lock = threading.Lock()
+        self._nextid = 900000000
+        self.page_cap = None # most items a paged call returns, if set
+        self.edits = {}      # id -> fields replacing the generated ones
+        self.removed = set() # ids of photos taken out of their photoset
+        self.generation = 0  # bumped by every change, see FakeServer.encoded
+        self.tokens = 0      # auth tokens issued
+
+    def edit(self, id, **fields):
+        """Overrides fields of the photo, photoset or group with this id"""
+        with self._lock:
+            self.edits.setdefault(id, {}).update(fields)
+            self.generation += 1
+
+    def remove(self, id):
+        """Takes a photo out of its photoset"""
+        with self._lock:
+            self.removed.add(id)
+            self.generation += 1
+
+    def newid(self):
+        with self._lock:
+            self._nextid += 1
+            return self._nextid
+
+    def photo(self, i):
+        p = photo(i - 100000000)
+        p['Id'] = i
+        p['Gallery'] = 1000 + (i - 100000000)//self.photos
+        p['Size'] = len(self.image)
+        p['OriginalUrl'] = 'http://%s/img/%i.jpg'%(self.host, i)
+        p['UrlHost'] = self.host
+        p['UrlCore'] = 'img/%i'%i
+        p.update(self.edits.get(i, ()))
+        return p
+
+    def photoset(self, s, includePhotos=False):
+        n = s - 1000
+        if not 0 <= n < self.nsets:
+            raise RpcFault('E_NOSUCHOBJECT', 'No photoset %s'%s)
+        ps = {'$type':'PhotoSet', 'Id':s, 'Title':'set %i'%n,
+              'Type':'Gallery', 'PhotoCount':self.photos, 'Views':n,
+              'CreatedOn':date(n), 'ModifiedOn':date(n + 1),
+              'UploadUrl':'http://%s/upload/%i'%(self.host, s),
+              'PageUrl':'http://%s/p%i'%(self.host, s)}
+        ids = [100000000 + n*self.photos + p for p in xrange(self.photos)]
+        if self.removed:
+            ids = [i for i in ids if i not in self.removed]
+            ps['PhotoCount'] = len(ids)
+        ps.update(self.edits.get(s, ()))
+        if includePhotos:
+            ps['Photos'] = [self.photo(i) for i in ids]
+        return ps
+
+    def group(self, g, includeChildren=False, sets=True):
+        if g == 1:
+            gr = {'$type':'Group', 'Id':1, 'Title':'root'}
+            children = [self.group(2 + i, includeChildren, sets)
+                        for i in xrange(self.groups)]
+        elif 2 <= g < 2 + self.groups:
+            n = g - 2
+            gr = {'$type':'Group', 'Id':g, 'Title':'group %i'%n,
+                  'CreatedOn':date(n), 'ModifiedOn':date(n + 2)}
+            children = [self.photoset(1000 + n*self.sets + i)
+                        for i in xrange(self.sets)] if sets else []
+        else:
+            raise RpcFault('E_NOSUCHOBJECT', 'No group %s'%g)
+        gr.update(self.edits.get(g, ()))
+        if includeChildren:
+            gr['Elements'] = children
+        return gr
+
+    def page(self, items, offset, limit):
+        offset = offset or 0
+        limit = limit if limit else 15
+        if self.page_cap is not None:
+            limit = min(limit, self.page_cap)
+        return [self.photo(100000000 + i) if items == 'photos'
+                else self.photoset(1000 + i)
+                for i in xrange(offset, min(offset + limit,
+                                            self.nphotos if items == 'photos'
+                                            else self.nsets))]
+
+    def call(self, method, params):
+        p = list(params) + [None]*6
+        if method in ('AuthenticatePlain', 'Authenticate'):
+            # A new token every time, as the real service hands out
+            with self._lock:
+                self.tokens += 1
+                return '%s-%i'%(TOKEN, self.tokens)
+        if method == 'GetChallenge':
+            return {'PasswordSalt':range(32), 'Challenge':range(32)}
+        if method == 'LoadGroupHierarchy':
+            return self.group(1, True)
+        if method == 'LoadGroup':
+            return self.group(int(p[0]), bool(p[2]))
+        if method == 'LoadPhotoSet':
+            return self.photoset(int(p[0]), bool(p[2]))
+        if method == 'LoadPhoto':
+            return self.photo(int(p[0]))
+        if method in ('LoadPublicProfile', 'LoadPrivateProfile'):
+            return {'$type':'User', 'LoginName':'fake',
+                    'RootGroup':self.group(1)}
+        if method in ('GetRecentPhotos', 'GetPopularPhotos'):
+            return self.page('photos', p[0], p[1])
+        if method in ('GetRecentSets', 'GetPopularSets'):
+            return self.page('sets', p[1], p[2])
+        if method in ('SearchPhotoByText', 'SearchPhotoByCategory'):
+            return {'$type':'PhotoResult', 'TotalCount':self.nphotos,
+                    'Photos':self.page('photos', p[3], p[4])}
+        if method in ('SearchSetByText', 'SearchSetByCategory'):
+            return {'$type':'PhotoSetResult', 'TotalCount':self.nsets,
+                    'PhotoSets':self.page('sets', p[4], p[5])}
+        if method in ('UpdatePhoto', 'UpdatePhotoSet', 'UpdateGroup'):
+            i = int(p[0])
+            if method == 'UpdatePhoto':
+                obj = self.photo(i)
+            elif method == 'UpdatePhotoSet':
+                obj = self.photoset(i)
+            else:
+                obj = self.group(i)
+            fields = dict((k, v) for k, v in (p[1] or {}).items()
+                          if k != '$type')
+            self.edit(i, **fields)
+            obj.update(fields)
+            return obj
+        if method == 'ReplacePhoto':
+            i = int(p[0])
+            self.edit(i, Sequence=self.photo(i)['Sequence'] + 'r')
+            return None
+        if method == 'CreateGroup':
+            return dict(p[1] or {}, **{'$type':'Group', 'Id':self.newid()})
+        if method == 'CreatePhotoSet':
+            return dict(p[2] or {}, **{'$type':'PhotoSet', 'Id':self.newid(),
+                                       'Type':p[1]})
+        if method.startswith(('Delete', 'Move', 'Reorder', 'Set', 'Collection',
+                              'Rotate', 'Replace', 'Update')):
+            return None
+        raise RpcFault('E_UNKNOWNMETHOD', 'Unknown method %s'%method)
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer the status line and headers into one send, and don't let
+    # Nagle's algorithm hold back small responses on kept-alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    imagepath = re.compile(r'^/img/(\d+)(-\d+)?\.jpg$')
+    redirectpath = re.compile(r'^/redirect/(\d+)(/.*)$')
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body, ctype='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def delay(self, key):
+        """Applies --latency, --error-rate and faults injected for key;
+        returns True if the request was answered (or dropped) already"""
+        server = self.server
+        server.log.append(key)
+        action = server.fault(key)
+        if action == 'drop':
+            self.close_connection = 1
+            return True
+        if isinstance(action, float):
+            time.sleep(action)
+        elif isinstance(action, basestring):
+            self.reply(200, json.dumps({'result':None, 'id':None, 'error':{
+                'code':action, 'message':'Injected %s'%action}}))
+            return True
+        elif action is not None:
+            code, headers = action if isinstance(action, tuple) else (action,
+                                                                      {})
+            self.send_response(code)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', '5')
+            self.end_headers()
+            self.wfile.write('fault')
+            return True
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            self.reply(503, 'Service Unavailable', 'text/plain')
+            return True
+        return False
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        redirect = self.redirectpath.match(path)
+        if redirect is not None:
+            hops, rest = int(redirect.group(1)), redirect.group(2)
+            self.send_response(302)
+            self.send_header('Location', rest if hops <= 1 else
+                             '/redirect/%i%s'%(hops - 1, rest))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if not self.imagepath.match(path):
+            return self.reply(404, 'Not Found', 'text/plain')
+        if self.delay('GET'):
+            return
+        self.reply(200, self.server.account.image, 'image/jpeg')
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.getheader('Content-Length') or 0)
+        remaining = length
+        chunks = []
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 256*1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if url.path == API_PATH:
+                chunks.append(chunk)
+        if url.path.startswith('/upload/'):
+            if self.delay('upload'):
+                return
+            query = urlparse.parse_qs(url.query)
+            self.server.uploads.append((int(url.path[len('/upload/'):]),
+                                        query.get('filename', [None])[0],
+                                        length - remaining))
+            return self.reply(200, json.dumps(self.server.account.newid()))
+        if url.path != API_PATH:
+            return self.reply(404, 'Not Found', 'text/plain')
+        req = json.loads(''.join(chunks))
+        if self.delay(req['method']):
+            return
+        try:
+            result = self.server.encoded(req['method'], req.get('params') or [])
+            body = '{"result": %s, "error": null, "id": %s}'%(
+                result, json.dumps(req.get('id')))
+        except RpcFault, e:
+            body = json.dumps({'result':None, 'id':req.get('id'),
+                               'error':{'code':e.code, 'message':e.message}})
+        self.reply(200, body)
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """The stand-in server; call serve_forever(), or start() for a
+    background thread"""
+    daemon_threads = True
+    # Read calls whose encoded results are kept, so that serving them
+    # costs about as little as possible
+    CACHED = ('LoadGroupHierarchy', 'LoadGroup', 'LoadPhotoSet', 'LoadPhoto')
+
+    def __init__(self, account, port=0, latency=0, error_rate=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        account.host = '127.0.0.1:%i'%self.server_address[1]
+        self.account = account
+        self.latency = latency
+        self.error_rate = error_rate
+        self.log = []  # RPC method names, 'GET' and 'upload', as received
+        self.uploads = []  # (photoset id, filename, bytes received)
+        self._faults = {}
+        self._faultlock = threading.Lock()
+        self._encoded = {}
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%i'%self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up (e.g. after an injected fault) are expected
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+    def inject(self, key, action, times=1):
+        """Makes the next requests for key (an RPC method name, 'GET' or
+        'upload') misbehave
+
+        action: 'drop' (close the connection without answering), seconds
+        (a float) to stall before answering, an HTTP status to answer
+        with instead, optionally as (status, {header: value}), or an RPC
+        error code such as 'E_NOTAUTHENTICATED' to fail the call with
+        """
+        with self._faultlock:
+            self._faults.setdefault(key, []).extend([action]*times)
+
+    def fault(self, key):
+        with self._faultlock:
+            actions = self._faults.get(key)
+            if actions:
+                return actions.pop(0)
+        return None
+
+    def encoded(self, method, params):
+        if method not in self.CACHED:
+            return json.dumps(self.account.call(method, params))
+        key = (method, json.dumps(params), self.account.generation)
+        result = self._encoded.get(key)
+        if result is None:
+            result = self._encoded[key] = json.dumps(
+                self.account.call(method, params))
+        return result
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever, name='fakeserver')
+        t.setDaemon(True)
+        t.start()
+        return t
+
+def options():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--port', type='int', default=0)
+    parser.add_option('--groups', type='int', default=10)
+    parser.add_option('--sets', type='int', default=10,
+                      help='photosets per group')
+    parser.add_option('--photos', type='int', default=100,
+                      help='photos per photoset')
+    parser.add_option('--image-bytes', type='int', default=100000)
+    parser.add_option('--latency', type='float', default=0,
+                      help='seconds added to every response')
+    parser.add_option('--error-rate', type='float', default=0,
+                      help='fraction of requests answered with 503')
+    return parser
+
+def main(argv=None):
+    opts, args = options().parse_args(argv)
+    account = Account(opts.groups, opts.sets, opts.photos, opts.image_bytes)
+    server = FakeServer(account, opts.port, opts.latency, opts.error_rate)
+    print 'listening on %s'%server.url
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""Offline benchmark suite against the local stand-in server
+
+usage: python benchmarks/run.py [options] [benchmark ...]
+
+Starts benchmarks/fakeserver.py in a separate process (so that it does not
+share this interpreter's lock) unless --url names a running one, points
+zenapi at it and runs the given benchmarks (by default all of them):
+
+  calls       LoadPhoto calls/s, one at a time and --workers at once
+  hierarchy   LoadGroupHierarchy and LoadPhotoSet(includePhotos=True):
+              total time, and the transport vs decode+build split
+  memory      bytes per Photo snapshot (benchmarks/snapshot_memory.py)
+  download    download_photoset throughput with --workers
+  upload      upload_directory throughput with --workers
+
+--json FILE also writes the results as JSON, to compare between runs.
+"""
+import json
+import optparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+from zenapi import _zapi, ThreadPoolZenConnection, wait
+from zenapi._zapi import (ZenConnection, ResponseObject, DecodeHook,
+                          MakeRequest, PhotoSet, InformationLevel)
+
+FIRST_PHOTO = 100000000
+FIRST_SET = 1000
+
+def timed(fn, *args, **kwargs):
+    t0 = time()
+    result = fn(*args, **kwargs)
+    return time() - t0, result
+
+def connect(opts):
+    zen = ZenConnection(username='bench', password='bench')
+    zen.AuthenticatePlain()
+    return zen
+
+def bench_calls(zen, opts):
+    n = opts.calls
+    elapsed, _ = timed(lambda: [zen.LoadPhoto(FIRST_PHOTO + i%opts.photos)
+                                for i in xrange(n)])
+    serial = n/elapsed
+    azen = ThreadPoolZenConnection(connection=zen, max_workers=opts.workers)
+    try:
+        elapsed, _ = timed(lambda: wait([
+            azen.LoadPhoto(FIRST_PHOTO + i) for i in xrange(n)]))
+    finally:
+        azen.close()
+    print 'calls: %.0f calls/s serial, %.0f calls/s with %i workers'%(
+        serial, n/elapsed, opts.workers)
+    return {'serial_calls_per_sec':serial,
+            'concurrent_calls_per_sec':n/elapsed}
+
+def _split(method, params, auth):
+    """(seconds on the wire, seconds decoding+building) of one call"""
+    t0 = time()
+    body = MakeRequest(method, params, auth, True).read()
+    t1 = time()
+    json.loads(body, object_hook=DecodeHook)
+    return t1 - t0, time() - t1, len(body)
+
+def bench_hierarchy(zen, opts):
+    results = {}
+    for name, method, params, call in (
+        ('hierarchy', 'LoadGroupHierarchy', [],
+         zen.LoadGroupHierarchy),
+        ('photoset', 'LoadPhotoSet',
+         [FIRST_SET, InformationLevel.Level2, True],
+         lambda: zen.LoadPhotoSet(FIRST_SET, InformationLevel.Level2, True))):
+        _split(method, params, zen.auth) # warm the server's cache
+        total, _ = timed(call)
+        wire, build, size = _split(method, params, zen.auth)
+        print ('%s: %.3fs (%.3fs transport, %.3fs decode+build of %.1f kB)'%(
+            method, total, wire, build, size/1e3))
+        results[name] = {'total':total, 'transport':wire, 'build':build,
+                         'bytes':size}
+    return results
+
+def bench_memory(zen, opts):
+    out = subprocess.check_output(
+        [sys.executable, os.path.join(HERE, 'snapshot_memory.py'),
+         str(max(1, opts.memory_photos//1000)), '1000'])
+    per = int(re.search(r'(\d+) bytes per photo', out).group(1))
+    secs = float(re.search(r'built in ([\d.]+)s', out).group(1))
+    print 'memory: %i bytes per Photo snapshot (%s)'%(
+        per, out.strip().replace('\n', '; '))
+    return {'bytes_per_photo':per, 'build_seconds':secs}
+
+def bench_download(zen, opts):
+    ps = zen.LoadPhotoSet(FIRST_SET, InformationLevel.Level2, True)
+    tmp = tempfile.mkdtemp(prefix='zenapi-bench-')
+    try:
+        elapsed, summary = timed(zen.download_photoset, ps, path=tmp,
+                                 workers=opts.workers)
+        nbytes = sum(os.path.getsize(os.path.join(d, f))
+                     for d, _, fs in os.walk(tmp) for f in fs)
+    finally:
+        shutil.rmtree(tmp, True)
+    print 'download: %i photos, %.1f MB/s with %i workers (%s)'%(
+        len(summary.downloaded), nbytes/elapsed/1e6, opts.workers, summary)
+    return {'photos':len(summary.downloaded), 'bytes':nbytes,
+            'bytes_per_sec':nbytes/elapsed}
+
+def bench_upload(zen, opts):
+    ps = zen.LoadPhotoSet(FIRST_SET)
+    tmp = tempfile.mkdtemp(prefix='zenapi-bench-')
+    try:
+        data = os.urandom(opts.image_bytes)
+        for i in xrange(opts.uploads):
+            with open(os.path.join(tmp, 'up%04i.jpg'%i), 'wb') as f:
+                f.write(data)
+        elapsed, report = timed(zen.upload_directory, ps, tmp,
+                                workers=opts.workers)
+    finally:
+        shutil.rmtree(tmp, True)
+    print 'upload: %i photos, %.1f MB/s with %i workers (%s)'%(
+        len(report.succeeded), report.bytes/elapsed/1e6, opts.workers, report)
+    return {'photos':len(report.succeeded), 'bytes':report.bytes,
+            'bytes_per_sec':report.bytes/elapsed}
+
+BENCHMARKS = [('calls', bench_calls), ('hierarchy', bench_hierarchy),
+              ('memory', bench_memory), ('download', bench_download),
+              ('upload', bench_upload)]
+
+def start_server(opts):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'fakeserver.py'),
+         '--groups', str(opts.groups), '--sets', str(opts.sets),
+         '--photos', str(opts.photos), '--image-bytes', str(opts.image_bytes),
+         '--latency', str(opts.latency)],
+        stdout=subprocess.PIPE)
+    line = proc.stdout.readline()
+    if not line.startswith('listening on '):
+        proc.kill()
+        raise RuntimeError('fake server did not start: %r'%line)
+    return proc, line.split()[-1]
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--url', help='use an already running fake server')
+    parser.add_option('--groups', type='int', default=10)
+    parser.add_option('--sets', type='int', default=10)
+    parser.add_option('--photos', type='int', default=500,
+                      help='photos per photoset')
+    parser.add_option('--image-bytes', type='int', default=200000)
+    parser.add_option('--latency', type='float', default=0)
+    parser.add_option('--calls', type='int', default=2000)
+    parser.add_option('--workers', type='int', default=8)
+    parser.add_option('--uploads', type='int', default=50)
+    parser.add_option('--memory-photos', type='int', default=100000)
+    parser.add_option('--json', help='also write the results to this file')
+    opts, names = parser.parse_args(argv)
+    unknown = set(names) - set(n for n, _ in BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: %s'%', '.join(sorted(unknown)))
+
+    proc = None
+    url = opts.url
+    if url is None:
+        proc, url = start_server(opts)
+    try:
+        _zapi.API_URL = _zapi.API_SSL_URL = url + '/api/1.8/zfapi.asmx'
+        _zapi.build_pool(maxsize=max(4, opts.workers))
+        zen = connect(opts)
+        results = {}
+        for name, bench in BENCHMARKS:
+            if not names or name in names:
+                results[name] = bench(zen, opts)
+    finally:
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return results
+
+if __name__ == '__main__':
+    main()
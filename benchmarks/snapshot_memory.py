@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Memory used by snapshots of a large synthetic hierarchy
+
+usage: python benchmarks/snapshot_memory.py [photosets] [photos per set]
+
+Builds Group -> PhotoSet -> Photo snapshots (Level2-sized photos, like
+LoadPhotoSet(..., includePhotos=True)) through ResponseObject.build and
+reports the growth of the process's peak RSS per photo.
+"""
+import gc
+import os
+import resource
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from zenapi._zapi import ResponseObject
+
+def date(i):
+    return {'$type':'DateTime',
+            'Value':'20%02i-%02i-%02i 12:%02i:%02i'%(i%20, i%12 + 1, i%28 + 1,
+                                                    i%60, (i*7)%60)}
+
+def photo(i):
+    return {
+        '$type':'Photo', 'Id':100000000 + i, 'Width':4000, 'Height':3000,
+        'Sequence':'a%i'%i, 'Owner':'someone', 'Title':'IMG_%05i.jpg'%i,
+        'MimeType':'image/jpeg', 'Views':i%997, 'Size':5000000 + i,
+        'Gallery':i//100, 'OriginalUrl':'http://example.com/img/%i.jpg'%i,
+        'UrlCore':'/img/s1/v%i/p%i'%(i%50, i), 'UrlHost':'photos.example.com',
+        'UrlToken':'tok%i'%i, 'PageUrl':'http://example.com/p%i'%i,
+        'MailboxId':'m%i'%i, 'TextCn':1, 'Flags':'None', 'IsVideo':False,
+        'Duration':0, 'Caption':None, 'FileName':'IMG_%05i.jpg'%i,
+        'UploadedOn':date(i), 'TakenOn':date(i + 1), 'Keywords':['a', 'b'],
+        'Categories':[], 'Copyright':None, 'Rotation':'None',
+    }
+
+def hierarchy(nsets, nphotos):
+    return {'$type':'Group', 'Id':1, 'Title':'root', 'Elements':[
+        {'$type':'PhotoSet', 'Id':1000 + s, 'Title':'set %i'%s,
+         'Type':'Gallery', 'PhotoCount':nphotos, 'Views':s,
+         'CreatedOn':date(s), 'ModifiedOn':date(s + 1),
+         'Photos':[photo(s*nphotos + p) for p in xrange(nphotos)]}
+        for s in xrange(nsets)]}
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def main(nsets=200, nphotos=1000):
+    raw = hierarchy(nsets, nphotos)
+    gc.collect()
+    before = maxrss()
+    t0 = time()
+    h = ResponseObject.build(raw)
+    elapsed = time() - t0
+    gc.collect()
+    grown = maxrss() - before
+    n = nsets*nphotos
+    print '%i photos built in %.2fs'%(n, elapsed)
+    print 'peak RSS grew %.1f MB: %i bytes per photo'%(grown/1e6, grown/n)
+    return h
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -1,94 +1,59 @@
-raise NotImplementedError("Haven't updated for api v1.6, this example is untested.  Use at own risk")
-from zenapi import ZenConnection
-from zenapi.snapshots import Group, PhotoSet
-from zenapi.updaters import PhotoSetUpdater, GroupUpdater
+from zenapi import ThreadPoolZenConnection, HierarchyTable, wait
 
 from time import time
-from threading import Thread
-import Queue
-
-_q = Queue.Queue()
 
 def updateZenTitlePhotos(username, password):
     """Updates the title photo of every PhotoSet and Group to be 
     the most-viewed photo.  Overwrites current title photos
     """
-    zen = ZenConnection(username=username, password=password)
+    zen = ThreadPoolZenConnection(username=username, password=password,
+                             max_workers=10)
     
     
     print 'Loading album hierarchy...'
     t0 = time()
-    h = zen.loadFullGroupHierarchy()
+    h = zen.connection.loadFullGroupHierarchy(workers=10)
     print 'Loaded in %i seconds.'%(time()-t0)    
-    zen.Authenticate() # so we only work on the public photos
+    zen.Authenticate().result() # so we only work on the public photos
     
     print 'Updating...'
     
     t1 = time()
-    _updateGroup(zen, h)
-    def worker():
-        while True:
-            item = _q.get()
-            item.start()
-            item.join()
-            _q.task_done()
-    for i in range(10):
-        t = Thread(target=worker)
-        t.setDaemon(True)
-        t.start()
-    _q.join()
+    pending = []
+    _updateTitlePhotos(zen, h, pending)
+    wait(pending)
+    for f in pending:
+        f.result() # raises if any update failed
+    zen.close()
     print 'Done in %i seconds'%(time()-t1)
     pass
 
 
-def _updatePhotoSet(zen, pset):
-    views = {}
-    for p in pset.Photos:
-        views[p.Views] = p
-        
-    mostViews = max(views.keys())
-    mostPopular = views[mostViews]
-    if pset.TitlePhoto is None or pset.TitlePhoto.Id != mostPopular.Id:
-        pset.TitlePhoto = mostPopular
-        _q.put(_UpdatePsPhoto(zen, pset, mostPopular))
-        
-def _updateGroup(zen, group):
-    views = {}
-    for element in group.Elements:
-        if isinstance(element, Group):
-            v = _updateGroup(zen, element)
-            views[v] = element.TitlePhoto
-        elif isinstance(element, PhotoSet):
-            _updatePhotoSet(zen, element)
-            views[element.Views] = element.TitlePhoto
-    
-        
-    mostViews = max(views.keys())
-    mostPopular = views[mostViews]
-    
-    if group.TitlePhoto is None or group.TitlePhoto.Id != mostPopular.Id:
-        print 'Group %s, popular is %s with %s views'%(group, 
-                                                       mostPopular, mostViews)
-        group.TitlePhoto = mostPopular
-        _q.put(_UpdateGroupPhoto(zen, group, mostPopular))
-        
-    return mostViews
-    
-class _UpdateTitlePhoto(Thread):
-    def __init__(self, zen, element, photo, **kwargs):
-        Thread.__init__(self, **kwargs)
-        self.zen = zen
-        self.photo = photo
-        self.element = element
-class _UpdatePsPhoto(_UpdateTitlePhoto):
-    def run(self):
-        self.zen.SetPhotoSetTitlePhoto(self.element, self.photo)
-class _UpdateGroupPhoto(_UpdateTitlePhoto):
-    def run(self):
-        self.zen.SetGroupTitlePhoto(self.element, self.photo)
+def _updateTitlePhotos(zen, h, pending):
+    # The most-viewed photo below every group and photoset at once (ties
+    # go to the first photo in the hierarchy)
+    table = HierarchyTable(h)
+    best = table.argmax('views')
+    for row in table.rows(table.PHOTOSET):
+        _setTitlePhoto(zen, table, row, best[row], pending)
+    for row in table.rows(table.GROUP):
+        _setTitlePhoto(zen, table, row, best[row], pending)
+
+def _setTitlePhoto(zen, table, row, best, pending):
+    if best < 0: # no photos below
+        return
+    element = table.objects[row]
+    mostPopular = table.objects[best]
+    if element.TitlePhoto is not None and element.TitlePhoto.Id == mostPopular.Id:
+        return
+    element.TitlePhoto = mostPopular
+    if table.kind[row] == table.PHOTOSET:
+        pending.append(zen.SetPhotoSetTitlePhoto(element, mostPopular))
+    else:
+        print 'Group %s, popular is %s with %s views'%(element, mostPopular,
+                                                       table.views[best])
+        pending.append(zen.SetGroupTitlePhoto(element, mostPopular))
     
-        
-            
 if __name__ == '__main__':
     
     updateZenTitlePhotos('myusername', 'mypassword')
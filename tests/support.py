@@ -0,0 +1,81 @@
+"""Shared test fixtures: the API pointed at a local fake server"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import fakeserver
+
+from zenapi import _zapi
+from zenapi._zapi import ResponseObject
+
+FIRST_PHOTO = 100000000
+FIRST_SET = 1000
+
+def lazy_photoset(n=3):
+    """A lazily built PhotoSet with n photos, as decoded from a response"""
+    return ResponseObject.build(
+        {'$type':'PhotoSet', 'Id':1, 'Title':'set',
+         'Photos':[{'$type':'Photo', 'Id':100 + i, 'Title':'p%i.jpg'%i,
+                    'UploadedOn':{'$type':'DateTime',
+                                  'Value':'2009-06-0%i 12:30:00'%(i + 1)}}
+                   for i in range(n)]}, lazy=True)
+
+class ServerTestCase(unittest.TestCase):
+    """Runs each test against a fresh fakeserver.FakeServer
+
+    The API URLs point at the server and the connection pool is rebuilt
+    (with the keyword arguments in pool) for every test.  self.server.log
+    lists the requests it received; self.tmp is a scratch directory.
+    """
+    groups, sets, photos, image_bytes = 2, 2, 5, 1000
+    pool = {}
+
+    def setUp(self):
+        self.account = fakeserver.Account(self.groups, self.sets, self.photos,
+                                          self.image_bytes)
+        self.server = fakeserver.FakeServer(self.account)
+        self.server.start()
+        self._urls = _zapi.API_URL, _zapi.API_SSL_URL
+        _zapi.API_URL = _zapi.API_SSL_URL = self.server.url + fakeserver.API_PATH
+        _zapi.build_pool(**self.pool)
+        self.tmp = tempfile.mkdtemp(prefix='zenapi-test-')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        _zapi.API_URL, _zapi.API_SSL_URL = self._urls
+        _zapi.build_pool()
+        shutil.rmtree(self.tmp, True)
+
+    def connect(self, **kwargs):
+        """An authenticated ZenConnection"""
+        zen = _zapi.ZenConnection(username='user', password='secret', **kwargs)
+        zen.AuthenticatePlain()
+        return zen
+
+    def calls(self, key):
+        """Number of requests for key the server received"""
+        return self.server.log.count(key)
@@ -0,0 +1,129 @@
+"""Tests of HierarchyTable against brute-force walks of the tree"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+import unittest
+
+from zenapi._zapi import Group, PhotoSet, Photo, DateTime
+from zenapi._analytics import HierarchyTable, numpy
+
+def _tree(seed=7):
+    """A random Group tree, with ties in Views and missing TakenOn dates"""
+    rand = random.Random(seed)
+    ids = [100]
+    def photoset(id):
+        ps = PhotoSet._fromjson({'Id':id, 'Title':'s%i'%id})
+        ps.Photos = []
+        for _ in range(rand.randint(0, 12)):
+            ids[0] += 1
+            taken = None
+            if rand.random() < .8:
+                taken = DateTime._fromjson(
+                    {'Value':'20%02i-01-01 00:00:00'%rand.randint(0, 20)})
+            ps.Photos.append(Photo._fromjson(
+                {'Id':ids[0], 'Views':rand.randint(0, 20),
+                 'Size':rand.randint(1, 10**6), 'TakenOn':taken}))
+        return ps
+    def group(id, depth):
+        g = Group._fromjson({'Id':id, 'Title':'g%i'%id})
+        g.Elements = []
+        for k in range(rand.randint(2, 5)):
+            if depth < 3 and rand.random() < .4:
+                g.Elements.append(group(id*10 + k, depth + 1))
+            else:
+                g.Elements.append(photoset(id*10 + k))
+        return g
+    return group(1, 0)
+
+def _photos(obj):
+    """Photos below obj, in preorder"""
+    if isinstance(obj, Photo):
+        return [obj]
+    children = obj.Elements if isinstance(obj, Group) else obj.Photos
+    return [p for c in children or () for p in _photos(c)]
+
+@unittest.skipIf(numpy is None, 'requires numpy')
+class HierarchyTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = _tree()
+        self.table = HierarchyTable(self.root)
+
+    def test_layout(self):
+        t = self.table
+        self.assertTrue(t.objects[0] is self.root)
+        self.assertEqual(t.parent[0], -1)
+        self.assertEqual(t.end[0], len(t))
+        for row, obj in enumerate(t.objects):
+            subtree = t.objects[row:t.end[row]]
+            if isinstance(obj, Photo):
+                self.assertEqual(subtree, [obj])
+            self.assertEqual([o for o in subtree if isinstance(o, Photo)],
+                             _photos(obj))
+            self.assertEqual(t.id[row], obj.Id)
+        self.assertEqual(t.row(self.root), 0)
+
+    def test_sum_and_count(self):
+        t = self.table
+        count = t.count()
+        size = t.sum('size')
+        for row, obj in enumerate(t.objects):
+            photos = _photos(obj)
+            self.assertEqual(count[row], len(photos))
+            self.assertEqual(size[row], sum(p.Size for p in photos))
+        self.assertEqual(t.count(t.PHOTOSET)[0],
+                         len(t.rows(t.PHOTOSET)))
+
+    def test_argmax(self):
+        t = self.table
+        best = t.argmax('views')
+        views = t.max('views')
+        for row, obj in enumerate(t.objects):
+            photos = _photos(obj)
+            if not photos:
+                self.assertEqual(best[row], -1)
+                self.assertEqual(views[row], 0)
+                continue
+            top = max(p.Views for p in photos)
+            first = [p for p in photos if p.Views == top][0] # ties: preorder
+            self.assertTrue(t.object(best[row]) is first)
+            self.assertEqual(views[row], top)
+
+    def test_max_dates(self):
+        t = self.table
+        taken = t.max('taken_on')
+        for row, obj in enumerate(t.objects):
+            dates = [p.TakenOn._values[0] for p in _photos(obj)
+                     if p.TakenOn is not None]
+            if dates:
+                self.assertEqual(str(taken[row]).replace('T', ' '),
+                                 max(dates))
+
+    def test_top(self):
+        t = self.table
+        for row, obj in enumerate(t.objects):
+            if isinstance(obj, Photo):
+                continue
+            expected = sorted(_photos(obj), key=lambda p: -p.Views)[:5]
+            self.assertEqual([t.object(r) for r in t.top(row, 'views', 5)],
+                             expected)
+
+if __name__ == '__main__':
+    unittest.main()
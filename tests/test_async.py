@@ -0,0 +1,244 @@
+"""Tests of the futures-based clients: non-blocking and thread pool"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import httplib
+import os
+import socket
+import unittest
+from cStringIO import StringIO
+from time import time
+
+from zenapi import AsyncZenConnection, ThreadPoolZenConnection, LocalMirror
+from zenapi._async import _Response, _Channel
+from zenapi._futures import Future
+from zenapi._zapi import ZenConnection
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+DROPPED = (httplib.HTTPException, socket.error)
+
+class ResponseTest(unittest.TestCase):
+
+    def feed(self, response, data, step=7):
+        done = False
+        for i in range(0, len(data), step):
+            self.assertFalse(done)
+            done = response.feed(data[i:i + step])
+        return done
+
+    def test_content_length(self):
+        r = _Response('GET')
+        self.assertTrue(self.feed(r, 'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n'
+                                     'X-Test: a\r\n\r\nhello'))
+        self.assertEqual((r.status, r.reason, r.body), (200, 'OK', 'hello'))
+        self.assertEqual(r.headers.getheader('x-test'), 'a')
+        self.assertFalse(r.will_close)
+
+    def test_chunked_to_sink(self):
+        sink = StringIO()
+        r = _Response('GET', sink)
+        self.assertTrue(self.feed(r, 'HTTP/1.1 100 Continue\r\n\r\n'
+                                     'HTTP/1.1 200 OK\r\n'
+                                     'Transfer-Encoding: chunked\r\n\r\n'
+                                     '5;x=1\r\nhello\r\n6\r\n world\r\n'
+                                     '0\r\nTrailer: t\r\n\r\n', step=3))
+        self.assertEqual(sink.getvalue(), 'hello world')
+        self.assertEqual((r.body, r.received), (None, 11))
+
+    def test_error_body_not_sunk(self):
+        sink = StringIO()
+        r = _Response('GET', sink)
+        self.assertTrue(self.feed(r, 'HTTP/1.1 404 Not Found\r\n'
+                                     'Content-Length: 4\r\n\r\ngone'))
+        self.assertEqual((r.body, sink.getvalue()), ('gone', ''))
+
+    def test_until_close(self):
+        r = _Response('GET')
+        self.assertFalse(self.feed(r, 'HTTP/1.0 200 OK\r\n\r\nbody'))
+        self.assertTrue(r.will_close)
+        self.assertTrue(r.eof())
+        self.assertEqual(r.body, 'body')
+
+    def test_bad_status(self):
+        self.assertRaises(httplib.BadStatusLine, _Response('GET').feed,
+                          'garbage\r\n\r\n')
+
+class AsyncTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = AsyncZenConnection(username='user', password='secret',
+                                      connections=4)
+        self.zen.AuthenticatePlain().result()
+
+    def tearDown(self):
+        self.zen.close()
+        ServerTestCase.tearDown(self)
+
+    def channels(self):
+        return [c for c in self.zen.transport._map.values()
+                if isinstance(c, _Channel)]
+
+    def test_calls_return_at_once(self):
+        self.server.inject('LoadPhoto', 0.5)
+        t0 = time()
+        f = self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertTrue(isinstance(f, Future))
+        self.assertTrue(time() - t0 < 0.25)
+        self.assertEqual(f.result().Id, FIRST_PHOTO)
+
+    def test_many_in_flight(self):
+        self.server.inject('LoadPhoto', 0.2, times=8)
+        t0 = time()
+        fs = [self.zen.LoadPhoto(FIRST_PHOTO + i) for i in range(8)]
+        self.assertEqual([f.result().Id for f in fs],
+                         range(FIRST_PHOTO, FIRST_PHOTO + 8))
+        # Two rounds of four calls in flight, each round stalled 0.2s
+        self.assertTrue(time() - t0 < 0.8)
+        self.assertEqual(len(self.channels()), 4)
+
+    def test_identical_reads_coalesced(self):
+        self.server.inject('LoadPhoto', 0.2)
+        a, b = self.zen.LoadPhoto(FIRST_PHOTO), self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertTrue(a.result() is b.result())
+        self.assertEqual(self.calls('LoadPhoto'), 1)
+        self.assertEqual(self.zen.coalesced, 1)
+
+    def test_challenge_response(self):
+        self.zen.Authenticate().result()
+        self.assertEqual(self.calls('GetChallenge'), 1)
+        self.assertEqual(self.calls('Authenticate'), 1)
+        self.assertEqual(self.zen.auth, 'fake-token-%i'%self.account.tokens)
+
+    def test_reauthenticates(self):
+        self.server.inject('LoadPhoto', 'E_NOTAUTHENTICATED')
+        self.assertEqual(self.zen.LoadPhoto(FIRST_PHOTO).result().Id,
+                         FIRST_PHOTO)
+        self.assertEqual(self.calls('Authenticate'), 1)
+        self.assertEqual(self.calls('LoadPhoto'), 2)
+
+    def test_transient_error_retried(self):
+        self.server.inject('LoadPhoto', (503, {'Retry-After':'0.05'}))
+        self.assertEqual(self.zen.LoadPhoto(FIRST_PHOTO).result().Id,
+                         FIRST_PHOTO)
+        self.assertEqual(self.calls('LoadPhoto'), 2)
+
+    def test_index_updated(self):
+        index = self.zen.index_hierarchy()
+        root = self.zen.LoadGroupHierarchy().result()
+        group = self.zen.CreateGroup(root).result()
+        self.assertTrue(index.element(group.Id) is group)
+
+    def test_read_resent_after_stale_connection(self):
+        self.zen.LoadPhoto(FIRST_PHOTO).result()
+        self.server.inject('LoadPhoto', 'drop')
+        self.assertEqual(self.zen.LoadPhoto(FIRST_PHOTO + 1).result().Id,
+                         FIRST_PHOTO + 1)
+        self.assertEqual(self.calls('LoadPhoto'), 3)
+
+    def test_mutation_not_resent(self):
+        self.zen.connection.throttle = None
+        self.zen.LoadPhoto(FIRST_PHOTO).result()
+        self.server.inject('CreateGroup', 'drop')
+        self.assertRaises(DROPPED, self.zen.CreateGroup(1).result)
+        self.assertEqual(self.calls('CreateGroup'), 1)
+
+    def test_timeout(self):
+        self.zen.transport.timeout = 0.2
+        self.zen.connection.throttle = None
+        self.server.inject('LoadPhoto', 0.6)
+        self.assertRaises(socket.timeout, self.zen.LoadPhoto(FIRST_PHOTO).result)
+        self.assertEqual(self.calls('LoadPhoto'), 1)
+
+    def test_download_and_upload(self):
+        photo = self.zen.LoadPhoto(FIRST_PHOTO).result()
+        self.assertTrue(self.zen.download(photo, path=self.tmp,
+                                          size=None).result())
+        fp = os.path.join(self.tmp, photo.Title)
+        with open(fp, 'rb') as f:
+            self.assertEqual(f.read(), self.account.image)
+        self.assertEqual(os.listdir(self.tmp), [photo.Title])
+        self.assertFalse(self.zen.download(photo, path=self.tmp, size=None,
+                                           skip_existing=True).result())
+        gallery = self.zen.LoadPhotoSet(FIRST_SET).result()
+        uploaded = self.zen.upload(gallery, fp).result()
+        self.assertTrue(uploaded.Id)
+        self.assertEqual(uploaded.Title, photo.Title)
+        self.assertEqual(self.calls('upload'), 1)
+
+    def test_download_follows_redirects(self):
+        photo = self.zen.LoadPhoto(FIRST_PHOTO).result()
+        photo.OriginalUrl = '%s/redirect/3/img/%i.jpg'%(self.server.url,
+                                                       FIRST_PHOTO)
+        self.assertTrue(self.zen.download(photo, path=self.tmp,
+                                          size=None).result())
+        with open(os.path.join(self.tmp, photo.Title), 'rb') as f:
+            self.assertEqual(f.read(), self.account.image)
+        photo.OriginalUrl = '%s/redirect/9/img/%i.jpg'%(self.server.url,
+                                                       FIRST_PHOTO)
+        f = self.zen.download(photo, path=self.tmp, fn='loop.jpg', size=None)
+        self.assertEqual(f.exception().code, 302)
+        self.assertEqual(os.listdir(self.tmp), [photo.Title])
+
+    def test_failed_download_leaves_nothing(self):
+        photo = self.zen.LoadPhoto(FIRST_PHOTO).result()
+        self.server.inject('GET', 500)
+        f = self.zen.download(photo, path=self.tmp, size=None)
+        self.assertEqual(f.exception().code, 500)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+class ThreadPoolTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = ThreadPoolZenConnection(connection=self.connect(),
+                                           max_workers=32)
+
+    def tearDown(self):
+        self.zen.close()
+        ServerTestCase.tearDown(self)
+
+    def test_calls_are_futures(self):
+        f = self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertTrue(isinstance(f, Future))
+        self.assertEqual(f.result().Id, FIRST_PHOTO)
+
+    def test_local_helpers_are_not(self):
+        self.assertEqual(self.zen.ensure_auth(), 'fake-token-1')
+        index = self.zen.index_hierarchy()
+        self.assertEqual(index.element(1).Title, 'root')
+        mirror = self.zen.mirror(os.path.join(self.tmp, 'mirror.db'))
+        self.assertTrue(isinstance(mirror, LocalMirror))
+        mirror.close()
+
+    def test_save_and_load(self):
+        fn = os.path.join(self.tmp, 'zen.pkl')
+        self.zen.save(fn)
+        zen = ThreadPoolZenConnection.load(fn, max_workers=2)
+        self.assertTrue(isinstance(zen.connection, ZenConnection))
+        zen.close()
+
+    def test_set_limits_keeps_workers_busy(self):
+        throttle = self.zen.set_limits(adaptive=True, initial=4, maximum=8)
+        self.assertTrue(throttle is self.zen.connection.throttle)
+        self.assertEqual(int(throttle.limiter.limit), 32)
+
+if __name__ == '__main__':
+    unittest.main()
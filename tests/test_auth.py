@@ -0,0 +1,139 @@
+"""Tests of the auth token lifecycle"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import json
+import os
+import stat
+import threading
+import time
+import unittest
+
+from zenapi._zapi import ZenConnection, RpcError
+
+from support import ServerTestCase, FIRST_PHOTO
+
+class AuthTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.tokenfile = os.path.join(self.tmp, 'token.json')
+
+    def tearDown(self):
+        self.zen.stop_auth_refresh()
+        ServerTestCase.tearDown(self)
+
+    def logins(self):
+        return self.calls('Authenticate') + self.calls('AuthenticatePlain')
+
+    def test_reauthenticates_once(self):
+        stale = self.zen.auth
+        self.server.inject('LoadPhoto', 'E_NOTAUTHENTICATED')
+        self.assertEqual(self.zen.LoadPhoto(FIRST_PHOTO).Id, FIRST_PHOTO)
+        self.assertNotEqual(self.zen.auth, stale)
+        self.assertEqual(self.calls('Authenticate'), 1)
+        self.assertEqual(self.calls('LoadPhoto'), 2)
+
+    def test_gives_up_after_one_retry(self):
+        self.server.inject('LoadPhoto', 'E_NOTAUTHENTICATED', 2)
+        self.assertRaises(RpcError, self.zen.LoadPhoto, FIRST_PHOTO)
+        self.assertEqual(self.calls('Authenticate'), 1)
+        self.server.inject('LoadPhoto', 'E_NOSUCHOBJECT')
+        self.assertRaises(RpcError, self.zen.LoadPhoto, FIRST_PHOTO)
+        self.assertEqual(self.calls('Authenticate'), 1)
+
+    def test_concurrent_reauthentication_shared(self):
+        self.server.inject('LoadPhoto', 'E_NOTAUTHENTICATED', 4)
+        self.server.inject('GetChallenge', 0.3)
+        photos = []
+        threads = [threading.Thread(
+            target=lambda i=i: photos.append(self.zen.LoadPhoto(FIRST_PHOTO + i)))
+            for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(photos), 4)
+        self.assertEqual(self.calls('Authenticate'), 1)
+
+    def test_ensure_auth(self):
+        token = self.zen.auth
+        self.assertEqual(self.zen.ensure_auth(), token)
+        self.assertEqual(self.logins(), 1)
+        self.zen.auth_expires = time.time() + self.zen.auth_margin - 1
+        self.assertNotEqual(self.zen.ensure_auth(), token)
+        self.assertEqual(self.logins(), 2)
+
+    def test_auto_auth_downloads_reuse_token(self):
+        self.zen.download_group(self.zen.LoadGroupHierarchy(),
+                                path=self.tmp, auto_auth=True)
+        self.assertEqual(self.logins(), 1)
+
+    def test_token_file(self):
+        token = self.zen.keep_authenticated(self.tokenfile, background=False)
+        self.assertEqual(token, self.zen.auth)
+        self.assertEqual(stat.S_IMODE(os.stat(self.tokenfile).st_mode), 0600)
+        # Another process picks up the token without authenticating
+        zen = ZenConnection(username='user', password='secret')
+        self.assertEqual(zen.keep_authenticated(self.tokenfile,
+                                                background=False), token)
+        self.assertEqual(self.logins(), 1)
+        self.assertEqual(zen.LoadPhoto(FIRST_PHOTO).Id, FIRST_PHOTO)
+
+    def test_token_file_not_reused(self):
+        self.zen.keep_authenticated(self.tokenfile, background=False)
+        other = ZenConnection(username='other', password='secret')
+        self.assertNotEqual(other.keep_authenticated(self.tokenfile,
+                                                     background=False),
+                            self.zen.auth)
+        # Expired, and unreadable, files are ignored too
+        with open(self.tokenfile, 'w') as f:
+            json.dump({'username':'user', 'token':'old',
+                       'expires':time.time()}, f)
+        zen = ZenConnection(username='user', password='secret')
+        self.assertNotEqual(zen.keep_authenticated(self.tokenfile,
+                                                   background=False), 'old')
+        with open(self.tokenfile, 'w') as f:
+            f.write('junk')
+        zen = ZenConnection(username='user', password='secret')
+        self.assertTrue(zen.keep_authenticated(self.tokenfile,
+                                               background=False))
+        self.assertEqual(self.logins(), 4)
+
+    def test_background_refresh(self):
+        token = self.zen.keep_authenticated(lifetime=1., margin=0.7)
+        deadline = time.time() + 5
+        while self.zen.auth == token and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertNotEqual(self.zen.auth, token)
+        self.zen.stop_auth_refresh()
+        self.assertEqual(self.zen._refresher, None)
+
+    def test_save_drops_token(self):
+        fn = os.path.join(self.tmp, 'zen.pkl')
+        self.zen.save(fn)
+        self.assertTrue(self.zen.auth is not None)
+        zen = ZenConnection.load(fn)
+        self.assertEqual(zen.auth, None)
+        self.assertTrue(zen.ensure_auth())
+
+if __name__ == '__main__':
+    unittest.main()
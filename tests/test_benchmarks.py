@@ -0,0 +1,125 @@
+"""Smoke tests of the stand-in server and the benchmark suite"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from time import time
+
+from zenapi import _zapi
+from zenapi._zapi import HttpError
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+import fakeserver # on sys.path once support is imported
+import run
+
+class AccountTest(unittest.TestCase):
+
+    def test_hierarchy(self):
+        account = fakeserver.Account(groups=3, sets=4, photos=5,
+                                     image_bytes=10)
+        root = account.call('LoadGroupHierarchy', [])
+        self.assertEqual([g['Title'] for g in root['Elements']],
+                         ['group 0', 'group 1', 'group 2'])
+        sets = [ps['Id'] for g in root['Elements'] for ps in g['Elements']]
+        self.assertEqual(sets, range(FIRST_SET, FIRST_SET + 12))
+        ps = account.call('LoadPhotoSet', [FIRST_SET + 5, 'Level1', True])
+        self.assertEqual([p['Id'] for p in ps['Photos']],
+                         range(FIRST_PHOTO + 25, FIRST_PHOTO + 30))
+        self.assertEqual(len(account.image), 10)
+
+    def test_unknown_objects(self):
+        account = fakeserver.Account(groups=1, sets=1, photos=1)
+        self.assertRaises(fakeserver.RpcFault, account.call, 'LoadPhotoSet',
+                          [FIRST_SET + 1])
+        self.assertRaises(fakeserver.RpcFault, account.call, 'NoSuchMethod',
+                          [])
+
+class FakeServerTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.zen.throttle = None
+
+    def test_latency(self):
+        self.server.latency = 0.2
+        t0 = time()
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertTrue(time() - t0 >= 0.2)
+
+    def test_error_rate(self):
+        self.server.error_rate = 1.
+        try:
+            self.zen.LoadPhoto(FIRST_PHOTO)
+        except HttpError, e:
+            self.assertEqual(e.code, 503)
+        else:
+            self.fail('no error')
+
+    def test_image(self):
+        resp = _zapi.OpenUrl(self.server.url + '/img/%i.jpg'%FIRST_PHOTO)
+        self.assertEqual(resp.read(), self.account.image)
+
+class BenchmarkRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self._urls = _zapi.API_URL, _zapi.API_SSL_URL
+        self._stdout = sys.stdout
+        sys.stdout = StringIO()
+        fd, self.out = tempfile.mkstemp(prefix='zenapi-bench-',
+                                        suffix='.json')
+        os.close(fd)
+
+    def tearDown(self):
+        sys.stdout = self._stdout
+        _zapi.API_URL, _zapi.API_SSL_URL = self._urls
+        _zapi.build_pool()
+        os.remove(self.out)
+
+    def test_all(self):
+        results = run.main(['--groups', '1', '--sets', '2', '--photos', '5',
+                            '--image-bytes', '2000', '--calls', '20',
+                            '--workers', '2', '--uploads', '3',
+                            '--memory-photos', '1000', '--json', self.out])
+        self.assertEqual(sorted(results), sorted(n for n, _ in run.BENCHMARKS))
+        self.assertTrue(results['calls']['serial_calls_per_sec'] > 0)
+        self.assertTrue(results['hierarchy']['photoset']['bytes'] > 0)
+        self.assertTrue(results['memory']['bytes_per_photo'] > 0)
+        self.assertEqual(results['download']['photos'], 5)
+        self.assertEqual(results['download']['bytes'], 5*2000)
+        self.assertEqual(results['upload']['bytes'], 3*2000)
+        with open(self.out) as f:
+            self.assertEqual(sorted(json.load(f)), sorted(results))
+        self.assertTrue('calls/s' in sys.stdout.getvalue())
+
+    def test_unknown_benchmark(self):
+        sys.stderr, stderr = StringIO(), sys.stderr
+        try:
+            self.assertRaises(SystemExit, run.main, ['nosuch'])
+        finally:
+            sys.stderr = stderr
+
+if __name__ == '__main__':
+    unittest.main()
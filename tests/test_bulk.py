@@ -0,0 +1,119 @@
+"""Tests of bulk metadata updates"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import json
+import os
+import unittest
+
+from zenapi._bulk import UpdateCheckpoint
+from zenapi._zapi import (AccessUpdater, PhotoUpdater, PhotoSetUpdater,
+                          RpcError)
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+class BulkUpdateTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.log = os.path.join(self.tmp, 'updates.log')
+        self.ids = range(FIRST_PHOTO, FIRST_PHOTO + 6)
+
+    def keyword(self, word='x', ids=None):
+        return [(i, PhotoUpdater(Keywords=[word])) for i in ids or self.ids]
+
+    def test_update_many(self):
+        seen = []
+        report = self.zen.update_many(
+            self.keyword() + [(FIRST_SET, PhotoSetUpdater(Caption='c'))],
+            workers=3, progress=seen.append)
+        self.assertEqual(len(report.updated), 7)
+        self.assertEqual([r.id for r in report], self.ids + [FIRST_SET])
+        self.assertEqual(sorted(r.id for r in seen),
+                         sorted(self.ids + [FIRST_SET]))
+        self.assertEqual(report.results[-1].method, 'UpdatePhotoSet')
+        self.assertEqual(report.results[0].result.Keywords, ['x'])
+        self.assertEqual(self.account.edits[FIRST_PHOTO], {'Keywords':['x']})
+        self.assertEqual(self.calls('UpdatePhoto'), 6)
+
+    def test_failures_reported(self):
+        self.server.inject('UpdatePhoto', 'E_NOSUCHOBJECT')
+        items = self.keyword() + ['junk', (FIRST_PHOTO, object())]
+        report = self.zen.update_many(items, workers=1)
+        self.assertEqual([r.status for r in report],
+                         ['failed'] + ['updated']*5 + ['failed']*2)
+        self.assertTrue(isinstance(report.failed[0].error, RpcError))
+        self.assertEqual(report.failed[1].id, 'junk')
+        self.assertEqual(len(report.succeeded), 5)
+        self.assertTrue('5 updated' in repr(report))
+        self.assertTrue('3 failed' in repr(report))
+
+    def test_snapshot_changes(self):
+        photos = [self.zen.LoadPhoto(i) for i in self.ids[:3]]
+        photos[0].Title = 'new.jpg'
+        photos[2].Caption = 'c'
+        report = self.zen.update_many([(p, None) for p in photos])
+        self.assertEqual([r.status for r in report],
+                         ['updated', 'unchanged', 'updated'])
+        self.assertEqual(photos[0].changes(), {})
+        self.assertEqual(self.account.edits[self.ids[0]], {'Title':'new.jpg'})
+        self.assertEqual(self.calls('UpdatePhoto'), 2)
+
+    def test_access_updates(self):
+        photo = self.zen.LoadPhoto(FIRST_PHOTO)
+        access = AccessUpdater(AccessType='Private')
+        report = self.zen.update_many([(photo, access),
+                                       (FIRST_PHOTO, access)])
+        self.assertEqual([r.status for r in report], ['updated', 'failed'])
+        self.assertEqual(report.results[0].method, 'UpdatePhotoAccess')
+        self.assertTrue(isinstance(report.results[1].error, TypeError))
+
+    def test_checkpoint_resume(self):
+        self.server.inject('UpdatePhoto', 'E_NOSUCHOBJECT')
+        report = self.zen.update_many(self.keyword(), workers=1,
+                                      checkpoint=self.log)
+        self.assertEqual(len(report.failed), 1)
+        # A rerun only makes the update which failed
+        report = self.zen.update_many(self.keyword(), checkpoint=self.log)
+        self.assertEqual([r.status for r in report],
+                         ['updated'] + ['skipped']*5)
+        self.assertEqual(self.calls('UpdatePhoto'), 7)
+        # Different fields are a different update
+        report = self.zen.update_many(self.keyword('y'), checkpoint=self.log)
+        self.assertEqual(len(report.updated), 6)
+
+    def test_checkpoint_cut_short(self):
+        self.zen.update_many(self.keyword(ids=self.ids[:2]),
+                             checkpoint=self.log)
+        with open(self.log, 'ab') as f:
+            f.write('{"method": "UpdatePhoto", "id"')
+        checkpoint = UpdateCheckpoint(self.log)
+        checkpoint.close()
+        self.assertEqual(len(checkpoint.done), 2)
+        key = ('UpdatePhoto', self.ids[0],
+               UpdateCheckpoint.fingerprint(PhotoUpdater(Keywords=['x'])))
+        self.assertTrue(key in checkpoint)
+        with open(self.log) as f:
+            self.assertEqual(json.loads(f.readline())['method'],
+                             'UpdatePhoto')
+
+if __name__ == '__main__':
+    unittest.main()
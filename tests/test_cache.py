@@ -0,0 +1,162 @@
+"""Tests of the response cache for read-only calls"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import unittest
+
+from zenapi._cache import ResponseCache
+from zenapi._zapi import InformationLevel
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(ttl=60, maxsize=3)
+        self.sent = []
+
+    def fn(self, method, params=None, auth=None):
+        self.sent.append((method, params))
+        if method == 'LoadPhotoSet':
+            return {'Id':params[0], 'Photos':[{'Id':params[0]*10}]}
+        return {'Id':params[0]}
+
+    def call(self, method, *params):
+        return self.cache.call(self.fn, method, params=list(params),
+                               auth='token')
+
+    def test_hit(self):
+        self.assertEqual(self.call('LoadPhoto', 1), {'Id':1})
+        self.assertEqual(self.call('LoadPhoto', 1), {'Id':1})
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_key_includes_auth_and_level(self):
+        self.call('LoadPhoto', 1, 'Level1')
+        self.call('LoadPhoto', 1, 'Level2')
+        self.cache.call(self.fn, 'LoadPhoto', params=[1, 'Level1'],
+                        auth='other')
+        self.assertEqual(len(self.sent), 3)
+
+    def test_expiry(self):
+        self.cache.ttl = 0.05
+        self.call('LoadPhoto', 1)
+        time.sleep(0.1)
+        self.call('LoadPhoto', 1)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_lru_eviction(self):
+        for i in (1, 2, 3):
+            self.call('LoadPhoto', i)
+        self.call('LoadPhoto', 1)
+        self.call('LoadPhoto', 4)
+        self.assertEqual(len(self.cache), 3)
+        self.call('LoadPhoto', 1)
+        self.call('LoadPhoto', 2)
+        self.assertEqual([p[0] for m, p in self.sent], [1, 2, 3, 4, 2])
+
+    def test_mutation_invalidates(self):
+        self.call('LoadPhotoSet', 5)
+        self.call('LoadPhoto', 7)
+        self.call('UpdatePhoto', 50, {})
+        self.call('LoadPhotoSet', 5)
+        self.call('LoadPhoto', 7)
+        self.assertEqual([m for m, p in self.sent],
+                         ['LoadPhotoSet', 'LoadPhoto', 'UpdatePhoto',
+                          'LoadPhotoSet'])
+
+    def test_invalidation_one_hop_further(self):
+        self.cache.maxsize = 10
+        self.call('LoadPhotoSet', 5, True)
+        self.call('LoadPhotoSet', 5, False)
+        self.call('LoadPhoto', 6)
+        # Photo 50 only appears in the first entry, which is about set 5
+        self.cache.invalidate([50])
+        self.assertEqual(len(self.cache), 1)
+
+    def test_neutral_calls_keep_entries(self):
+        self.call('LoadPhoto', 1)
+        self.call('SearchPhotoByText', 1)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_failed_mutation_still_invalidates(self):
+        self.call('LoadPhoto', 1)
+        def fail(method, params=None, auth=None):
+            raise IOError('lost')
+        self.assertRaises(IOError, self.cache.call, fail, 'DeletePhoto',
+                          params=[1], auth='token')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_stale_result_not_stored(self):
+        def racing(method, params=None, auth=None):
+            # A mutation lands while this read is in flight
+            self.cache.invalidate([1])
+            return {'Id':1}
+        self.cache.call(racing, 'LoadPhoto', params=[1], auth='token')
+        self.assertEqual(len(self.cache), 0)
+
+class ConnectionCacheTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.zen.enable_cache()
+
+    def test_repeated_loads(self):
+        a = self.zen.LoadPhotoSet(FIRST_SET, includePhotos=True)
+        b = self.zen.LoadPhotoSet(FIRST_SET, includePhotos=True)
+        self.assertEqual(self.calls('LoadPhotoSet'), 1)
+        self.assertFalse(a is b)
+        self.assertEqual(a.Photos[0].Id, b.Photos[0].Id)
+        self.zen.LoadPhotoSet(FIRST_SET, level=InformationLevel.Level2,
+                              includePhotos=True)
+        self.assertEqual(self.calls('LoadPhotoSet'), 2)
+
+    def test_update_invalidates(self):
+        self.zen.LoadPhotoSet(FIRST_SET, includePhotos=True)
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        photo = self.zen.LoadPhoto(FIRST_PHOTO)
+        photo.Title = 'new'
+        self.zen.save_changes(photo)
+        self.assertEqual(self.zen.LoadPhoto(FIRST_PHOTO).Title, 'new')
+        ps = self.zen.LoadPhotoSet(FIRST_SET, includePhotos=True)
+        self.assertEqual(ps.Photos[0].Title, 'new')
+        self.assertEqual(self.calls('LoadPhoto'), 2)
+        self.assertEqual(self.calls('LoadPhotoSet'), 2)
+
+    def test_upload_invalidates_gallery(self):
+        ps = self.zen.LoadPhotoSet(FIRST_SET)
+        fp = os.path.join(self.tmp, 'a.jpg')
+        with open(fp, 'wb') as f:
+            f.write('x')
+        self.zen._uploadfile(ps, fp)
+        self.zen.LoadPhotoSet(FIRST_SET)
+        self.assertEqual(self.calls('LoadPhotoSet'), 2)
+
+    def test_disable(self):
+        self.zen.disable_cache()
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertEqual(self.calls('LoadPhoto'), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Tests of changed-field tracking and minimal updates"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+
+from zenapi._zapi import (Photo, PhotoSet, Group, DateTime, PhotoUpdater,
+                          PhotoSetUpdater, GroupUpdater)
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+def _photo():
+    return Photo._fromjson({'Id':5, 'Title':'a.jpg', 'Caption':'c',
+                            'Keywords':['x'], 'Views':3})
+
+class ChangeTrackingTest(unittest.TestCase):
+
+    def test_unchanged(self):
+        p = _photo()
+        self.assertEqual(p.changes(), {})
+        self.assertEqual(getattr(p, '_dirty', None), None)
+        self.assertEqual(p.updater(), None)
+
+    def test_assignments(self):
+        p = _photo()
+        p.Title = 'b.jpg'
+        p.Title = 'c.jpg'
+        p.Copyright = 'me'
+        self.assertEqual(p.changes(), {'Title':('a.jpg', 'c.jpg'),
+                                       'Copyright':(None, 'me')})
+        # Setting a field back to its original value undoes the change
+        p.Title = 'a.jpg'
+        self.assertEqual(p.changes(), {'Copyright':(None, 'me')})
+
+    def test_update(self):
+        p = _photo()
+        p.update({'Caption':'d', 'Views':3})
+        self.assertEqual(p.changes(), {'Caption':('c', 'd')})
+
+    def test_mark_changed(self):
+        p = _photo()
+        p.Keywords.append('y')
+        self.assertEqual(p.changes(), {})
+        p.mark_changed('Keywords')
+        self.assertEqual(p.changes(), {'Keywords':(None, ['x', 'y'])})
+        self.assertRaises(KeyError, p.mark_changed, 'NoSuchField')
+
+    def test_clear_changes(self):
+        p = _photo()
+        p.Title, p.Caption = 'b.jpg', 'd'
+        p.clear_changes('Title')
+        self.assertEqual(list(p.changes()), ['Caption'])
+        p.clear_changes()
+        self.assertEqual(p.changes(), {})
+        p.clear_changes()
+
+    def test_updater(self):
+        p = _photo()
+        p.Title, p.Views = 'b.jpg', 4
+        u = p.updater()
+        self.assertEqual(type(u), PhotoUpdater)
+        self.assertEqual(u.asdict(), {'$type':'PhotoUpdater',
+                                      'Title':'b.jpg'})
+        # Only fields the updater carries, and never None
+        p = _photo()
+        p.Views, p.Caption = 4, None
+        self.assertEqual(p.updater(), None)
+
+    def test_updater_types(self):
+        ps = PhotoSet._fromjson({'Id':1})
+        ps.Keywords = ['k']
+        self.assertEqual(type(ps.updater()), PhotoSetUpdater)
+        g = Group._fromjson({'Id':1})
+        g.Caption = 'c'
+        self.assertEqual(g.updater().asdict(),
+                         {'$type':'GroupUpdater', 'Caption':'c'})
+        self.assertRaises(TypeError, DateTime._fromjson({}).updater)
+
+class SaveChangesTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+
+    def test_nothing_to_save(self):
+        photo = self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertTrue(self.zen.save_changes(photo) is photo)
+        photo.Views = 1000
+        self.assertTrue(self.zen.save_changes(photo) is photo)
+        self.assertEqual(self.calls('UpdatePhoto'), 0)
+
+    def test_sends_only_changes(self):
+        photo = self.zen.LoadPhoto(FIRST_PHOTO)
+        photo.Title = 'new.jpg'
+        result = self.zen.save_changes(photo)
+        self.assertEqual(result.Title, 'new.jpg')
+        self.assertEqual(self.calls('UpdatePhoto'), 1)
+        self.assertEqual(self.account.edits[FIRST_PHOTO],
+                         {'Title':'new.jpg'})
+        self.assertEqual(photo.changes(), {})
+        self.zen.save_changes(photo)
+        self.assertEqual(self.calls('UpdatePhoto'), 1)
+
+    def test_photoset_and_group(self):
+        ps = self.zen.LoadPhotoSet(FIRST_SET)
+        ps.Keywords = ['a', 'b']
+        self.zen.save_changes(ps)
+        self.assertEqual(self.account.edits[FIRST_SET],
+                         {'Keywords':['a', 'b']})
+        group = self.zen.LoadGroup(2)
+        group.Caption = 'c'
+        self.assertEqual(self.zen.save_changes(group).Caption, 'c')
+        self.assertEqual(self.account.edits[2], {'Caption':'c'})
+        self.assertEqual((self.calls('UpdatePhotoSet'),
+                          self.calls('UpdateGroup')), (1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""Tests of response decoding"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+
+from zenapi import _codec
+from zenapi._codec import Codec, CountingReader, use_codec, get_codec
+from zenapi._zapi import (ResponseObject, DecodeHook, DateTime, Photo,
+                          PhotoSet)
+
+from support import ServerTestCase, FIRST_SET
+
+PAYLOAD = json.dumps(
+    {'$type':'PhotoSet', 'Id':1, 'Title':'set', 'Keywords':['a', 'b'],
+     'Photos':[{'$type':'Photo', 'Id':100 + i, 'Title':'p%i.jpg'%i,
+                'UploadedOn':{'$type':'DateTime',
+                              'Value':'2009-06-0%i 12:30:00'%(i + 1)}}
+               for i in range(3)],
+     'Other':{'$type':'NotAType', 'x':1}})
+
+class DecodeHookTest(unittest.TestCase):
+
+    def test_snapshots_in_one_pass(self):
+        ps = json.loads(PAYLOAD, object_hook=DecodeHook)
+        self.assertEqual(type(ps), PhotoSet)
+        self.assertEqual(type(ps.Photos), list)
+        self.assertEqual([type(p) for p in ps.Photos], [Photo]*3)
+        self.assertEqual(type(ps.Photos[0].UploadedOn), DateTime)
+        self.assertEqual(ps.Photos[0].UploadedOn.Value,
+                         datetime(2009, 6, 1, 12, 30))
+        self.assertEqual(ps.Keywords, ['a', 'b'])
+        self.assertEqual(ps.changes(), {})
+
+    def test_unknown_types_stay_dicts(self):
+        ps = json.loads(PAYLOAD, object_hook=DecodeHook)
+        self.assertEqual(ps._dict['Other'], {'$type':'NotAType', 'x':1})
+        self.assertEqual(json.loads('{"a": {"b": 1}}', object_hook=DecodeHook),
+                         {'a':{'b':1}})
+
+    def test_same_as_build(self):
+        hooked = json.loads(PAYLOAD, object_hook=DecodeHook)
+        built = ResponseObject.build(json.loads(PAYLOAD))
+        self.assertEqual(hooked.asdict(), built.asdict())
+        self.assertEqual(hooked.asdict(), json.loads(PAYLOAD))
+
+class CodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = get_codec()
+
+    def tearDown(self):
+        _codec.codec = self.codec
+
+    def test_default_is_not_ujson(self):
+        codec = Codec()
+        self.assertEqual(codec.name,
+                         'simplejson' if Codec.available('simplejson')
+                         else 'json')
+        self.assertEqual(get_codec().name, codec.name)
+
+    def test_use_codec(self):
+        codec = use_codec('json')
+        self.assertTrue(get_codec() is codec is _codec.codec)
+        self.assertEqual((codec.name, codec.stream), ('json', False))
+        self.assertEqual(codec.loads(codec.dumps({'a':[1, 2.5, None]})),
+                         {'a':[1, 2.5, None]})
+
+    def test_missing_library(self):
+        for name in ('ujson', 'simplejson'):
+            if not Codec.available(name):
+                self.assertRaises(ImportError, Codec, name)
+        self.assertRaises(ImportError, Codec, 'nosuchjson')
+
+    def test_ujson_hooks_while_parsing(self):
+        if not Codec.available('ujson'):
+            raise unittest.SkipTest('ujson is not installed')
+        codec = Codec('ujson')
+        self.assertTrue(codec.hooked is not codec.module)
+        ps = codec.loads(PAYLOAD, object_hook=DecodeHook)
+        self.assertEqual(type(ps.Photos[0]), Photo)
+        self.assertEqual(ps.asdict(), json.loads(PAYLOAD))
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        if not Codec.available('ijson'):
+            raise unittest.SkipTest('ijson is not installed')
+        self.codec = Codec('json', stream=True)
+
+    def test_stream_flag(self):
+        self.assertTrue(self.codec.stream)
+        self.assertEqual(repr(self.codec), '<Codec json, streaming>')
+        self.assertFalse(Codec('json').stream)
+
+    def test_same_as_loads(self):
+        for doc in ('{"a": [1, 2.5, -3e2, true, false, null, "x\\u00e9"],'
+                    ' "b": {}, "c": []}', '[]', '"s"', '7'):
+            self.assertEqual(self.codec.load(StringIO(doc)), json.loads(doc))
+        self.assertEqual(type(self.codec.load(StringIO('2.5'))), float)
+
+    def test_object_hook(self):
+        ps = self.codec.load(StringIO(PAYLOAD), DecodeHook)
+        self.assertEqual(type(ps), PhotoSet)
+        self.assertEqual([type(p) for p in ps.Photos], [Photo]*3)
+        self.assertEqual(ps.asdict(), json.loads(PAYLOAD))
+
+    def test_counts_bytes(self):
+        reader = CountingReader(StringIO(PAYLOAD))
+        self.codec.load(reader)
+        self.assertEqual(reader.count, len(PAYLOAD))
+
+    def test_one_document(self):
+        self.assertRaises(Exception, self.codec.load, StringIO(''))
+        self.assertRaises(Exception, self.codec.load, StringIO('{"a": '))
+
+class DecodeTest(ServerTestCase):
+
+    def test_calls_return_snapshots(self):
+        zen = self.connect()
+        ps = zen.LoadPhotoSet(FIRST_SET, includePhotos=True)
+        self.assertEqual(type(ps), PhotoSet)
+        self.assertEqual(len(ps.Photos), self.photos)
+        self.assertEqual(type(ps.Photos[0]), Photo)
+        self.assertEqual(type(ps.CreatedOn), DateTime)
+
+    def test_streamed_calls(self):
+        if not Codec.available('ijson'):
+            raise unittest.SkipTest('ijson is not installed')
+        codec = get_codec()
+        use_codec(stream=True)
+        try:
+            zen = self.connect()
+            ps = zen.LoadPhotoSet(FIRST_SET, includePhotos=True)
+        finally:
+            _codec.codec = codec
+        self.assertEqual(type(ps), PhotoSet)
+        self.assertEqual([p.Id for p in ps.Photos],
+                         [p.Id for p in zen.LoadPhotoSet(
+                             FIRST_SET, includePhotos=True).Photos])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Tests of lazily parsed DateTime fields"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from datetime import datetime
+
+from zenapi._zapi import DateTime, Photo, _datestr
+
+class DateTimeTest(unittest.TestCase):
+
+    def test_raw_string_kept(self):
+        d = DateTime._fromjson({'Value':'2009-06-01 12:30:00'})
+        self.assertEqual(d.asdict(), {'$type':'DateTime',
+                                      'Value':'2009-06-01 12:30:00'})
+        self.assertTrue(isinstance(d._values[0], basestring))
+
+    def test_parsed_on_read(self):
+        d = DateTime._fromjson({'Value':'2009-06-01 12:30:00'})
+        self.assertEqual(d.Value, datetime(2009, 6, 1, 12, 30))
+        self.assertTrue(d.Value is d.Value) # parsed once
+        self.assertEqual(d.asdict()['Value'], '2009-06-01 12:30:00')
+
+    def test_set_value(self):
+        d = DateTime._fromjson({'Value':'2009-06-01 12:30:00'})
+        d.Value = datetime(2010, 2, 3, 4, 5, 6)
+        self.assertEqual(d.asdict()['Value'], '2010-02-03 04:05:06')
+
+    def test_in_snapshot(self):
+        p = Photo._fromjson({'Id':1, 'TakenOn':DateTime._fromjson(
+            {'Value':'2009-06-01 12:30:00'})})
+        self.assertEqual(_datestr(p.TakenOn), '2009-06-01 12:30:00')
+        self.assertTrue(isinstance(p.TakenOn._values[0], basestring))
+        self.assertEqual(_datestr(p.UploadedOn), None)
+
+    def test_str2d(self):
+        self.assertEqual(DateTime.str2d('2009-12-31 23:59:58'),
+                         datetime(2009, 12, 31, 23, 59, 58))
+        self.assertEqual(DateTime.d2str(datetime(2009, 1, 2, 3, 4, 5)),
+                         '2009-01-02 03:04:05')
+
+    def test_str2d_rejects_bad_dates(self):
+        for s in ('2009-13-01 00:00:00', '2009-06-01T12:30:00',
+                  '2009-06-01', 'junk'):
+            self.assertRaises(ValueError, DateTime.str2d, s)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Tests of coalesced and batched loads"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import threading
+import time
+import unittest
+
+from zenapi._futures import SingleFlight
+from zenapi._zapi import RpcError, Photo, PhotoSet
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+class SingleFlightTest(unittest.TestCase):
+
+    def run_together(self, flights, n, fn, key='k'):
+        start = threading.Event()
+        results = []
+        def call():
+            start.wait()
+            try:
+                results.append(flights.do(key, fn))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=call) for i in range(n)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_shared_result(self):
+        flights = SingleFlight()
+        calls = []
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return object()
+        results = self.run_together(flights, 5, fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.coalesced, 4)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_shared_exception(self):
+        flights = SingleFlight()
+        def fn():
+            time.sleep(0.2)
+            raise ValueError('bad')
+        results = self.run_together(flights, 3, fn)
+        self.assertEqual([type(r) for r in results], [ValueError]*3)
+        self.assertEqual(flights.coalesced, 2)
+        self.assertEqual(flights._calls, {})
+
+    def test_calls_again_once_finished(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do('k', lambda: 1), 1)
+        self.assertEqual(flights.do('k', lambda: 2), 2)
+        self.assertEqual(flights.do('j', lambda x: x, 3), 3)
+        self.assertEqual(flights.coalesced, 0)
+
+class LoadManyTest(ServerTestCase):
+
+    def test_load_photos(self):
+        zen = self.connect()
+        ids = [FIRST_PHOTO + 3, FIRST_PHOTO, FIRST_PHOTO + 3, FIRST_PHOTO + 1]
+        photos = zen.load_photos([zen.LoadPhoto(ids[0])] + ids[1:], workers=2)
+        self.assertEqual([type(p) for p in photos], [Photo]*4)
+        self.assertEqual([p.Id for p in photos], ids)
+        # The repeated Id was loaded once
+        self.assertEqual(self.calls('LoadPhoto'), 4)
+
+    def test_load_photosets(self):
+        zen = self.connect()
+        ids = [FIRST_SET + 2, FIRST_SET, FIRST_SET + 2]
+        sets = zen.load_photosets(ids, includePhotos=True)
+        self.assertEqual([type(ps) for ps in sets], [PhotoSet]*3)
+        self.assertEqual([ps.Id for ps in sets], ids)
+        self.assertEqual(len(sets[1].Photos), self.photos)
+        self.assertEqual(self.calls('LoadPhotoSet'), 2)
+
+    def test_errors_per_id(self):
+        zen = self.connect()
+        self.server.inject('LoadPhoto', 'E_NOSUCHOBJECT')
+        ids = [FIRST_PHOTO, FIRST_PHOTO + 1, FIRST_PHOTO]
+        photos = zen.load_photos(ids, workers=1)
+        self.assertTrue(isinstance(photos[0], RpcError))
+        self.assertEqual(photos[0].code, 'E_NOSUCHOBJECT')
+        self.assertTrue(photos[2] is photos[0])
+        self.assertEqual(photos[1].Id, FIRST_PHOTO + 1)
+
+    def test_concurrent_loads_coalesced(self):
+        zen = self.connect()
+        self.server.inject('LoadPhoto', 0.5)
+        results = []
+        def load():
+            results.append(zen.LoadPhoto(FIRST_PHOTO))
+        threads = [threading.Thread(target=load) for i in range(3)]
+        for t in threads:
+            t.start()
+            time.sleep(0.05)
+        for t in threads:
+            t.join()
+        self.assertEqual([p.Id for p in results], [FIRST_PHOTO]*3)
+        self.assertEqual(self.calls('LoadPhoto'), 1)
+        self.assertEqual(zen.flights.coalesced, 2)
+
+    def test_writes_not_coalesced(self):
+        zen = self.connect()
+        self.assertEqual(zen.load_photos([]), [])
+        zen.CreateGroup(1)
+        zen.CreateGroup(1)
+        self.assertEqual(self.calls('CreateGroup'), 2)
+        self.assertEqual(zen.flights.coalesced, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Tests of loading the full group hierarchy"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import threading
+import time
+import unittest
+
+from zenapi._zapi import ResponseObject, Group
+
+from support import ServerTestCase, FIRST_SET
+
+def _photosets(group):
+    for e in group.Elements or ():
+        if isinstance(e, Group):
+            for ps in _photosets(e):
+                yield ps
+        else:
+            yield e
+
+class FullHierarchyTest(ServerTestCase):
+    groups, sets, photos = 2, 3, 4
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.nsets = self.groups*self.sets
+
+    def test_loads_everything(self):
+        root = self.zen.loadFullGroupHierarchy(workers=4)
+        sets = list(_photosets(root))
+        self.assertEqual(len(sets), self.nsets)
+        self.assertEqual([len(ps.Photos) for ps in sets],
+                         [self.photos]*self.nsets)
+        self.assertEqual(sets[0].Photos[0].Gallery, sets[0].Id)
+        self.assertTrue(all(ps.changes() == {} for ps in sets))
+        self.assertEqual(self.calls('LoadGroupHierarchy'), 1)
+        self.assertEqual(self.calls('LoadPhotoSet'), self.nsets)
+
+    def test_callback_streams_photosets(self):
+        seen = []
+        root = self.zen.loadFullGroupHierarchy(
+            callback=lambda ps: seen.append((ps, len(ps.Photos),
+                                             threading.current_thread())))
+        self.assertEqual(len(seen), self.nsets)
+        self.assertEqual(sorted(ps.Id for ps, n, t in seen),
+                         [ps.Id for ps in _photosets(root)])
+        # In place, in the calling thread, with the photos attached
+        self.assertTrue(all(n == self.photos and
+                            t is threading.current_thread()
+                            for ps, n, t in seen))
+        self.assertTrue(seen[0][0] in list(_photosets(root)))
+
+    def test_filter(self):
+        root = self.zen.loadFullGroupHierarchy(
+            filter=lambda e: e.Title not in ('group 1', 'set 0'))
+        loaded = [ps.Title for ps in _photosets(root) if ps.Photos is not None]
+        self.assertEqual(loaded, ['set 1', 'set 2'])
+        self.assertEqual(self.calls('LoadPhotoSet'), 2)
+
+    def test_failures_completed_later(self):
+        self.server.inject('LoadPhotoSet', 'E_NOSUCHOBJECT')
+        root = self.zen.loadFullGroupHierarchy(workers=1)
+        missing = [ps for ps in _photosets(root) if ps.Photos is None]
+        self.assertEqual([ps.Id for ps in missing], [FIRST_SET])
+        # Passing the tree back loads just what is missing
+        self.assertTrue(self.zen.loadFullGroupHierarchy(root=root) is root)
+        self.assertEqual(len(root.Elements[0].Elements[0].Photos),
+                         self.photos)
+        self.assertEqual(self.calls('LoadPhotoSet'), self.nsets + 1)
+        self.assertEqual(self.calls('LoadGroupHierarchy'), 1)
+
+    def test_breadth_first(self):
+        # A photoset at the top, after the groups, is still loaded first
+        tree = self.account.call('LoadGroupHierarchy', [])
+        tree['Elements'].append(self.account.photoset(FIRST_SET))
+        root = ResponseObject.build(tree)
+        seen = []
+        self.zen.loadFullGroupHierarchy(workers=1, root=root,
+                                        callback=seen.append)
+        self.assertTrue(seen[0] is root.Elements[-1])
+        self.assertEqual(len(seen), self.nsets + 1)
+
+    def test_workers_bound_calls_in_flight(self):
+        self.server.inject('LoadPhotoSet', 0.2, self.nsets)
+        t0 = time.time()
+        self.zen.loadFullGroupHierarchy(workers=2)
+        self.assertTrue(time.time() - t0 >= 0.2*self.nsets/2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Tests of the in-memory hierarchy index"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from zenapi._index import HierarchyIndex
+from zenapi._zapi import ResponseObject, Group, PhotoSet, Photo
+
+from support import ServerTestCase, FIRST_SET
+
+def _photo(id, title, filename=None):
+    return {'$type':'Photo', 'Id':id, 'Title':title,
+            'FileName':filename or title}
+
+def _tree():
+    """root/Clients/{Smith, Smith, Jones} plus root/Misc, where the two
+    Smith photosets share a title"""
+    return ResponseObject.build(
+        {'$type':'Group', 'Id':1, 'Title':'root', 'Elements':[
+            {'$type':'Group', 'Id':2, 'Title':'Clients', 'Elements':[
+                {'$type':'PhotoSet', 'Id':10, 'Title':'Smith', 'Photos':[
+                    _photo(100, 'a.jpg'), _photo(101, 'b.jpg')]},
+                {'$type':'PhotoSet', 'Id':11, 'Title':'Smith', 'Photos':[
+                    _photo(102, 'a.jpg', 'other.jpg')]},
+                {'$type':'PhotoSet', 'Id':12, 'Title':'Jones', 'Photos':[
+                    _photo(100, 'a.jpg')]}]},
+            {'$type':'PhotoSet', 'Id':13, 'Title':'Misc', 'Photos':[]}]})
+
+class HierarchyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = _tree()
+        self.index = HierarchyIndex(self.root)
+
+    def test_lookups(self):
+        self.assertEqual(len(self.index), 9)
+        self.assertEqual(self.index.element(2).Title, 'Clients')
+        self.assertEqual(self.index.byPath('Clients/Jones').Id, 12)
+        self.assertEqual(self.index.byPath('/Clients/Jones/a.jpg/').Id, 100)
+        self.assertEqual(self.index.byPath('Nowhere'), None)
+        self.assertEqual([p.Id for p in self.index.byFileName('a.jpg')],
+                         [100])
+        self.assertEqual(self.index.parent(12).Id, 2)
+        self.assertEqual([ps.Id for ps in self.index.photosets(100)],
+                         [10, 12])
+        self.assertEqual(self.index.path(self.index.photo(100), 12),
+                         'Clients/Jones/a.jpg')
+
+    def test_same_title_siblings(self):
+        self.assertEqual(self.index.byPath('Clients/Smith').Id, 10)
+        self.assertEqual(self.index.byPath('Clients/Smith/a.jpg').Id, 100)
+        self.index.remove(10)
+        self.assertEqual(self.index.byPath('Clients/Smith').Id, 11)
+        self.assertEqual(self.index.byPath('Clients/Smith/a.jpg').Id, 102)
+        self.index.remove(11)
+        self.assertEqual(self.index.byPath('Clients/Smith'), None)
+        self.assertEqual(self.index.byPath('Clients/Smith/a.jpg'), None)
+
+    def test_removing_second_sibling_keeps_first(self):
+        self.index.remove(11)
+        self.assertEqual(self.index.byPath('Clients/Smith').Id, 10)
+        self.assertEqual(self.index.byPath('Clients/Smith/a.jpg').Id, 100)
+
+    def test_remove_group(self):
+        self.index.remove(2)
+        self.assertEqual([e.Id for e in self.root.Elements], [13])
+        self.assertEqual(self.index.element(10), None)
+        self.assertEqual(self.index.photo(100), None)
+        self.assertEqual(self.index.byPath('Clients'), None)
+        self.assertEqual(len(self.index), 2)
+
+    def test_remove_photo(self):
+        self.index.removePhoto(100, 10)
+        self.assertEqual([p.Id for p in self.index.element(10).Photos], [101])
+        self.assertEqual([ps.Id for ps in self.index.photosets(100)], [12])
+        self.index.removePhoto(100)
+        self.assertEqual(self.index.photo(100), None)
+        self.assertEqual(self.index.byFileName('a.jpg'), [])
+
+    def test_add_and_move(self):
+        group = Group._fromjson({'Id':3, 'Title':'New'})
+        self.index.add(group, 1, 0)
+        self.assertEqual(self.root.Elements[0], group)
+        self.assertEqual(self.index.byPath('New'), group)
+        self.index.move(13, 3)
+        self.assertEqual(self.index.path(13), 'New/Misc')
+        self.index.movePhoto(101, 10, 13)
+        self.assertEqual(self.index.byPath('New/Misc/b.jpg').Id, 101)
+        self.assertEqual([p.Id for p in self.index.element(10).Photos], [100])
+
+    def test_update_renames(self):
+        self.index.update(PhotoSet._fromjson({'Id':12, 'Title':'Brown'}))
+        self.assertEqual(self.index.byPath('Clients/Jones'), None)
+        self.assertEqual(self.index.byPath('Clients/Brown/a.jpg').Id, 100)
+        self.index.update(Photo._fromjson({'Id':101, 'Title':'c.jpg',
+                                           'FileName':'c.jpg'}))
+        self.assertEqual(self.index.byPath('Clients/Smith/c.jpg').Id, 101)
+        self.assertEqual(self.index.byFileName('b.jpg'), [])
+
+    def test_outside_changes_ignored(self):
+        self.index.add(Group._fromjson({'Id':4, 'Title':'x'}), 999)
+        self.index.remove(999)
+        self.index.update(Photo._fromjson({'Id':999, 'Title':'x'}))
+        self.assertEqual(len(self.index), 9)
+
+class ConnectionIndexTest(ServerTestCase):
+
+    def test_kept_in_step(self):
+        zen = self.connect()
+        index = zen.index_hierarchy()
+        self.assertEqual(index.byPath('group 0/set 1').Id, FIRST_SET + 1)
+        group = zen.CreateGroup(1)
+        self.assertTrue(index.element(group.Id) is group)
+        zen.DeletePhotoset(FIRST_SET + 1)
+        self.assertEqual(index.byPath('group 0/set 1'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Tests of lazily built snapshot lists"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import cPickle
+import json
+import pickle
+import threading
+import unittest
+
+from zenapi._zapi import LazyList, Photo, PhotoSet
+
+from support import ServerTestCase, FIRST_SET, lazy_photoset
+
+class LazyListTest(unittest.TestCase):
+
+    def test_unbuilt(self):
+        ps = lazy_photoset()
+        self.assertTrue(isinstance(ps.Photos, LazyList))
+        self.assertFalse(isinstance(ps.Photos, list))
+        self.assertEqual(len(ps.Photos), 3)
+        self.assertTrue(ps.Photos)
+        self.assertEqual(repr(ps.Photos), '<LazyList of 3 unbuilt items>')
+        self.assertTrue(ps.Photos._raw is not None)
+
+    def test_materialize(self):
+        ps = lazy_photoset()
+        first = ps.Photos[0]
+        self.assertTrue(isinstance(first, Photo))
+        self.assertTrue(ps.Photos._raw is None)
+        self.assertEqual([p.Id for p in ps.Photos], [100, 101, 102])
+        self.assertTrue(first is ps.Photos[0]) # built only once
+        self.assertEqual([p.Id for p in ps.Photos[1:]], [101, 102])
+        ps.Photos.append(Photo._fromjson({'Id':200}))
+        self.assertEqual(len(ps.Photos), 4)
+        del ps.Photos[0]
+        self.assertEqual([p.Id for p in reversed(ps.Photos)],
+                         [200, 102, 101])
+        self.assertTrue(first not in ps.Photos)
+
+    def test_list_operations(self):
+        a, b = LazyList([3, 1, 2]), LazyList([3, 1, 2])
+        self.assertEqual(a, b)
+        self.assertEqual(a, [3, 1, 2])
+        self.assertEqual(list(a), [3, 1, 2])
+        self.assertEqual(a + [4], [3, 1, 2, 4])
+        self.assertEqual([0] + a, [0, 3, 1, 2])
+        self.assertEqual(','.join(str(i) for i in a), '3,1,2')
+        self.assertEqual(json.dumps(list(a)), '[3, 1, 2]')
+        a.sort()
+        self.assertEqual(a, [1, 2, 3])
+        self.assertNotEqual(a, b)
+        self.assertEqual((a.index(2), a.count(2)), (1, 1))
+        a.extend([4, 5])
+        self.assertEqual((a.pop(), len(a)), (5, 4))
+
+    def test_json_of_asdict(self):
+        ps = lazy_photoset()
+        d = json.loads(json.dumps(ps.asdict()))
+        self.assertEqual([p['Id'] for p in d['Photos']], [100, 101, 102])
+        self.assertEqual(d['Photos'][0]['UploadedOn']['Value'],
+                         '2009-06-01 12:30:00')
+
+    def test_pickles_as_list(self):
+        ps = lazy_photoset()
+        for module in (pickle, cPickle):
+            for protocol in (0, 2):
+                photos = module.loads(module.dumps(ps.Photos, protocol))
+                self.assertEqual(type(photos), list)
+                self.assertEqual([p.Id for p in photos], [100, 101, 102])
+
+    def test_per_instance_lock(self):
+        a, b = lazy_photoset().Photos, lazy_photoset().Photos
+        self.assertFalse(a._lock is b._lock)
+        # Building one list never waits for another
+        with a._lock:
+            self.assertEqual(b[0].Id, 100)
+
+    def test_concurrent_builds(self):
+        photos = lazy_photoset(200).Photos
+        start = threading.Event()
+        seen = []
+        def read():
+            start.wait()
+            seen.append(photos[199])
+        threads = [threading.Thread(target=read) for i in range(8)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(seen), 8)
+        self.assertTrue(all(p is seen[0] for p in seen))
+        self.assertEqual(len(photos), 200)
+
+class LazyConnectionTest(ServerTestCase):
+
+    def test_lazy_photoset(self):
+        zen = self.connect(lazy=True)
+        ps = zen.LoadPhotoSet(FIRST_SET, includePhotos=True)
+        self.assertEqual(type(ps), PhotoSet)
+        self.assertTrue(isinstance(ps.Photos, LazyList))
+        self.assertEqual(len(json.loads(json.dumps(ps.asdict()))['Photos']),
+                         self.photos)
+        self.assertEqual(type(ps.Photos[0]), Photo)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""Tests of per-method call and transfer metrics"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import unittest
+
+from zenapi import _metrics
+from zenapi._metrics import (Histogram, MetricsRegistry, enable_metrics,
+                             disable_metrics, get_metrics)
+from zenapi._zapi import RpcError
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        h = Histogram()
+        self.assertEqual(h.percentile(50), None)
+        for i in range(1, 101):
+            h.add(i/100.)
+        self.assertEqual((h.count, h.max), (100, 1.))
+        self.assertAlmostEqual(h.total, 50.5)
+        # Bucket bounds are within 9% of the true value
+        for q in (50, 95, 99):
+            self.assertTrue(q/100. <= h.percentile(q) <= q/100.*1.1)
+        self.assertEqual(h.percentile(100), 1.)
+
+    def test_extremes(self):
+        h = Histogram()
+        h.add(0)
+        h.add(1e6)
+        self.assertEqual(h.counts[0], 1)
+        self.assertEqual(h.counts[-1], 1)
+        self.assertEqual(h.percentile(50), h.LOWEST)
+        self.assertEqual(h.percentile(100), 1e6)
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def tearDown(self):
+        disable_metrics()
+
+    def test_snapshot(self):
+        m = MetricsRegistry()
+        m.record_call('LoadPhoto', 0.1, 100, 2000)
+        m.record_call('LoadPhoto', 0.3, 100, 0, RpcError('E_NOSUCHOBJECT'))
+        m.record_transfer('download', 2., 1000)
+        m.record_transfer('upload', 1., 500, IOError())
+        d = m.snapshot()
+        photo = d['calls']['LoadPhoto']
+        self.assertEqual((photo['calls'], photo['errors']), (2, 1))
+        self.assertEqual(photo['error_types'], {'RpcError':1})
+        self.assertEqual((photo['bytes_out'], photo['bytes_in']), (200, 2000))
+        self.assertAlmostEqual(photo['mean'], 0.2)
+        self.assertEqual(photo['max'], 0.3)
+        down = d['transfers']['download']
+        self.assertEqual((down['bytes_in'], down['bytes_out']), (1000, 0))
+        self.assertEqual(down['bytes_per_sec'], 500.)
+        self.assertEqual(d['transfers']['upload']['bytes_out'], 500)
+        self.assertTrue(d['uptime'] >= 0)
+
+    def test_listeners(self):
+        m = MetricsRegistry()
+        events = []
+        def broken(*args):
+            raise ValueError
+        m.add_listener(broken)
+        m.add_listener(lambda *args: events.append(args))
+        m.record_call('LoadPhoto', 0.1, 1, 2)
+        m.record_transfer('upload', 0.5, 10)
+        self.assertEqual(events, [('call', 'LoadPhoto', 0.1, 1, 2, None),
+                                  ('transfer', 'upload', 0.5, 10, 0, None)])
+        m.remove_listener(broken)
+        self.assertEqual(len(m.listeners), 1)
+
+    def test_reset(self):
+        m = MetricsRegistry()
+        m.record_call('LoadPhoto', 0.1)
+        m.reset()
+        self.assertEqual(m.snapshot()['calls'], {})
+
+    def test_enable_disable(self):
+        self.assertEqual(get_metrics(), None)
+        m = enable_metrics()
+        self.assertTrue(get_metrics() is m is _metrics.registry)
+        mine = MetricsRegistry()
+        self.assertTrue(enable_metrics(mine) is mine)
+        self.assertTrue(disable_metrics() is mine)
+        self.assertEqual(get_metrics(), None)
+
+class InstrumentationTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.zen.throttle = None
+        self.metrics = enable_metrics()
+
+    def tearDown(self):
+        disable_metrics()
+        ServerTestCase.tearDown(self)
+
+    def test_calls(self):
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        self.zen.LoadPhoto(FIRST_PHOTO + 1)
+        self.server.inject('LoadPhoto', 'E_NOSUCHOBJECT')
+        self.assertRaises(RpcError, self.zen.LoadPhoto, FIRST_PHOTO)
+        d = self.metrics.snapshot()['calls']['LoadPhoto']
+        self.assertEqual((d['calls'], d['errors']), (3, 1))
+        self.assertTrue(d['bytes_out'] > 0 and d['bytes_in'] > 0)
+        self.assertTrue(d['p50'] > 0 and d['p99'] >= d['p50'])
+
+    def test_transfers(self):
+        photo = self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertTrue(photo.download(path=self.tmp, size=None))
+        fp = os.path.join(self.tmp, 'up.jpg')
+        with open(fp, 'wb') as f:
+            f.write('x'*3000)
+        self.zen.upload(self.zen.LoadPhotoSet(FIRST_SET), fp)
+        d = self.metrics.snapshot()['transfers']
+        self.assertEqual(d['download']['calls'], 1)
+        self.assertEqual(d['download']['bytes_in'], self.image_bytes)
+        self.assertEqual(d['upload']['bytes_out'], 3000)
+        self.assertTrue(d['download']['bytes_per_sec'] > 0)
+
+    def test_disabled(self):
+        disable_metrics()
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertEqual(self.metrics.snapshot()['calls'], {})
+
+if __name__ == '__main__':
+    unittest.main()
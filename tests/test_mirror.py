@@ -0,0 +1,124 @@
+"""Tests of the SQLite account mirror"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import unittest
+from datetime import datetime
+
+from zenapi import LocalMirror
+from zenapi._zapi import Group, PhotoSet, Photo
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+class MirrorTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.filename = os.path.join(self.tmp, 'mirror.db')
+        self.mirror = LocalMirror(self.zen, self.filename)
+        self.stats = self.mirror.refresh(workers=2)
+
+    def tearDown(self):
+        self.mirror.close()
+        ServerTestCase.tearDown(self)
+
+    def nsets(self):
+        return self.groups*self.sets
+
+    def test_first_refresh(self):
+        self.assertEqual(len(self.stats.changed), self.nsets())
+        self.assertEqual(self.stats.calls, 1 + self.nsets())
+        self.assertEqual(len(self.mirror.photos()),
+                         self.nsets()*self.photos)
+        self.assertEqual(self.mirror.query('SELECT COUNT(*) FROM groups'),
+                         [(1 + self.groups,)])
+
+    def test_unchanged_refresh(self):
+        stats = self.mirror.refresh()
+        self.assertEqual(stats.calls, 1)
+        self.assertEqual(len(stats.unchanged), self.nsets())
+        self.assertEqual(stats.changed, [])
+        self.assertEqual(self.calls('LoadPhotoSet'), self.nsets())
+
+    def test_changed_photoset(self):
+        self.account.remove(FIRST_PHOTO)
+        self.account.edit(FIRST_SET + 1, ModifiedOn={
+            '$type':'DateTime', 'Value':'2030-01-01 00:00:00'})
+        stats = self.mirror.refresh()
+        self.assertEqual(sorted(stats.changed), [FIRST_SET, FIRST_SET + 1])
+        self.assertEqual(stats.calls, 3)
+        self.assertEqual(self.mirror.photos(id=FIRST_PHOTO), [])
+        self.assertEqual(len(self.mirror.photos(photoset=FIRST_SET)),
+                         self.photos - 1)
+
+    def test_full_refresh(self):
+        stats = self.mirror.refresh(full=True)
+        self.assertEqual(len(stats.changed), self.nsets())
+
+    def test_failed_photoset_keeps_photos(self):
+        self.account.remove(FIRST_PHOTO)
+        self.server.inject('LoadPhotoSet', 'E_UNAVAILABLE')
+        stats = self.mirror.refresh()
+        [(psid, error)] = stats.failed
+        self.assertEqual(psid, FIRST_SET)
+        self.assertEqual(len(self.mirror.photos(photoset=FIRST_SET)),
+                         self.photos)
+        # Still stale, so the next refresh tries again
+        stats = self.mirror.refresh()
+        self.assertEqual(stats.changed, [FIRST_SET])
+        self.assertEqual(self.mirror.photos(id=FIRST_PHOTO), [])
+
+    def test_queries(self):
+        [group] = self.mirror.groups(title='group 1')
+        self.assertTrue(isinstance(group, Group))
+        self.assertEqual(group.Elements, None)
+        photosets = self.mirror.photosets(parent=group.Id)
+        self.assertEqual([ps.Title for ps in photosets], ['set 2', 'set 3'])
+        self.assertTrue(isinstance(photosets[0], PhotoSet))
+        self.assertEqual(self.mirror.photosets(path='group 0/set 1')[0].Id,
+                         FIRST_SET + 1)
+        photos = self.mirror.photos(min_views=15, order_by='views DESC')
+        self.assertEqual([p.Id - FIRST_PHOTO for p in photos],
+                         [19, 18, 17, 16, 15])
+        self.assertTrue(isinstance(photos[0], Photo))
+        self.assertEqual(len(self.mirror.photos(
+            uploaded_after=datetime(2010, 1, 1))), 10)
+        self.assertEqual(len(self.mirror.photos(
+            uploaded_before='2002-01-01 00:00:00', limit=1)), 1)
+        [photo] = self.mirror.photos(title='IMG_00003.jpg')
+        self.assertEqual(photo.Id, FIRST_PHOTO + 3)
+
+    def test_photoset(self):
+        ps = self.mirror.photoset(FIRST_SET)
+        self.assertEqual(ps.Title, 'set 0')
+        self.assertEqual([p.Id for p in ps.Photos],
+                         range(FIRST_PHOTO, FIRST_PHOTO + self.photos))
+        self.assertEqual(self.mirror.photoset(FIRST_SET,
+                                              includePhotos=False).Photos, None)
+        self.assertEqual(self.mirror.photoset(9999), None)
+
+    def test_persistent(self):
+        self.mirror.close()
+        self.mirror = LocalMirror(None, self.filename)
+        self.assertEqual(len(self.mirror.photos()), self.nsets()*self.photos)
+
+if __name__ == '__main__':
+    unittest.main()
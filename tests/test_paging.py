@@ -0,0 +1,121 @@
+"""Tests of iteration over paged calls"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+import unittest
+
+from zenapi._paging import iterpages, pageitems
+
+from support import ServerTestCase, FIRST_PHOTO
+
+class Pages(object):
+    """fetch() over range(size), returning at most cap items a call"""
+
+    def __init__(self, size, cap=None, total=True, reported=None):
+        self.size = size
+        self.cap = cap
+        self.total = total
+        self.reported = size if reported is None else reported
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __call__(self, offset, limit):
+        with self._lock:
+            self.requests.append((offset, limit))
+        if self.cap is not None:
+            limit = min(limit, self.cap)
+        items = range(offset, min(offset + limit, self.size))
+        if not self.total:
+            return items
+        return {'Photos':items, 'TotalCount':self.reported}
+
+class IterPagesTest(unittest.TestCase):
+
+    def test_pageitems(self):
+        self.assertEqual(pageitems(None), ([], None))
+        self.assertEqual(pageitems([1, 2]), ([1, 2], None))
+        self.assertEqual(pageitems({'PhotoSets':[1], 'TotalCount':5}),
+                         ([1], 5))
+        self.assertEqual(pageitems({'Photos':None, 'TotalCount':0}), ([], 0))
+
+    def test_all_pages(self):
+        for prefetch in (0, 1, 3):
+            fetch = Pages(25)
+            self.assertEqual(list(iterpages(fetch, page_size=10,
+                                            prefetch=prefetch)), range(25))
+            self.assertEqual(sorted(fetch.requests),
+                             [(0, 10), (10, 10), (20, 5)])
+
+    def test_server_page_cap(self):
+        fetch = Pages(50, cap=7)
+        self.assertEqual(list(iterpages(fetch, page_size=10, prefetch=2)),
+                         range(50))
+        # Once the cap is known pages are asked for at its size
+        self.assertEqual(fetch.requests[0], (0, 10))
+        self.assertTrue(all(n <= 7 for offset, n in fetch.requests[1:]))
+        self.assertTrue(len(fetch.requests) <= 9)
+
+    def test_short_page_without_total(self):
+        fetch = Pages(50, cap=7, total=False)
+        self.assertEqual(list(iterpages(fetch, page_size=10)), range(7))
+
+    def test_empty_page_stops(self):
+        # The server promised more than it has
+        fetch = Pages(30, reported=100)
+        self.assertEqual(list(iterpages(fetch, page_size=10, prefetch=0)),
+                         range(30))
+        self.assertEqual(fetch.requests[-1], (30, 10))
+
+    def test_max_items(self):
+        fetch = Pages(100)
+        self.assertEqual(list(iterpages(fetch, page_size=10, prefetch=2,
+                                        max_items=15)), range(15))
+        self.assertEqual(sorted(fetch.requests), [(0, 10), (10, 5)])
+
+    def test_close_early(self):
+        fetch = Pages(1000)
+        pages = iterpages(fetch, page_size=10, prefetch=2)
+        self.assertEqual([pages.next() for i in range(5)], range(5))
+        pages.close()
+        self.assertTrue(len(fetch.requests) <= 3)
+
+    def test_bad_page_size(self):
+        self.assertRaises(ValueError, list, iterpages(Pages(1), page_size=0))
+
+class IterateTest(ServerTestCase):
+    sets, photos = 3, 10
+
+    def test_server_page_cap(self):
+        self.account.page_cap = 4
+        zen = self.connect()
+        photos = list(zen.iterate('SearchPhotoByText', query='x',
+                                  page_size=10, prefetch=2))
+        self.assertEqual([p.Id for p in photos],
+                         range(FIRST_PHOTO, FIRST_PHOTO + self.account.nphotos))
+
+    def test_without_total(self):
+        zen = self.connect()
+        photos = list(zen.iterate('GetRecentPhotos', page_size=7))
+        self.assertEqual(len(photos), self.account.nphotos)
+        self.assertEqual(self.calls('GetRecentPhotos'),
+                         self.account.nphotos//7 + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Tests of the keep-alive connection pool and its resend policy"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import httplib
+import os
+import socket
+import unittest
+
+from zenapi import _zapi
+from zenapi._pool import ConnectionPool, PoolTimeout
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+DROPPED = (httplib.HTTPException, socket.error)
+
+class PoolTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.zen.throttle = None # so only the pool resends
+
+    def idle(self):
+        return [c for hp in _zapi._pool._hosts.values() for c, t in hp.idle]
+
+    def test_keepalive(self):
+        for i in range(5):
+            self.assertEqual(self.zen.LoadPhoto(FIRST_PHOTO + i).Id,
+                             FIRST_PHOTO + i)
+        self.assertEqual(len(self.idle()), 1)
+
+    def test_download_returns_connection(self):
+        photo = self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertTrue(photo.download(path=self.tmp, size=None))
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        self.assertEqual(len(self.idle()), 1)
+
+    def test_upload_reuses_connection(self):
+        gallery = self.zen.LoadPhotoSet(FIRST_SET)
+        fp = os.path.join(self.tmp, 'a.jpg')
+        with open(fp, 'wb') as f:
+            f.write('x'*100)
+        for i in range(3):
+            self.zen.upload(gallery, fp)
+        self.assertEqual(len(self.idle()), 1)
+        self.assertEqual(self.calls('upload'), 3)
+
+    def test_read_resent_after_stale_connection(self):
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        self.server.inject('LoadPhoto', 'drop')
+        self.assertEqual(self.zen.LoadPhoto(FIRST_PHOTO).Id, FIRST_PHOTO)
+        self.assertEqual(self.calls('LoadPhoto'), 3)
+
+    def test_mutation_not_resent_after_send(self):
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        self.server.inject('CreateGroup', 'drop')
+        self.assertRaises(DROPPED, self.zen.CreateGroup, 1)
+        self.assertEqual(self.calls('CreateGroup'), 1)
+
+    def test_fresh_connection_not_resent(self):
+        _zapi._pool.clear()
+        self.server.inject('LoadPhoto', 'drop')
+        self.assertRaises(DROPPED, self.zen.LoadPhoto, FIRST_PHOTO)
+        self.assertEqual(self.calls('LoadPhoto'), 1)
+
+    def test_mutation_resent_when_never_sent(self):
+        self.zen.LoadPhoto(FIRST_PHOTO)
+        # The connection passes the health check, but writes to it fail
+        self.idle()[0].sock.shutdown(socket.SHUT_WR)
+        _zapi._pool._is_alive = lambda conn: True
+        group = self.zen.CreateGroup(1)
+        self.assertTrue(group.Id)
+        self.assertEqual(self.calls('CreateGroup'), 1)
+
+class PoolTimeoutTest(ServerTestCase):
+    pool = {'timeout':0.3}
+
+    def test_timeout_not_resent(self):
+        zen = self.connect()
+        zen.throttle = None
+        zen.LoadPhoto(FIRST_PHOTO)
+        self.server.inject('LoadPhoto', 1.0)
+        self.assertRaises(socket.error, zen.LoadPhoto, FIRST_PHOTO)
+        self.assertEqual(self.calls('LoadPhoto'), 2)
+
+class BlockingPoolTest(unittest.TestCase):
+
+    def test_pool_timeout(self):
+        pool = ConnectionPool(maxsize=1, block=True, pool_timeout=0.05)
+        key = ('http', '127.0.0.1', 1)
+        conn, reused = pool._get(key)
+        self.assertFalse(reused)
+        self.assertRaises(PoolTimeout, pool._get, key)
+        pool._put(key, conn, reusable=False)
+        pool._put(key, pool._get(key)[0], reusable=False)
+
+if __name__ == '__main__':
+    unittest.main()
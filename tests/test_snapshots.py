@@ -0,0 +1,103 @@
+"""Tests of snapshot storage: compact fields, FieldDict and pickling"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import cPickle
+import pickle
+import unittest
+from datetime import datetime
+
+from zenapi._zapi import Photo, PhotoSet, PhotoUpdater
+
+from support import lazy_photoset
+
+class CompactStorageTest(unittest.TestCase):
+
+    def test_no_instance_dict(self):
+        p = Photo._fromjson({'Id':5, 'Title':'a.jpg'})
+        self.assertFalse(hasattr(p, '__dict__'))
+        self.assertEqual(len(p._values), len(Photo.__allfields__))
+        self.assertEqual(p._values[Photo.__fieldindex__['Title']], 'a.jpg')
+
+    def test_inherited_fields(self):
+        # Parent fields come first, so their properties work on subclasses
+        for cls in (Photo, PhotoSet):
+            parent = cls.__mro__[1]
+            self.assertEqual(cls.__allfields__[:len(parent.__allfields__)],
+                             parent.__allfields__)
+
+    def test_asdict_and_update(self):
+        p = Photo._fromjson({'Id':5, 'Title':'a.jpg'})
+        self.assertEqual(p.asdict(), {'$type':'Photo', 'Id':5,
+                                      'Title':'a.jpg'})
+        p.update({'Title':'b.jpg', 'Views':3})
+        self.assertEqual((p.Title, p.Views), ('b.jpg', 3))
+
+class FieldDictTest(unittest.TestCase):
+
+    def test_fields(self):
+        p = Photo._fromjson({'Id':5, 'Title':'a.jpg'})
+        d = p._dict
+        self.assertEqual(d['Title'], 'a.jpg')
+        self.assertEqual(d['Caption'], None)
+        self.assertEqual(d['$type'], 'Photo')
+        d['Title'] = 'b.jpg'
+        self.assertEqual(p.Title, 'b.jpg')
+        self.assertEqual(p.changes(), {'Title':('a.jpg', 'b.jpg')})
+        self.assertTrue('Title' in d)
+        self.assertEqual(len(d), len(Photo.__allfields__))
+        self.assertEqual(list(d)[:len(Photo.__allfields__)],
+                         list(Photo.__allfields__))
+
+    def test_extra_keys(self):
+        p = Photo._fromjson({'Id':5, 'Unknown':1})
+        d = p._dict
+        self.assertEqual(d['Unknown'], 1)
+        self.assertTrue('Unknown' in d)
+        self.assertRaises(KeyError, d.__getitem__, 'Missing')
+        d['Other'] = 2
+        self.assertEqual(len(d), len(Photo.__allfields__) + 2)
+        del d['Other']
+        self.assertFalse('Other' in d)
+        self.assertEqual(d.copy()['Unknown'], 1)
+
+class PickleTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        ps = lazy_photoset()
+        for module in (pickle, cPickle):
+            for protocol in (0, 2):
+                copy = module.loads(module.dumps(ps, protocol))
+                self.assertEqual(type(copy), PhotoSet)
+                self.assertEqual(copy.asdict(), ps.asdict())
+                self.assertEqual(copy.Photos[1].UploadedOn.Value,
+                                 datetime(2009, 6, 2, 12, 30))
+
+    def test_extra_keys_survive(self):
+        p = Photo._fromjson({'Id':5, 'Unknown':1})
+        copy = cPickle.loads(cPickle.dumps(p, 2))
+        self.assertEqual(copy._dict['Unknown'], 1)
+
+    def test_updater(self):
+        u = PhotoUpdater(Title='t', Keywords=['a'])
+        copy = cPickle.loads(cPickle.dumps(u, 2))
+        self.assertEqual(copy.asdict(), u.asdict())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""Tests of manifest-based syncing"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import unittest
+
+from zenapi._sync import SyncManifest
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+class SyncTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.manifest = os.path.join(self.tmp, 'manifest.json')
+        self.first = self.sync()
+
+    def sync(self, **kwargs):
+        return self.zen.sync(1, path=self.tmp, manifest=self.manifest,
+                             size=None, **kwargs)
+
+    def local(self, photo_id, title=None):
+        """Expected local path of a photo of the first photoset"""
+        return os.path.join(self.tmp, 'root', 'group 0', 'set 0',
+                            title or 'IMG_%05i.jpg'%(photo_id - FIRST_PHOTO))
+
+    def total(self):
+        return self.groups*self.sets*self.photos
+
+    def test_initial(self):
+        self.assertEqual(len(self.first.downloaded), self.total())
+        self.assertEqual(self.first.failed, [])
+        with open(self.local(FIRST_PHOTO), 'rb') as f:
+            self.assertEqual(f.read(), self.account.image)
+        self.assertEqual(self.calls('LoadGroupHierarchy'), 1)
+        self.assertEqual(self.calls('LoadGroup'), 0)
+        self.assertEqual(self.calls('LoadPhotoSet'), self.groups*self.sets)
+
+    def test_manifest_round_trip(self):
+        manifest = SyncManifest(self.manifest)
+        self.assertEqual(len(manifest.photos), self.total())
+        self.assertEqual(len(manifest.photosets), self.groups*self.sets)
+        entry = manifest.photos[str(FIRST_PHOTO)]
+        self.assertEqual(entry['paths'], {str(FIRST_SET):os.path.relpath(
+            self.local(FIRST_PHOTO), self.tmp)})
+        manifest.filename = os.path.join(self.tmp, 'copy.json')
+        manifest.save()
+        copy = SyncManifest(manifest.filename)
+        self.assertEqual((copy.photos, copy.photosets),
+                         (manifest.photos, manifest.photosets))
+
+    def test_manifest_version(self):
+        with open(self.manifest, 'wb') as f:
+            json.dump({'version':0, 'photos':{}, 'photosets':{}}, f)
+        self.assertRaises(ValueError, SyncManifest, self.manifest)
+
+    def test_unchanged(self):
+        summary = self.sync()
+        self.assertEqual((summary.downloaded, summary.renamed, summary.deleted),
+                         ([], [], []))
+        self.assertEqual(summary.unchanged, self.total())
+        self.assertEqual(self.calls('GET'), self.total())
+
+    def test_missing_file(self):
+        os.remove(self.local(FIRST_PHOTO))
+        summary = self.sync()
+        [(photo, path)] = summary.downloaded
+        self.assertEqual(photo.Id, FIRST_PHOTO)
+        self.assertTrue(os.path.isfile(self.local(FIRST_PHOTO)))
+
+    def test_replaced(self):
+        # ReplacePhoto changes the photo's Sequence but not the photoset's
+        # ModifiedOn or PhotoCount
+        self.zen.ReplacePhoto(FIRST_PHOTO, FIRST_PHOTO + 1)
+        self.assertEqual(self.sync(quick=True).downloaded, [])
+        summary = self.sync()
+        self.assertEqual([p.Id for p, path in summary.downloaded],
+                         [FIRST_PHOTO])
+        self.assertEqual(summary.unchanged, self.total() - 1)
+
+    def test_renamed(self):
+        self.account.edit(FIRST_PHOTO, Title='renamed.jpg')
+        summary = self.sync()
+        [(photo, old, new)] = summary.renamed
+        self.assertEqual(photo.Id, FIRST_PHOTO)
+        self.assertEqual(new, os.path.relpath(
+            self.local(FIRST_PHOTO, 'renamed.jpg'), self.tmp))
+        self.assertFalse(os.path.exists(self.local(FIRST_PHOTO)))
+        self.assertTrue(os.path.isfile(self.local(FIRST_PHOTO, 'renamed.jpg')))
+        self.assertEqual(summary.downloaded, [])
+        self.assertEqual(SyncManifest(self.manifest).photos[
+            str(FIRST_PHOTO)]['paths'], {str(FIRST_SET):new})
+
+    def test_pruned(self):
+        self.account.remove(FIRST_PHOTO)
+        summary = self.sync()
+        self.assertEqual(summary.deleted,
+                         [os.path.relpath(self.local(FIRST_PHOTO), self.tmp)])
+        self.assertFalse(os.path.exists(self.local(FIRST_PHOTO)))
+        self.assertFalse(str(FIRST_PHOTO) in SyncManifest(self.manifest).photos)
+
+    def test_pruned_kept(self):
+        self.account.remove(FIRST_PHOTO)
+        summary = self.sync(delete=False)
+        self.assertEqual(summary.deleted, [])
+        self.assertTrue(os.path.isfile(self.local(FIRST_PHOTO)))
+        self.assertFalse(str(FIRST_PHOTO) in SyncManifest(self.manifest).photos)
+
+    def test_failed_photoset_not_pruned(self):
+        self.account.remove(FIRST_PHOTO)
+        self.server.inject('LoadPhotoSet', 'E_UNAVAILABLE')
+        summary = self.sync(workers=1)
+        [(photoset, path, error)] = summary.failed
+        self.assertEqual(error.code, 'E_UNAVAILABLE')
+        self.assertEqual(summary.deleted, [])
+        self.assertTrue(str(FIRST_PHOTO) in SyncManifest(self.manifest).photos)
+
+    def test_photoset(self):
+        summary = self.zen.sync(self.zen.LoadPhotoSet(FIRST_SET),
+                                path=os.path.join(self.tmp, 'one'), size=None)
+        self.assertEqual(len(summary.downloaded), self.photos)
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.tmp, 'one', 'set 0', 'IMG_00000.jpg')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+"""Tests of rate limiting, adaptive concurrency and retries"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import threading
+import time
+import unittest
+
+from zenapi._throttle import TokenBucket, AdaptiveLimiter, CallThrottle
+from zenapi._zapi import HttpError, RpcError, IsTransient
+
+from support import ServerTestCase, FIRST_PHOTO
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_empty(self):
+        bucket = TokenBucket(10, burst=3)
+        self.assertTrue(all(bucket.try_consume() for i in range(3)))
+        self.assertFalse(bucket.try_consume())
+
+    def test_consume_waits_for_tokens(self):
+        bucket = TokenBucket(20, burst=1)
+        t0 = time.time()
+        for i in range(5):
+            bucket.consume()
+        # 4 tokens at 20/s after the first
+        self.assertTrue(time.time() - t0 >= 0.15)
+
+    def test_large_request_leaves_debt(self):
+        bucket = TokenBucket(100, burst=10)
+        bucket.consume(30)
+        self.assertTrue(bucket._tokens < 0)
+        self.assertFalse(bucket.try_consume())
+
+    def test_set_rate(self):
+        bucket = TokenBucket(1, burst=1)
+        bucket.consume()
+        bucket.set_rate(1000, burst=5)
+        time.sleep(0.01)
+        self.assertTrue(bucket.try_consume())
+        self.assertEqual(bucket.burst, 5)
+
+    def test_bad_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def test_increase_and_cut(self):
+        limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=5)
+        for i in range(20):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(limiter.limit, 5)
+        limiter.acquire()
+        limiter.release(0.01, overloaded=True)
+        self.assertEqual(limiter.limit, 2.5)
+        self.assertEqual(limiter.inflight, 0)
+
+    def test_one_cut_per_round(self):
+        limiter = AdaptiveLimiter(initial=8)
+        for i in range(3):
+            limiter.acquire()
+        for i in range(3):
+            limiter.release(10, overloaded=True)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_minimum(self):
+        limiter = AdaptiveLimiter(initial=2, minimum=1)
+        for i in range(3):
+            limiter.acquire()
+            limiter.release(0, overloaded=True)
+            limiter._lastcut = 0
+        self.assertEqual(limiter.limit, 1)
+
+    def test_slow_calls_overload(self):
+        limiter = AdaptiveLimiter(initial=8, latency_target=0.5)
+        limiter.acquire()
+        limiter.release(1.0)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_acquire_blocks_at_limit(self):
+        limiter = AdaptiveLimiter(initial=1)
+        limiter.acquire()
+        acquired = threading.Event()
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+        t = threading.Thread(target=acquire)
+        t.start()
+        self.assertFalse(acquired.wait(0.2))
+        limiter.release(0.01)
+        self.assertTrue(acquired.wait(5))
+        t.join()
+
+    def test_widen(self):
+        limiter = AdaptiveLimiter(initial=4, maximum=8)
+        limiter.widen(16)
+        self.assertEqual((limiter.limit, limiter.maximum), (16, 16))
+        limiter.widen(2)
+        self.assertEqual((limiter.limit, limiter.maximum), (16, 16))
+
+class Flaky(object):
+    """Raises each of errors in turn, then returns 'ok'"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+class CallThrottleTest(unittest.TestCase):
+
+    def throttle(self, **kwargs):
+        kwargs.setdefault('backoff', 0.01)
+        return CallThrottle(transient=IsTransient, **kwargs)
+
+    def test_retries_transient(self):
+        throttle = self.throttle()
+        fn = Flaky(HttpError(503), HttpError(500))
+        self.assertEqual(throttle.call(True, fn), 'ok')
+        self.assertEqual((fn.calls, throttle.retried), (3, 2))
+
+    def test_gives_up(self):
+        throttle = self.throttle(retries=2)
+        fn = Flaky(*[HttpError(503)]*5)
+        self.assertRaises(HttpError, throttle.call, True, fn)
+        self.assertEqual(fn.calls, 3)
+
+    def test_no_retry_of_writes_or_lasting_errors(self):
+        throttle = self.throttle()
+        fn = Flaky(HttpError(503))
+        self.assertRaises(HttpError, throttle.call, False, fn)
+        fn = Flaky(RpcError('E_NOSUCHOBJECT'))
+        self.assertRaises(RpcError, throttle.call, True, fn)
+        fn = Flaky(HttpError(404))
+        self.assertRaises(HttpError, throttle.call, True, fn)
+        self.assertEqual(throttle.retried, 0)
+
+    def test_retry_after(self):
+        throttle = self.throttle(max_backoff=2.)
+        e = HttpError(429, {'Retry-After':'1.5'})
+        self.assertEqual(throttle.delay(0, e), 1.5)
+        e = HttpError(429, {'Retry-After':'120'})
+        self.assertEqual(throttle.delay(0, e), 2.)
+        # Unparseable or missing headers fall back to the backoff
+        e = HttpError(503, {'Retry-After':'Fri, 31 Dec 1999 23:59:59 GMT'})
+        self.assertTrue(0 <= throttle.delay(0, e) <= 0.01)
+        self.assertTrue(0 <= throttle.delay(0, HttpError(503, {})) <= 0.01)
+
+    def test_jitter(self):
+        throttle = self.throttle(backoff=1., max_backoff=5.)
+        for attempt, most in ((0, 1.), (1, 2.), (2, 4.), (6, 5.)):
+            delays = [throttle.delay(attempt) for i in range(200)]
+            self.assertTrue(all(0 <= d <= most for d in delays))
+            self.assertTrue(len(set(delays)) > 100)
+            self.assertTrue(max(delays) > most/2)
+
+    def test_limiter_released_on_errors(self):
+        throttle = self.throttle(adaptive=True, initial=4, retries=1)
+        fn = Flaky(HttpError(503), HttpError(503))
+        self.assertRaises(HttpError, throttle.call, True, fn)
+        self.assertEqual(throttle.limiter.inflight, 0)
+        self.assertTrue(throttle.limiter.limit < 4)
+
+    def test_rate(self):
+        throttle = self.throttle(rate=20, burst=1, adaptive=False)
+        t0 = time.time()
+        for i in range(5):
+            throttle.call(True, Flaky())
+        self.assertTrue(time.time() - t0 >= 0.15)
+
+class ConnectionThrottleTest(ServerTestCase):
+
+    def test_unbounded_by_default(self):
+        zen = self.connect()
+        self.assertTrue(zen.throttle.bucket is None)
+        self.assertTrue(zen.throttle.limiter is None)
+        self.assertEqual(zen.throttle.retries, 3)
+
+    def test_set_limits(self):
+        zen = self.connect()
+        throttle = zen.set_limits(rate=100, initial=2, maximum=4)
+        self.assertTrue(zen.throttle is throttle)
+        self.assertEqual(throttle.bucket.rate, 100)
+        self.assertEqual(throttle.limiter.limit, 2)
+        self.assertEqual(zen.set_limits(adaptive=False).limiter, None)
+
+    def test_retry_after_from_server(self):
+        zen = self.connect()
+        self.server.inject('LoadPhoto', (429, {'Retry-After':'0.3'}))
+        t0 = time.time()
+        self.assertEqual(zen.LoadPhoto(FIRST_PHOTO).Id, FIRST_PHOTO)
+        self.assertTrue(time.time() - t0 >= 0.3)
+        self.assertEqual(self.calls('LoadPhoto'), 2)
+        self.assertEqual(zen.throttle.retried, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,264 @@
+"""Tests of photo transfers: downloads and the bulk transfer engines"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import threading
+import unittest
+
+from zenapi import _zapi
+from zenapi._zapi import HttpError, RpcError, PhotoSet
+from zenapi._pool import BLOCKSIZE
+from zenapi._transfers import DownloadEngine, listfiles
+
+from support import ServerTestCase, FIRST_PHOTO, FIRST_SET
+
+def _files(top):
+    """Paths of the files below top, relative to it"""
+    return sorted(os.path.relpath(os.path.join(root, fn), top)
+                  for root, dirs, files in os.walk(top) for fn in files)
+
+def _write(fp, size):
+    """Writes size random bytes to a new file fp; returns fp"""
+    if not os.path.isdir(os.path.dirname(fp)):
+        os.makedirs(os.path.dirname(fp))
+    with open(fp, 'wb') as f:
+        f.write(os.urandom(size))
+    return fp
+
+class PhotoDownloadTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.photo = self.zen.LoadPhoto(FIRST_PHOTO)
+        self.fp = os.path.join(self.tmp, self.photo.Title)
+
+    def redirected(self, hops):
+        self.photo.OriginalUrl = '%s/redirect/%i/img/%i.jpg'%(
+            self.server.url, hops, FIRST_PHOTO)
+
+    def test_download(self):
+        self.assertTrue(self.zen.download(self.photo, path=self.tmp, size=None))
+        with open(self.fp, 'rb') as f:
+            self.assertEqual(f.read(), self.account.image)
+        self.assertEqual(os.listdir(self.tmp), [self.photo.Title])
+
+    def test_follows_redirects(self):
+        self.redirected(_zapi.MAX_REDIRECTS)
+        self.assertTrue(self.zen.download(self.photo, path=self.tmp, size=None))
+        with open(self.fp, 'rb') as f:
+            self.assertEqual(f.read(), self.account.image)
+
+    def test_too_many_redirects(self):
+        self.redirected(_zapi.MAX_REDIRECTS + 1)
+        try:
+            self.zen.download(self.photo, path=self.tmp, size=None)
+        except HttpError, e:
+            self.assertEqual(e.code, 302)
+        else:
+            self.fail('HttpError not raised')
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_other_3xx_not_saved(self):
+        self.server.inject('GET', 300)
+        self.assertRaises(HttpError, self.zen.download, self.photo,
+                          path=self.tmp, size=None)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_failure_keeps_existing_file(self):
+        with open(self.fp, 'wb') as f:
+            f.write('old')
+        self.server.inject('GET', 500)
+        self.assertRaises(HttpError, self.zen.download, self.photo,
+                          path=self.tmp, size=None)
+        with open(self.fp, 'rb') as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.tmp), [self.photo.Title])
+
+class UnpooledDownloadTest(PhotoDownloadTest):
+    pool = {'enabled':False}
+
+class UploadTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.gallery = self.zen.LoadPhotoSet(FIRST_SET)
+
+    def write(self, fn, size):
+        return _write(os.path.join(self.tmp, fn), size)
+
+    def test_upload(self):
+        fp = self.write('a.jpg', 5000)
+        photo = self.zen.upload(self.gallery, fp)
+        self.assertTrue(photo.Id)
+        self.assertEqual((photo.Title, photo.FileName), ('a.jpg', 'a.jpg'))
+        self.assertEqual(self.server.uploads, [(FIRST_SET, 'a.jpg', 5000)])
+
+    def test_relative_filename(self):
+        fp = self.write(os.path.join('sub', 'b.jpg'), 10)
+        self.zen.upload(self.gallery, fp, filenameStripRoot=self.tmp)
+        self.assertEqual(self.server.uploads,
+                         [(FIRST_SET, os.path.join('sub', 'b.jpg'), 10)])
+
+    def test_streamed_in_blocks(self):
+        size = 2*BLOCKSIZE + 10
+        fp = self.write('big.jpg', size)
+        blocks = []
+        photo_id, zfilename = self.zen._uploadfile(self.gallery, fp,
+                                                   callback=blocks.append)
+        self.assertTrue(photo_id)
+        self.assertTrue(len(blocks) > 2)
+        self.assertTrue(max(blocks) <= BLOCKSIZE)
+        self.assertEqual(sum(blocks), size)
+        self.assertEqual(self.server.uploads, [(FIRST_SET, 'big.jpg', size)])
+
+class UnpooledUploadTest(UploadTest):
+    pool = {'enabled':False}
+
+class UploadDirectoryTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+        self.gallery = self.zen.LoadPhotoSet(FIRST_SET)
+        self.src = os.path.join(self.tmp, 'src')
+        self.paths = [_write(os.path.join(self.src, fn), 20000)
+                      for fn in ('a.jpg', 'b.JPG', 'c.mov')]
+
+    def test_listfiles(self):
+        _write(os.path.join(self.src, '.hidden.jpg'), 1)
+        _write(os.path.join(self.src, 'sub', 'd.jpg'), 1)
+        self.assertEqual(listfiles(self.src), self.paths)
+        self.assertEqual(listfiles(self.src, extensions=('.jpg',)),
+                         self.paths[:2])
+        self.assertEqual(listfiles(self.src, recursive=True),
+                         self.paths + [os.path.join(self.src, 'sub', 'd.jpg')])
+
+    def test_directory(self):
+        finished = []
+        report = self.zen.upload_directory(self.gallery, self.src, workers=2,
+                                           progress=finished.append)
+        self.assertEqual([r.path for r in report], self.paths)
+        self.assertEqual(len(report.succeeded), 3)
+        self.assertEqual(report.failed, [])
+        self.assertEqual(report.bytes, 60000)
+        self.assertEqual(sorted(finished), sorted(report.results))
+        self.assertEqual([r.photo.Title for r in report],
+                         ['a.jpg', 'b.JPG', 'c.mov'])
+        self.assertEqual(self.calls('UpdatePhoto'), 3)
+
+    def test_failed_upload(self):
+        self.server.inject('upload', 500)
+        report = self.zen.upload_directory(self.gallery, self.paths,
+                                           workers=1)
+        [failed] = report.failed
+        self.assertTrue(failed.path == self.paths[0])
+        self.assertEqual((failed.stage, failed.error.code), ('upload', 500))
+        self.assertEqual((failed.photo_id, failed.photo), (None, None))
+        self.assertEqual(len(report.succeeded), 2)
+        self.assertEqual(report.bytes, 40000)
+        self.assertEqual(self.calls('UpdatePhoto'), 2)
+
+    def test_failed_update(self):
+        self.server.inject('UpdatePhoto', 'E_INVALIDPARAM')
+        report = self.zen.upload_directory(self.gallery, self.paths,
+                                           workers=1, update_workers=1)
+        [failed] = report.failed
+        self.assertEqual((failed.stage, failed.error.code),
+                         ('update', 'E_INVALIDPARAM'))
+        self.assertTrue(failed.photo_id)
+        self.assertEqual(failed.photo, None)
+        self.assertEqual(len(report.succeeded), 2)
+        self.assertEqual(report.bytes, 60000)
+
+    def test_bandwidth_capped(self):
+        # The first second's worth of bytes goes at once; the rest waits
+        report = self.zen.upload_directory(self.gallery, self.paths,
+                                           max_bytes_per_sec=40000)
+        self.assertEqual(len(report.succeeded), 3)
+        self.assertTrue(report.elapsed >= 0.4, report.elapsed)
+
+class UnpooledUploadDirectoryTest(UploadDirectoryTest):
+    pool = {'enabled':False}
+
+class DownloadEngineTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.zen = self.connect()
+
+    def expected(self):
+        return sorted(os.path.join('root', 'group %i'%g,
+                                   'set %i'%(g*self.sets + s),
+                                   'IMG_%05i.jpg'%((g*self.sets + s)*self.photos
+                                                   + p))
+                      for g in range(self.groups) for s in range(self.sets)
+                      for p in range(self.photos))
+
+    def test_group(self):
+        events = []
+        lock = threading.Lock()
+        def progress(event, photo, path, error):
+            with lock:
+                events.append(event)
+        summary = self.zen.download_group(1, path=self.tmp, size=None,
+                                          workers=4, progress=progress)
+        self.assertEqual(_files(self.tmp), self.expected())
+        self.assertEqual(len(summary.downloaded), len(self.expected()))
+        self.assertEqual((summary.skipped, summary.failed), ([], []))
+        self.assertEqual(events, ['downloaded']*len(self.expected()))
+        with open(os.path.join(self.tmp, self.expected()[0]), 'rb') as f:
+            self.assertEqual(f.read(), self.account.image)
+
+    def test_skip_existing(self):
+        self.zen.download_group(1, path=self.tmp, size=None, workers=4)
+        summary = self.zen.download_group(1, path=self.tmp, size=None,
+                                          workers=4, skip_existing=True)
+        self.assertEqual(len(summary.skipped), len(self.expected()))
+        self.assertEqual(summary.downloaded, [])
+        self.assertEqual(self.calls('GET'), len(self.expected()))
+
+    def test_failed_photo(self):
+        self.server.inject('GET', 404)
+        summary = self.zen.download_photoset(
+            self.zen.LoadPhotoSet(FIRST_SET), path=self.tmp, size=None,
+            workers=2)
+        self.assertEqual(len(summary.downloaded), self.photos - 1)
+        [(photo, path, error)] = summary.failed
+        self.assertTrue(isinstance(error, HttpError))
+        self.assertEqual(error.code, 404)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(len(_files(self.tmp)), self.photos - 1)
+
+    def test_failed_listing(self):
+        engine = DownloadEngine(self.zen, workers=2)
+        missing = PhotoSet({'Id':9999, 'Title':'missing'})
+        engine.add_photoset(missing, self.tmp)
+        engine.add_photoset(self.zen.LoadPhotoSet(FIRST_SET), self.tmp)
+        summary = engine.join()
+        [(obj, path, error)] = summary.failed
+        self.assertTrue(obj is missing)
+        self.assertEqual((path, error.code), (None, 'E_NOSUCHOBJECT'))
+        self.assertTrue(isinstance(error, RpcError))
+        self.assertEqual(len(summary.downloaded), self.photos)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,3 +19,12 @@
 """
 from . import snapshots, updaters
 from ._zapi import ZenConnection
+from ._threaded import ThreadPoolZenConnection, wait, as_completed
+from ._async import AsyncZenConnection, AsyncTransport
+from ._cache import ResponseCache
+from ._mirror import LocalMirror
+from ._index import HierarchyIndex
+from ._metrics import (MetricsRegistry, enable_metrics, disable_metrics,
+                       get_metrics)
+from ._codec import use_codec, get_codec
+from ._analytics import HierarchyTable
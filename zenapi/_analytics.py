@@ -0,0 +1,224 @@
+"""Vectorized aggregates over a loaded group hierarchy (requires numpy)"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ._zapi import Group, PhotoSet, Photo
+
+# Row kinds
+GROUP, PHOTOSET, PHOTO = 0, 1, 2
+
+# Columns: name -> (snapshot field, numpy dtype)
+COLUMNS = {
+    'views':('Views', 'int64'),
+    'size':('Size', 'int64'),
+    'photo_bytes':('PhotoBytes', 'int64'),
+    'created_on':('CreatedOn', 'datetime64[s]'),
+    'modified_on':('ModifiedOn', 'datetime64[s]'),
+    'taken_on':('TakenOn', 'datetime64[s]'),
+    'uploaded_on':('UploadedOn', 'datetime64[s]'),
+}
+
+class HierarchyTable(object):
+    """Columnar copy of a Group tree, for fast per-subtree aggregates
+
+    Every group, photoset and photo becomes one row, in preorder, so the
+    rows below row i are exactly rows i+1 .. end[i]-1.  A photo in several
+    photosets (e.g. collections) has a row under each of them.  Columns are
+    numpy arrays:
+
+    id, kind (GROUP, PHOTOSET or PHOTO), parent (row, -1 for the root),
+    depth, end, and the data columns of COLUMNS (views, size,
+    photo_bytes, created_on, ...), extracted when first used, where
+    missing numbers are 0 and missing dates NaT.
+
+    Aggregates (sum, count, max, argmax) are computed for every row at
+    once, over the rows of one kind in its subtree; top() ranks a single
+    subtree.  The table is a copy: rebuild it after changing the tree.
+
+    params:
+    root: a Group, e.g. from loadFullGroupHierarchy
+    """
+    GROUP, PHOTOSET, PHOTO = GROUP, PHOTOSET, PHOTO
+
+    def __init__(self, root):
+        if numpy is None:
+            raise ImportError('HierarchyTable requires numpy')
+        objects = []
+        parents = []
+        depths = []
+        byclass = self._byclass = {} # snapshot class -> its rows
+        stack = [(root, -1, 0)]
+        while stack:
+            obj, parent, depth = stack.pop()
+            row = len(objects)
+            objects.append(obj)
+            parents.append(parent)
+            depths.append(depth)
+            byclass.setdefault(obj.__class__, []).append(row)
+            if isinstance(obj, Group):
+                # reversed, so that children come off the stack in order
+                stack.extend((c, row, depth + 1)
+                             for c in reversed(obj.Elements or ()))
+            elif isinstance(obj, PhotoSet) and obj.Photos:
+                # Photos are leaves, so they are added in one go
+                photos = obj.Photos
+                byclass.setdefault(Photo, []).extend(
+                    xrange(row + 1, row + 1 + len(photos)))
+                objects.extend(photos)
+                parents.extend([row]*len(photos))
+                depths.extend([depth + 1]*len(photos))
+        n = len(objects)
+        self.objects = objects
+        self.parent = numpy.array(parents, dtype='int64')
+        self.depth = numpy.array(depths, dtype='int64')
+        self.kind = numpy.empty(n, dtype='int8')
+        for cls, rows in byclass.iteritems():
+            self.kind[rows] = (PHOTO if issubclass(cls, Photo) else
+                               PHOTOSET if issubclass(cls, PhotoSet) else
+                               GROUP)
+        self.id = self._column('Id', 'int64')
+        # Subtree sizes, summed up the tree one depth at a time
+        size = numpy.ones(n, dtype='int64')
+        for d in xrange(int(self.depth.max()) if n else 0, 0, -1):
+            at = numpy.flatnonzero(self.depth == d)
+            numpy.add.at(size, self.parent[at], size[at])
+        self.end = numpy.arange(n, dtype='int64') + size
+        self._rows = None
+
+    def __getattr__(self, name):
+        # Data columns are extracted on first use
+        if name not in COLUMNS:
+            raise AttributeError(name)
+        column = self._column(*COLUMNS[name])
+        setattr(self, name, column)
+        return column
+
+    def _column(self, field, dtype):
+        dates = dtype.startswith('datetime64')
+        column = numpy.zeros(len(self.objects), dtype=dtype)
+        if dates:
+            column[:] = numpy.datetime64('NaT')
+        objects = self.objects
+        for cls, rows in self._byclass.iteritems():
+            i = cls.__fieldindex__.get(field)
+            if i is None:
+                continue
+            values = [objects[r]._values[i] for r in rows]
+            if dates: # the raw strings (or datetimes, if already parsed)
+                values = [None if v is None else v._values[0]
+                          for v in values]
+            else:
+                values = [v or 0 for v in values]
+            column[rows] = numpy.array(values, dtype=dtype)
+        return column
+
+    def __len__(self):
+        return len(self.objects)
+
+    def row(self, obj, kind=None):
+        """Row of a Group, PhotoSet or Photo (its first, for a photo in
+        several photosets); with kind given, obj may be an Id"""
+        if kind is None:
+            kind = (PHOTO if isinstance(obj, Photo) else
+                    PHOTOSET if isinstance(obj, PhotoSet) else GROUP)
+        if self._rows is None:
+            rows = {}
+            kinds = self.kind.tolist()
+            ids = self.id.tolist()
+            for row in xrange(len(kinds) - 1, -1, -1): # first row wins
+                rows[(kinds[row], ids[row])] = row
+            self._rows = rows
+        return self._rows[(kind, int(obj))]
+
+    def rows(self, kind):
+        """Indices of all rows of one kind"""
+        return numpy.flatnonzero(self.kind == kind)
+
+    def _array(self, column):
+        if isinstance(column, basestring):
+            return getattr(self, column)
+        return numpy.asarray(column)
+
+    def sum(self, column, kind=PHOTO):
+        """For every row, the sum of column over the rows of kind in its
+        subtree (including itself)"""
+        values = numpy.where(self.kind == kind, self._array(column), 0)
+        cum = numpy.concatenate(([0], numpy.cumsum(values)))
+        return cum[self.end] - cum[:-1]
+
+    def count(self, kind=PHOTO):
+        """For every row, the number of rows of kind in its subtree"""
+        return self.sum(numpy.ones(len(self), dtype='int64'), kind)
+
+    def argmax(self, column, kind=PHOTO):
+        """For every row, the row of kind in its subtree with the highest
+        value of column (-1 if there is none)
+
+        Ties go to the row first in preorder, whatever the column's type:
+        values are replaced by their rank and combined with the row number
+        into one integer key, which is then maximised up the tree one depth
+        at a time.
+        """
+        n = len(self)
+        values = self._array(column)
+        mask = self.kind == kind
+        rank = numpy.zeros(n, dtype='int64')
+        if mask.any():
+            rank[mask] = numpy.unique(values[mask], return_inverse=True)[1]
+        rows = numpy.arange(n, dtype='int64')
+        best = numpy.where(mask, rank*n + (n - 1 - rows), -1)
+        for d in xrange(int(self.depth.max()) if n else 0, 0, -1):
+            at = numpy.flatnonzero(self.depth == d)
+            numpy.maximum.at(best, self.parent[at], best[at])
+        return numpy.where(best >= 0, n - 1 - best%n, -1)
+
+    def max(self, column, kind=PHOTO):
+        """For every row, the highest value of column over the rows of kind
+        in its subtree (the column's zero or NaT if there are none)"""
+        values = self._array(column)
+        best = self.argmax(values, kind)
+        result = values[numpy.maximum(best, 0)]
+        if values.dtype.kind == 'M':
+            result[best < 0] = numpy.datetime64('NaT')
+        else:
+            result[best < 0] = 0
+        return result
+
+    def top(self, obj, column, k=10, kind=PHOTO):
+        """Rows of the k highest values of column among the rows of kind
+        below obj (a row, or a Group/PhotoSet), highest first; ties in
+        preorder"""
+        start = obj if isinstance(obj, (int, long, numpy.integer)) \
+            else self.row(obj)
+        stop = self.end[start]
+        rows = start + numpy.flatnonzero(self.kind[start:stop] == kind)
+        if not len(rows):
+            return rows
+        rank = numpy.unique(self._array(column)[rows],
+                            return_inverse=True)[1]
+        return rows[numpy.lexsort((rows, -rank))[:k]]
+
+    def object(self, row):
+        """The snapshot at a row (or None for -1)"""
+        return None if row < 0 else self.objects[row]
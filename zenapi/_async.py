@@ -0,0 +1,1149 @@
+"""Non-blocking client: API calls multiplexed on one event loop thread"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncore
+import errno
+import heapq
+import httplib
+import logging
+import os
+import random
+import select
+import socket
+import sys
+import threading
+import types
+import urlparse
+from collections import deque
+from cStringIO import StringIO
+from time import time
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+from . import _codec, _metrics
+from ._cache import READ_METHODS, NEUTRAL_METHODS, ResponseCache, _ids
+from ._futures import Future
+from ._pool import BLOCKSIZE
+from ._threaded import _syncmethod
+from ._zapi import (ZenConnection, ResponseObject, Photo, HttpError,
+                    DecodeHook, EncodeRequest, RpcResult, MakeHeaders,
+                    IDEMPOTENT_PREFIXES, API_METHODS, USE_TLS,
+                    REDIRECT_CODES, MAX_REDIRECTS)
+
+RECVSIZE = 256*1024
+
+def _wouldblock(e):
+    """True if socket error e only means the operation has to wait"""
+    if ssl is not None and isinstance(e, ssl.SSLError):
+        return e.args[0] in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE)
+    return e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN)
+
+def _socketpair():
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    a = socket.create_connection(listener.getsockname())
+    b, addr = listener.accept()
+    listener.close()
+    return b, a
+
+def _forward(source, target):
+    """Finishes Future target like the finished Future source"""
+    try:
+        result = source.result()
+    except BaseException:
+        target.set_exception(sys.exc_info())
+    else:
+        target.set_result(result)
+
+def _started():
+    """A Future for work which is already under way (so not cancellable)"""
+    f = Future()
+    f.set_running_or_notify_cancel()
+    return f
+
+class _Response(object):
+    """Incremental parser of one HTTP/1.1 response
+
+    status, reason and headers (an httplib.HTTPMessage) are set once the
+    head has arrived.  The body is written to sink if one was given and the
+    status is 2xx; otherwise it is kept as the string body.  received
+    counts the body bytes.
+    """
+
+    def __init__(self, method, sink=None):
+        self.method = method
+        self.status = None
+        self.reason = None
+        self.headers = None
+        self.body = None
+        self.received = 0
+        self.will_close = False
+        self._sink = sink
+        self._chunks = []
+        self._buf = ''
+        self._state = 'head'
+        self._remaining = None
+
+    def feed(self, data):
+        """Parses the next bytes; returns True once the response is complete"""
+        while data and self._state != 'done':
+            data = getattr(self, '_' + self._state)(data)
+        return self._state == 'done'
+
+    def eof(self):
+        """The connection closed; returns True if that ended the body"""
+        if self._state == 'body' and self._remaining is None:
+            self._finish()
+            return True
+        return self._state == 'done'
+
+    def _line(self, data):
+        """Returns (the next line or None if incomplete, the rest of data)"""
+        buf = self._buf + data
+        i = buf.find('\r\n')
+        if i < 0:
+            if len(buf) > 65536:
+                raise httplib.LineTooLong('header line')
+            self._buf = buf
+            return None, ''
+        self._buf = ''
+        return buf[:i], buf[i + 2:]
+
+    def _head(self, data):
+        buf = self._buf + data
+        end = buf.find('\r\n\r\n')
+        if end < 0:
+            if len(buf) > 65536:
+                raise httplib.LineTooLong('response head')
+            self._buf = buf
+            return ''
+        self._buf = ''
+        line, sep, fields = buf[:end + 2].partition('\r\n')
+        words = line.split(None, 2) + ['']
+        try:
+            version, status, reason = words[0], int(words[1]), words[2]
+        except (IndexError, ValueError):
+            raise httplib.BadStatusLine(line)
+        if not version.startswith('HTTP/'):
+            raise httplib.BadStatusLine(line)
+        rest = buf[end + 4:]
+        if 100 <= status < 200:
+            return rest # interim response, the real one follows
+        self.status = status
+        self.reason = reason.strip()
+        self.headers = httplib.HTTPMessage(StringIO(fields), 0)
+        connection = (self.headers.getheader('connection') or '').lower()
+        self.will_close = 'close' in connection or (
+            version == 'HTTP/1.0' and 'keep-alive' not in connection)
+        if self._sink is not None and not 200 <= status < 300:
+            self._sink = None # error bodies are kept for the HttpError
+        encoding = (self.headers.getheader('transfer-encoding') or '').lower()
+        length = self.headers.getheader('content-length')
+        if self.method == 'HEAD' or status in (204, 304):
+            self._finish()
+        elif 'chunked' in encoding:
+            self._state = 'size'
+        elif length is not None:
+            self._remaining = int(length)
+            self._state = 'body'
+            if not self._remaining:
+                self._finish()
+        else:
+            self.will_close = True # the body ends with the connection
+            self._state = 'body'
+        return rest
+
+    def _body(self, data):
+        if self._remaining is None:
+            self._write(data)
+            return ''
+        part = data[:self._remaining]
+        self._write(part)
+        self._remaining -= len(part)
+        if not self._remaining:
+            self._finish()
+        return data[len(part):]
+
+    def _size(self, data):
+        line, rest = self._line(data)
+        if line is not None:
+            try:
+                size = int(line.split(';', 1)[0].strip(), 16)
+            except ValueError:
+                raise httplib.HTTPException('Bad chunk size %r'%line)
+            if size:
+                self._remaining = size
+                self._state = 'chunk'
+            else:
+                self._state = 'trailer'
+        return rest
+
+    def _chunk(self, data):
+        part = data[:self._remaining]
+        self._write(part)
+        self._remaining -= len(part)
+        if not self._remaining:
+            self._state = 'crlf'
+        return data[len(part):]
+
+    def _crlf(self, data):
+        line, rest = self._line(data)
+        if line is not None:
+            self._state = 'size'
+        return rest
+
+    def _trailer(self, data):
+        line, rest = self._line(data)
+        if line == '':
+            self._finish()
+        return rest
+
+    def _write(self, data):
+        self.received += len(data)
+        if self._sink is not None:
+            self._sink.write(data)
+        else:
+            self._chunks.append(data)
+
+    def _finish(self):
+        self._state = 'done'
+        if self._sink is None:
+            self.body = ''.join(self._chunks)
+            self._chunks = []
+
+class _Request(object):
+    """An HTTP request queued on an AsyncTransport"""
+
+    def __init__(self, method, key, path, headers, body, sink, idempotent):
+        self.method = method
+        self.key = key
+        self.sink = sink
+        self.idempotent = idempotent
+        self.future = _started()
+        scheme, host, port = key
+        names = set(k.lower() for k in headers)
+        lines = ['%s %s HTTP/1.1'%(method, path)]
+        if 'host' not in names:
+            if port == (443 if scheme == 'https' else 80):
+                lines.append('Host: %s'%host)
+            else:
+                lines.append('Host: %s:%i'%(host, port))
+        if 'accept-encoding' not in names:
+            lines.append('Accept-Encoding: identity')
+        if isinstance(body, basestring) and 'content-length' not in names:
+            lines.append('Content-Length: %i'%len(body))
+        lines.extend('%s: %s'%(k, v) for k, v in headers.items())
+        self.head = '\r\n'.join(lines) + '\r\n\r\n'
+        self.file = None
+        if isinstance(body, basestring):
+            self.head += body
+        elif body is not None:
+            self.file = body # streamed; needs a Content-Length header
+            self.offset = body.tell()
+        self.sent = 0
+        self.received = False
+
+    def rewind(self):
+        self.sent = 0
+        if self.file is not None:
+            self.file.seek(self.offset)
+
+class _Waker(asyncore.dispatcher):
+    """Wakes the event loop from other threads through a socket pair"""
+
+    def __init__(self, map):
+        r, self._w = _socketpair()
+        self._w.setblocking(0)
+        asyncore.dispatcher.__init__(self, r, map=map)
+
+    def wake(self):
+        try:
+            self._w.send('x')
+        except socket.error:
+            pass # the pair is full, so the loop will wake anyway
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.socket.recv(4096)
+        except socket.error:
+            pass
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self._w.close()
+
+class _Channel(asyncore.dispatcher):
+    """One non-blocking keep-alive connection, carrying a request at a time
+
+    Moves through the states 'connecting', 'handshake' (TLS only), then
+    'sending' and 'receiving' for each request, and 'ready' while idle.
+    """
+
+    def __init__(self, transport, key, addr):
+        asyncore.dispatcher.__init__(self, map=transport._map)
+        self.transport = transport
+        self.key = key
+        self.request = None
+        self.response = None
+        self.reused = False
+        self.served = 0
+        self.activity = time()
+        self.closed = False
+        self._out = deque()
+        self._file = None
+        self._want = None
+        family, sockaddr = addr
+        self.create_socket(family, socket.SOCK_STREAM)
+        try:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            err = self.socket.connect_ex(sockaddr)
+            if err in (0, errno.EISCONN):
+                self._connected()
+            elif err in (errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK):
+                self.state = 'connecting'
+            else:
+                raise socket.error(err, os.strerror(err))
+        except:
+            self.close()
+            raise
+
+    def start(self, request):
+        self.request = request
+        self.response = _Response(request.method, request.sink)
+        self.reused = self.served > 0
+        self.activity = time()
+        self._out = deque([request.head])
+        self._file = request.file
+        if self.state == 'ready':
+            self.state = 'sending'
+
+    def _connected(self):
+        if self.key[0] == 'https':
+            self.socket = ssl.wrap_socket(self.socket,
+                                          ssl_version=self.transport.ssl_version,
+                                          do_handshake_on_connect=False)
+            self.state = 'handshake'
+            self._want = 'write'
+        else:
+            self.state = 'sending' if self.request is not None else 'ready'
+
+    def _checkconnect(self):
+        err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            raise socket.error(err, os.strerror(err))
+        self._connected()
+
+    def _handshake(self):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLError, e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self._want = 'read'
+                return
+            if e.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self._want = 'write'
+                return
+            raise
+        self._want = None
+        self.state = 'sending' if self.request is not None else 'ready'
+
+    def readable(self):
+        if self.state == 'connecting':
+            return False
+        return self.state != 'handshake' or self._want == 'read'
+
+    def writable(self):
+        return (self.state in ('connecting', 'sending') or
+                (self.state == 'handshake' and self._want == 'write'))
+
+    def handle_write_event(self):
+        if self.state == 'connecting':
+            self._checkconnect()
+        if self.state == 'handshake':
+            self._handshake()
+        elif self.state == 'sending':
+            self._send()
+
+    def handle_read_event(self):
+        if self.state == 'handshake':
+            self._handshake()
+        elif self.state != 'connecting':
+            self._recv()
+
+    def handle_expt_event(self):
+        err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            raise socket.error(err, os.strerror(err))
+
+    def _send(self):
+        request = self.request
+        while True:
+            if not self._out:
+                if self._file is None:
+                    break
+                block = self._file.read(BLOCKSIZE)
+                if not block:
+                    self._file = None
+                    break
+                self._out.append(block)
+            data = self._out[0]
+            try:
+                n = self.socket.send(data)
+            except socket.error, e:
+                if _wouldblock(e):
+                    return
+                raise
+            self.activity = time()
+            request.sent += n
+            if n < len(data):
+                self._out[0] = data[n:]
+                return
+            self._out.popleft()
+        self.state = 'receiving'
+
+    def _recv(self, drain=False):
+        while True:
+            try:
+                data = self.socket.recv(RECVSIZE)
+            except socket.error, e:
+                if _wouldblock(e):
+                    return
+                raise
+            if not data:
+                self._eof()
+                return
+            self.activity = time()
+            if self.request is None:
+                # Nothing should arrive on an idle connection
+                self._lost(None)
+                return
+            self.request.received = True
+            if self.response.feed(data):
+                self._done()
+                return
+            # TLS may hold decrypted bytes which poll can't see
+            if not (drain or (self.key[0] == 'https' and self.socket.pending())):
+                return
+
+    def _eof(self):
+        if self.request is not None and self.response.eof():
+            self._done()
+        elif self.request is not None and self.request.received:
+            self._lost(httplib.IncompleteRead('%i bytes'%self.response.received))
+        else:
+            self._lost(httplib.BadStatusLine("''"))
+
+    def _done(self):
+        request, response = self.request, self.response
+        reusable = self.state == 'receiving' and not response.will_close
+        self.request = self.response = None
+        self._out.clear()
+        self._file = None
+        self.served += 1
+        self.state = 'ready'
+        self.activity = time()
+        if not reusable:
+            self.close()
+        self.transport._release(self, request, reusable)
+        request.future.set_result(response)
+
+    def _lost(self, error):
+        """Closes the connection, failing (or resending) its request with
+        error, an exception or sys.exc_info() tuple"""
+        request = self.request
+        self.request = self.response = None
+        self._file = None
+        self.close()
+        if request is None:
+            self.transport._discard(self)
+            return
+        if not isinstance(error, tuple):
+            error = (type(error), error, None)
+        self.transport._release(self, request, False)
+        self.transport._failed(self, request, error)
+
+    def handle_close(self):
+        if self.closed:
+            return
+        if self.request is not None and self.state == 'receiving':
+            try:
+                self._recv(drain=True) # the rest may still be buffered
+            except socket.error:
+                pass
+        if not self.closed:
+            self._lost(socket.error(errno.ECONNRESET,
+                                    'Connection closed by server'))
+
+    def handle_error(self):
+        exc_info = sys.exc_info()
+        if not self.closed:
+            self._lost(exc_info)
+
+    def close(self):
+        self.closed = True
+        asyncore.dispatcher.close(self)
+
+class _Host(object):
+    """Connections to and requests waiting for a single (scheme, host, port)"""
+
+    def __init__(self):
+        self.idle = []   # connections, most recently used last
+        self.busy = 0    # connections opening or carrying a request
+        self.waiting = deque()
+
+class AsyncTransport(object):
+    """HTTP/1.1 requests over non-blocking sockets, on one event loop thread
+
+    A background thread multiplexes every connection with poll (or select)
+    through asyncore.  Each request runs on a keep-alive connection of its
+    own; up to connections requests per host are in flight at once, and
+    any more wait in a queue, so neither costs a thread.  A request which
+    finds its reused connection closed is resent on another under the same
+    rules as ConnectionPool.urlopen: always if none of it was sent, and if
+    idempotent also when no response arrived (but never after a timeout).
+
+    Host names are resolved (blocking) once per host and cached.  Callbacks
+    of the returned futures run on the event loop thread: they must not
+    block, e.g. by waiting for another future.
+
+    params:
+    connections: connections, i.e. requests in flight, per host
+    idle_timeout: seconds an unused connection is kept open
+    timeout: seconds a request may go without any progress before it fails
+    with socket.timeout (None to wait forever)
+    use_tls: as in build_pool
+    """
+
+    def __init__(self, connections=64, idle_timeout=30, timeout=60,
+                 use_tls=USE_TLS):
+        self.connections = connections
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_version = None
+        if ssl is not None:
+            self.ssl_version = (ssl.PROTOCOL_TLSv1 if use_tls
+                                else ssl.PROTOCOL_SSLv23)
+        self.resent = 0
+        self._map = {}
+        self._hosts = {}
+        self._addrs = {}
+        self._timers = [] # heap of (deadline, sequence, fn, args)
+        self._sequence = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._waker = None
+        self._closed = False
+
+    def request(self, method, url, headers=None, body=None, sink=None,
+                idempotent=False):
+        """Queues a request; returns a Future of its response
+
+        body: a string, or an open file which is streamed from its current
+        position (it then needs a Content-Length header, and must stay open
+        until the request finishes)
+        sink: a file to which a 2xx response body is written as it arrives
+        idempotent: see above
+
+        The response has status, reason, headers (an httplib.HTTPMessage),
+        received (the body size) and body (the body as a string, unless it
+        went to sink).  Statuses of 400 and above are not errors here.
+        """
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request = _Request(method, (scheme, parts.hostname, port), path,
+                           headers or {}, body, sink, idempotent)
+        self.call_soon(self._submit, request)
+        return request.future
+
+    def call_soon(self, fn, *args):
+        """Runs fn(*args) on the event loop thread"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('transport is closed')
+            self._pending.append((fn, args))
+            if self._thread is None:
+                self._waker = _Waker(self._map)
+                self._thread = threading.Thread(target=self._run,
+                                                name='zenapi-async')
+                self._thread.setDaemon(True)
+                self._thread.start()
+            waker = self._waker
+        waker.wake()
+
+    def call_later(self, delay, fn, *args):
+        """Runs fn(*args) on the event loop thread after delay seconds"""
+        self.call_soon(self._schedule, time() + delay, fn, args)
+
+    def _schedule(self, deadline, fn, args):
+        self._sequence += 1
+        heapq.heappush(self._timers, (deadline, self._sequence, fn, args))
+
+    def close(self):
+        """Closes every connection and stops the event loop thread; requests
+        still queued or in flight fail"""
+        with self._lock:
+            if self._closed:
+                return
+            thread = self._thread
+            if thread is None:
+                self._closed = True
+                return
+            self._pending.append((self._shutdown, ()))
+            waker = self._waker
+        waker.wake()
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _run(self):
+        use_poll = hasattr(select, 'poll')
+        while True:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    fn, args = self._pending.popleft()
+                self._guarded(fn, args)
+            if self._closed:
+                return
+            now = time()
+            while self._timers and self._timers[0][0] <= now:
+                deadline, sequence, fn, args = heapq.heappop(self._timers)
+                self._guarded(fn, args)
+            self._expire(now)
+            wait = 1.0
+            if self.timeout is not None:
+                wait = min(wait, self.timeout/4.)
+            if self._timers:
+                wait = max(0, min(wait, self._timers[0][0] - now))
+            asyncore.loop(wait, use_poll, self._map, 1)
+
+    @staticmethod
+    def _guarded(fn, args):
+        try:
+            fn(*args)
+        except Exception:
+            logging.exception('Exception in event loop callback %r', fn)
+
+    def _expire(self, now):
+        """Fails requests past the timeout and closes connections idle
+        past idle_timeout"""
+        for channel in self._map.values():
+            if not isinstance(channel, _Channel):
+                continue
+            if channel.request is not None:
+                if (self.timeout is not None and
+                    now - channel.activity > self.timeout):
+                    channel._lost(socket.timeout('timed out'))
+            elif now - channel.activity > self.idle_timeout:
+                channel._lost(None)
+
+    def _host(self, key):
+        host = self._hosts.get(key)
+        if host is None:
+            host = self._hosts[key] = _Host()
+        return host
+
+    def _resolve(self, key):
+        addr = self._addrs.get(key)
+        if addr is None:
+            scheme, hostname, port = key
+            family, socktype, proto, name, sockaddr = socket.getaddrinfo(
+                hostname, port, 0, socket.SOCK_STREAM)[0]
+            addr = self._addrs[key] = (family, sockaddr)
+        return addr
+
+    def _submit(self, request):
+        if self._closed:
+            request.future.set_exception(RuntimeError('transport is closed'))
+            return
+        host = self._host(request.key)
+        while host.idle:
+            channel = host.idle.pop()
+            if not channel.closed:
+                host.busy += 1
+                channel.start(request)
+                return
+        if host.busy >= self.connections:
+            host.waiting.append(request)
+            return
+        host.busy += 1
+        try:
+            channel = _Channel(self, request.key, self._resolve(request.key))
+        except Exception:
+            host.busy -= 1
+            request.future.set_exception(sys.exc_info())
+            return
+        channel.start(request)
+
+    def _release(self, channel, request, reusable):
+        host = self._host(channel.key)
+        host.busy -= 1
+        if reusable:
+            host.idle.append(channel)
+        if host.waiting and host.busy < self.connections:
+            self._submit(host.waiting.popleft())
+
+    def _discard(self, channel):
+        host = self._host(channel.key)
+        if channel in host.idle:
+            host.idle.remove(channel)
+
+    def _failed(self, channel, request, exc_info):
+        error = exc_info[1]
+        if (channel.reused and not self._closed and not request.received and
+            not isinstance(error, socket.timeout) and
+            (request.sent == 0 or request.idempotent)):
+            # The server dropped the kept-alive connection: resend
+            self.resent += 1
+            request.rewind()
+            self._submit(request)
+        else:
+            request.future.set_exception(exc_info)
+
+    def _shutdown(self):
+        with self._lock:
+            self._closed = True
+        error = RuntimeError('transport is closed')
+        for channel in self._map.values():
+            if isinstance(channel, _Channel):
+                channel._lost(error)
+        for host in self._hosts.values():
+            while host.waiting:
+                host.waiting.popleft().future.set_exception(error)
+        self._waker.close()
+
+class _Pending(BaseException):
+    """Stops a replayed ZenConnection method at a call not yet sent
+
+    (A BaseException so that the method's own except clauses pass it on)
+    """
+
+    def __init__(self, method, kwargs):
+        BaseException.__init__(self, method)
+        self.method = method
+        self.kwargs = kwargs
+
+class _Replay(object):
+    """Stands in for a ZenConnection while one of its methods is replayed
+
+    The method's code runs unchanged, but where it would put a call on the
+    wire (_dispatch) it gets the outcome of that call from outcomes, the
+    finished Futures of an earlier run; the first call beyond them stops
+    the run with _Pending, so it can be sent without blocking and the
+    method replayed once it is answered.  Methods calling one another
+    (e.g. Authenticate calls GetChallenge) stay on the replay; all other
+    attributes are read from and written to the connection.
+    """
+    __slots__ = ('_connection', '_outcomes', '_step')
+
+    def __init__(self, connection, outcomes):
+        object.__setattr__(self, '_connection', connection)
+        object.__setattr__(self, '_outcomes', outcomes)
+        object.__setattr__(self, '_step', 0)
+
+    def __getattr__(self, name):
+        fn = ZenConnection.__dict__.get(name)
+        if isinstance(fn, types.FunctionType):
+            return types.MethodType(fn, self)
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+
+    def _dispatch(self, method, **kwargs):
+        if self._step == len(self._outcomes):
+            raise _Pending(method, kwargs)
+        sent = self._outcomes[self._step]
+        object.__setattr__(self, '_step', self._step + 1)
+        return sent.result()
+
+class AsyncZenConnection(object):
+    """ZenConnection whose API calls are sent without blocking
+
+    The API methods (LoadGroup, LoadPhotoSet, Search*, Update*, ...), plus
+    download and upload, take the same arguments as on ZenConnection but
+    return a Future at once.  Requests go out over non-blocking keep-alive
+    sockets driven by a single event loop thread (see AsyncTransport), so
+    hundreds of calls may be in flight without a thread apiece; responses
+    are decoded on that thread.
+
+    The wrapped connection's cache, lazy mode, coalescing of identical
+    reads, index, re-authentication and retries (the retries and backoff
+    of its throttle, and its rate limit) apply as on ZenConnection; calls
+    in flight are bounded by the transport's connections per host rather
+    than by the throttle's adaptive limit.  The bulk helpers (download_group,
+    sync, update_many, ...) are left to self.connection or to
+    ThreadPoolZenConnection.
+
+    Futures' callbacks run on the event loop thread and must not block.
+
+    >>> zen = AsyncZenConnection(username='demo', connections=100)
+    >>> fs = [zen.LoadPhoto(i) for i in ids]
+    >>> photos = [f.result() for f in fs]
+    """
+
+    def __init__(self, username=None, password=None, filename=None,
+                 connection=None, transport=None, connections=64, timeout=60):
+        """
+        params:
+        connection: an existing ZenConnection to wrap.  If None, one is built
+        from username/password/filename
+        transport: an AsyncTransport to send through; by default a new one
+        with connections per host and timeout (see AsyncTransport)
+        """
+        if connection is None:
+            connection = ZenConnection(username=username, password=password,
+                                       filename=filename)
+        if transport is None:
+            transport = AsyncTransport(connections=connections, timeout=timeout)
+        self.connection = connection
+        self.transport = transport
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _getauth(self):
+        return self.connection.auth
+    def _setauth(self, val):
+        self.connection.auth = val
+    auth = property(fget=_getauth, fset=_setauth)
+
+    @staticmethod
+    def load(filename, **kwargs):
+        """Loads a connection saved with save(); kwargs as for __init__"""
+        return AsyncZenConnection(connection=ZenConnection.load(filename),
+                                  **kwargs)
+
+    def close(self):
+        """Closes the transport; calls still in flight fail"""
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def call(self, method, useMyAuthentication=True, **kwargs):
+        """ZenConnection.call without blocking; returns a Future"""
+        return self._replay('call', method, useMyAuthentication, **kwargs)
+
+    def _replay(self, name, *args, **kwargs):
+        """Runs ZenConnection method name with its calls sent
+        asynchronously (see _Replay); returns a Future of its result"""
+        fn = ZenConnection.__dict__[name]
+        result = _started()
+        outcomes = []
+        def step(sent=None):
+            if sent is not None:
+                outcomes.append(sent)
+            try:
+                value = fn(_Replay(self.connection, outcomes), *args, **kwargs)
+            except _Pending, p:
+                self._dispatch(p.method, **p.kwargs).add_done_callback(step)
+            except BaseException:
+                result.set_exception(sys.exc_info())
+            else:
+                result.set_result(value)
+        step()
+        return result
+
+    def _dispatch(self, method, **kwargs):
+        if self.connection.flights is None or method not in READ_METHODS:
+            return self._send(method, **kwargs)
+        # Identical reads already in flight are shared, not repeated
+        key = ResponseCache.key(method, kwargs.get('params'),
+                                kwargs.get('auth'))
+        with self._lock:
+            shared = self._flights.get(key)
+            if shared is not None:
+                self.coalesced += 1
+                return shared
+            shared = self._flights[key] = _started()
+        def landed(f):
+            with self._lock:
+                del self._flights[key]
+            _forward(f, shared)
+        self._send(method, **kwargs).add_done_callback(landed)
+        return shared
+
+    def _send(self, method, auth=None, use_ssl=False, params=None):
+        """Sends a call through the connection's cache (see ResponseCache.call)"""
+        if params is None:
+            params = []
+        connection = self.connection
+        cache = connection.cache
+        result = _started()
+        if cache is not None and method in READ_METHODS:
+            key = cache.key(method, params, auth)
+            try:
+                plain = cache.get(key)
+            except KeyError:
+                cache.misses += 1
+            else:
+                cache.hits += 1
+                result.set_result(ResponseObject.build(plain, connection.lazy))
+                return result
+            generation = cache._generation
+        # The cache keeps plain results, and lazy mode builds them later
+        plain = cache is not None or connection.lazy
+        def answered(f):
+            try:
+                value = f.result()
+            except BaseException:
+                exc_info = sys.exc_info()
+                if cache is not None and method not in READ_METHODS and \
+                   method not in NEUTRAL_METHODS:
+                    cache.invalidate(_ids(params, set()))
+                result.set_exception(exc_info)
+                return
+            if cache is not None:
+                if method in READ_METHODS:
+                    cache.put(key, value, params, generation)
+                elif method not in NEUTRAL_METHODS:
+                    cache.invalidate(_ids(params, set()))
+            if plain:
+                value = ResponseObject.build(value, connection.lazy)
+            result.set_result(value)
+        sent = _started()
+        sent.add_done_callback(answered)
+        self._attempt(sent, method, params, auth, use_ssl,
+                      None if plain else DecodeHook, 0)
+        return result
+
+    def _attempt(self, sent, method, params, auth, use_ssl, hook, attempt):
+        """Posts a call, retrying as the connection's throttle allows"""
+        throttle = self.connection.throttle
+        bucket = getattr(throttle, 'bucket', None)
+        if bucket is not None and not bucket.try_consume():
+            self.transport.call_later(1./bucket.rate, self._attempt, sent,
+                                      method, params, auth, use_ssl, hook,
+                                      attempt)
+            return
+        url, headers, data = EncodeRequest(method, params, auth, use_ssl)
+        idempotent = method.startswith(IDEMPOTENT_PREFIXES)
+        t0 = time()
+        def answered(f):
+            m = _metrics.registry
+            received = 0
+            try:
+                resp = f.result()
+                received = resp.received
+                if resp.status >= 400:
+                    logging.warning('ZenFolio API Call for %s failed with '
+                                    'params: %s\nresponse code %d with '
+                                    'body:\n %s', method, params, resp.status,
+                                    resp.body)
+                    raise HttpError(code=resp.status, headers=resp.headers,
+                                    url=url, body=resp.body)
+                value = RpcResult(_codec.codec.loads(resp.body, hook))
+            except Exception, e:
+                exc_info = sys.exc_info()
+                if m is not None:
+                    m.record_call(method, time() - t0, len(data), received, e)
+                if (throttle is not None and idempotent and
+                    attempt < throttle.retries and throttle.transient(e)):
+                    throttle.retried += 1
+                    self.transport.call_later(throttle.delay(attempt, e),
+                                              self._attempt, sent, method,
+                                              params, auth, use_ssl, hook,
+                                              attempt + 1)
+                else:
+                    sent.set_exception(exc_info)
+                return
+            if m is not None:
+                m.record_call(method, time() - t0, len(data), received)
+            sent.set_result(value)
+        self.transport.request('POST', url, headers, data,
+                               idempotent=idempotent).add_done_callback(answered)
+
+    def download(self, photo, fn=None, path=None, skip_existing=False,
+                 set_mtime=False, size=Photo.Original):
+        """Downloads a photo using current authentication (see Photo.download)
+
+        The event loop thread writes the photo to a temporary file next to
+        its destination as it arrives, and renames it into place once
+        complete.  Redirects are followed as by OpenUrl.
+        
+        returns: a Future of True if downloaded, False if skipped
+        """
+        if fn is None:
+            fn = photo.Title
+        if path is None:
+            path = os.curdir
+        fp = os.path.join(path, fn)
+        base = os.path.dirname(fp)
+        if not os.path.isdir(base):
+            os.makedirs(base)
+        result = _started()
+        if skip_existing and os.path.isfile(fp):
+            result.set_result(False)
+            return result
+        if set_mtime:
+            from time import mktime
+            ts = mktime(photo.UploadedOn.Value.timetuple())
+        url = photo.getUrl(size=size)
+        tmp = '%s.%08x.part'%(fp, random.randint(0, 2**32 - 1))
+        out = os.fdopen(os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_EXCL|
+                                getattr(os, 'O_BINARY', 0), 0666), 'wb')
+        headers = MakeHeaders(auth=self.auth)
+        t0 = time()
+        def fetched(f, url=url, hops=MAX_REDIRECTS):
+            m = _metrics.registry
+            try:
+                resp = f.result()
+                location = resp.headers.getheader('Location')
+                if resp.status in REDIRECT_CODES and location and hops:
+                    # Only 2xx bodies reach out, so it is still empty
+                    url = urlparse.urljoin(url, location)
+                    self.transport.request(
+                        'GET', url, headers, sink=out, idempotent=True
+                    ).add_done_callback(lambda f: fetched(f, url, hops - 1))
+                    return
+                out.close()
+                if resp.status >= 300:
+                    raise HttpError(code=resp.status, headers=resp.headers,
+                                    url=url, body=resp.body)
+                expected = resp.headers.getheader('Content-Length')
+                if expected is not None and int(expected) != resp.received:
+                    raise httplib.IncompleteRead('%i bytes'%resp.received,
+                                                 int(expected) - resp.received)
+                if os.name == 'nt' and os.path.exists(fp):
+                    os.remove(fp) # rename won't replace a file on windows
+                os.rename(tmp, fp)
+                if set_mtime:
+                    os.utime(fp, (ts, ts))
+            except Exception, e:
+                exc_info = sys.exc_info()
+                out.close()
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                if m is not None:
+                    m.record_transfer('download', time() - t0, 0, e)
+                result.set_exception(exc_info)
+                return
+            if m is not None:
+                m.record_transfer('download', time() - t0, resp.received)
+            result.set_result(True)
+        try:
+            sent = self.transport.request('GET', url, headers, sink=out,
+                                          idempotent=True)
+        except:
+            out.close()
+            os.remove(tmp)
+            raise
+        sent.add_done_callback(fetched)
+        return result
+
+    def upload(self, photoset, file_name, autoFillUpdater=True, updater=None,
+               filenameStripRoot=True):
+        """Uploads a photo (see ZenConnection.upload)
+
+        The event loop thread streams the file from disk, then the photo's
+        UpdatePhoto call is sent.  returns: a Future of the updated Photo
+        """
+        if not photoset.Type == 'Gallery':
+            raise TypeError('Photoset must be a gallery to support uploads')
+        connection = self.connection
+        url, headers, zfilename = connection._uploadrequest(
+            photoset, file_name, filenameStripRoot)
+        updater = ZenConnection._uploadupdater(file_name, zfilename,
+                                               autoFillUpdater, updater)
+        body = open(file_name, 'rb')
+        result = _started()
+        t0 = time()
+        def uploaded(f):
+            body.close()
+            m = _metrics.registry
+            try:
+                resp = f.result()
+                if resp.status >= 400:
+                    raise HttpError(code=resp.status, headers=resp.headers,
+                                    url=url, body=resp.body)
+                photo_id = _codec.codec.loads(resp.body)
+            except Exception, e:
+                exc_info = sys.exc_info()
+                if m is not None:
+                    m.record_transfer('upload', time() - t0, 0, e)
+                result.set_exception(exc_info)
+                return
+            if m is not None:
+                m.record_transfer('upload', time() - t0,
+                                  headers['Content-Length'])
+            if connection.cache is not None:
+                connection.cache.invalidate([int(photoset)])
+            self.UpdatePhoto(Photo({'Id':photo_id}),
+                             updater).add_done_callback(updated)
+        def updated(f):
+            try:
+                photo = f.result()
+            except BaseException:
+                result.set_exception(sys.exc_info())
+                return
+            if connection.index is not None:
+                connection.index.addPhoto(photo, photoset)
+            result.set_result(photo)
+        try:
+            sent = self.transport.request('POST', url, headers, body)
+        except:
+            body.close()
+            raise
+        sent.add_done_callback(uploaded)
+        return result
+
+def _replaymethod(name):
+    method = ZenConnection.__dict__[name]
+    def _call(self, *args, **kwargs):
+        return self._replay(name, *args, **kwargs)
+    _call.__name__ = name
+    _call.__doc__ = ((method.__doc__ or '').rstrip() +
+                     '\n\n(Sent without blocking: returns a Future)')
+    return _call
+
+for _name in API_METHODS:
+    setattr(AsyncZenConnection, _name, _replaymethod(_name))
+for _name in ('enable_cache', 'disable_cache', 'set_limits', 'ensure_auth',
+              'keep_authenticated', 'stop_auth_refresh', 'index_hierarchy',
+              'mirror', 'save'):
+    setattr(AsyncZenConnection, _name,
+            _syncmethod(_name, ZenConnection.__dict__[_name]))
+del _name
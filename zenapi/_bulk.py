@@ -0,0 +1,249 @@
+"""Concurrent bulk Update* calls with resumable progress"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from time import time
+
+from ._futures import Executor
+from ._zapi import (Group, PhotoSet, Photo, AccessUpdater, GroupUpdater,
+                    PhotoSetUpdater, PhotoUpdater)
+
+# Update call for each kind of updater, and for access updaters by target
+METHODS = {GroupUpdater:'UpdateGroup', PhotoSetUpdater:'UpdatePhotoSet',
+           PhotoUpdater:'UpdatePhoto'}
+ACCESS_METHODS = {Group:'UpdateGroupAccess', PhotoSet:'UpdatePhotoSetAccess',
+                  Photo:'UpdatePhotoAccess'}
+
+class UpdateResult(object):
+    """Outcome of one (target, updater) pair
+
+    id: the target's id (or the item itself, if it is not a valid pair)
+    method: the Update* call made for it (None if none applies)
+    status: 'updated', 'unchanged' (nothing to send), 'skipped' (already
+    done according to the checkpoint) or 'failed'
+    result: what the call returned (e.g. the updated snapshot), if made
+    error: the exception, if it failed
+    """
+
+    def __init__(self, id, method):
+        self.id = id
+        self.method = method
+        self.status = None
+        self.result = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        method = self.method or 'Update'
+        if self.ok:
+            return '<UpdateResult %s %s: %s>'%(method, self.id, self.status)
+        return '<UpdateResult %s %s: failed: %s>'%(method, self.id, self.error)
+
+class UpdateReport(object):
+    """Per-item UpdateResults of a bulk update, in input order"""
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    def _with(self, status):
+        return [r for r in self.results if r.status == status]
+
+    @property
+    def updated(self):
+        return self._with('updated')
+
+    @property
+    def unchanged(self):
+        return self._with('unchanged')
+
+    @property
+    def skipped(self):
+        return self._with('skipped')
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return self._with('failed')
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return ('<%s: %i updated, %i unchanged, %i skipped, %i failed '
+                'in %.1fs>'%(self.__class__.__name__, len(self.updated),
+                             len(self.unchanged), len(self.skipped),
+                             len(self.failed), self.elapsed))
+
+class UpdateCheckpoint(object):
+    """Append-only record of the updates already applied
+
+    Each finished update adds one JSON line holding its method, target id
+    and a fingerprint of the fields sent, so a rerun skips exactly the
+    updates that were made (and still makes ones whose fields differ).
+    Lines are flushed as they are written, so progress survives a crash.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                for line in f:
+                    try:
+                        d = json.loads(line)
+                    except ValueError: # cut short by a crash
+                        continue
+                    self.done.add((d['method'], d['id'], d['fields']))
+        self._file = open(filename, 'ab')
+
+    @staticmethod
+    def fingerprint(updater):
+        d = updater.asdict()
+        return hashlib.sha1(json.dumps(d, sort_keys=True)).hexdigest()
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, key):
+        method, id, fields = key
+        line = json.dumps({'method':method, 'id':id, 'fields':fields})
+        with self._lock:
+            self.done.add(key)
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class BulkUpdater(object):
+    """Runs Update* calls for (target, updater) pairs on a pool of workers
+
+    params:
+    zen: an authenticated ZenConnection
+    workers: number of concurrent calls
+    checkpoint: None, or the filename of an UpdateCheckpoint
+    progress: called as progress(result) when each item finishes
+    """
+
+    def __init__(self, zen, workers=8, checkpoint=None, progress=None):
+        self.zen = zen
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.progress = progress
+
+    @staticmethod
+    def method(target, updater):
+        if isinstance(updater, AccessUpdater):
+            for cls, method in ACCESS_METHODS.iteritems():
+                if isinstance(target, cls):
+                    return method
+            raise TypeError('Access updates need a Group, PhotoSet or Photo '
+                            'snapshot as target, not %r'%(target,))
+        if updater is None:
+            cls = getattr(target, '__updater__', None)
+            if cls is None:
+                raise TypeError('Without an updater the target must be a '
+                                'Group, PhotoSet or Photo snapshot, not %r'%(
+                                    target,))
+        else:
+            cls = updater.__class__
+        return METHODS[cls]
+
+    def _finish(self, result, status, error=None):
+        result.status = status
+        if error is not None:
+            logging.warning('%s of %s failed: %s', result.method or 'Update',
+                            result.id, error)
+            result.error = error
+        if self.progress is not None:
+            try:
+                self.progress(result)
+            except Exception:
+                logging.exception('Update progress callback failed')
+
+    def _update(self, result, target, updater, tracked, key, checkpoint):
+        try:
+            result.result = getattr(self.zen, result.method)(target, updater)
+        except Exception, e:
+            self._finish(result, 'failed', e)
+            return
+        if tracked: # the updater was made from the target's changes
+            target.clear_changes(*[k for k, v in updater._items()
+                                   if v is not None])
+        if checkpoint is not None:
+            checkpoint.add(key)
+        self._finish(result, 'updated')
+
+    def run(self, items):
+        """Applies every (target, updater) pair; returns an UpdateReport"""
+        t0 = time()
+        checkpoint = None
+        if self.checkpoint is not None:
+            checkpoint = UpdateCheckpoint(self.checkpoint)
+        pool = Executor(max_workers=self.workers, name='zenapi-update')
+        results = []
+        try:
+            fs = []
+            for item in items:
+                result = UpdateResult(item, None)
+                results.append(result)
+                try:
+                    target, updater = item
+                    result.id = int(target)
+                    result.method = self.method(target, updater)
+                    tracked = updater is None
+                    if tracked:
+                        updater = target.updater()
+                        if updater is None:
+                            self._finish(result, 'unchanged')
+                            continue
+                    key = (result.method, result.id,
+                           UpdateCheckpoint.fingerprint(updater))
+                except Exception, e: # a bad pair fails on its own
+                    self._finish(result, 'failed', e)
+                    continue
+                if checkpoint is not None and key in checkpoint:
+                    self._finish(result, 'skipped')
+                    continue
+                fs.append(pool.submit(self._update, result, target, updater,
+                                      tracked, key, checkpoint))
+            for f in fs:
+                f.result()
+        finally:
+            # Let running updates finish before the checkpoint is closed
+            pool.shutdown(wait=True, cancel_pending=True)
+            if checkpoint is not None:
+                checkpoint.close()
+        return UpdateReport(results, time() - t0)
@@ -0,0 +1,181 @@
+"""In-memory cache for read-only API calls"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from time import time
+
+# Calls whose results may be cached
+READ_METHODS = frozenset([
+    'LoadGroup', 'LoadGroupHierarchy', 'LoadPhoto', 'LoadPhotoSet',
+    'LoadPrivateProfile', 'LoadPublicProfile', 'GetCategories',
+    'GetPopularPhotos', 'GetPopularSets', 'GetRecentPhotos', 'GetRecentSets',
+])
+
+# Calls which neither may be cached nor change anything
+NEUTRAL_METHODS = frozenset([
+    'GetChallenge', 'Authenticate', 'AuthenticatePlain',
+    'GetDownloadOriginalKey', 'KeyringAddKeyPlain', 'SearchPhotoByCategory',
+    'SearchPhotoByText', 'SearchSetByCategory', 'SearchSetByText',
+])
+
+def _ids(obj, found):
+    """Collects every integer in params, and every Id in a decoded result"""
+    if isinstance(obj, bool):
+        return found
+    if isinstance(obj, (int, long)):
+        found.add(obj)
+    elif isinstance(obj, dict):
+        if 'Id' in obj:
+            found.add(obj['Id'])
+        for v in obj.itervalues():
+            if isinstance(v, (list, tuple, dict)):
+                _ids(v, found)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            _ids(v, found)
+    return found
+
+class _Entry(object):
+    __slots__ = ('result', 'expires', 'keyids', 'tags')
+
+    def __init__(self, result, expires, keyids, tags):
+        self.result = result
+        self.expires = expires
+        self.keyids = keyids
+        self.tags = tags
+
+class ResponseCache(object):
+    """TTL + LRU cache of decoded results of the READ_METHODS
+
+    Entries are keyed on (method, params, auth token), so the information
+    level and the caller's identity are part of the key.  Each entry is
+    tagged with every object Id it references (in its params or anywhere in
+    its result).  Any other call except the NEUTRAL_METHODS is treated as a
+    mutation: afterwards every entry referencing an Id in its params is
+    dropped, along with entries about the objects those entries describe
+    (e.g. DeletePhoto drops LoadPhotoSet(gallery, includePhotos=True), and
+    then LoadPhotoSet(gallery) without photos too).
+
+    params:
+    ttl: seconds an entry stays valid (None for no expiry)
+    maxsize: maximum number of entries; least recently used are evicted
+    """
+
+    def __init__(self, ttl=60, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tags = {} # Id -> set of keys
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(method, params, auth):
+        return (method, json.dumps(params, sort_keys=True), auth)
+
+    def get(self, key):
+        """Returns the cached result for key, or raises KeyError"""
+        with self._lock:
+            e = self._entries.pop(key)
+            if e.expires is not None and e.expires < time():
+                self._untag(key, e)
+                raise KeyError(key)
+            self._entries[key] = e # most recently used
+            return e.result
+
+    def put(self, key, result, params, generation=None):
+        """Stores a result unless an invalidation happened since generation"""
+        keyids = _ids(params, set())
+        tags = _ids(result, set(keyids))
+        expires = None if self.ttl is None else time() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._untag(key, old)
+            self._entries[key] = _Entry(result, expires, keyids, tags)
+            for t in tags:
+                self._tags.setdefault(t, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                k, e = self._entries.popitem(last=False)
+                self._untag(k, e)
+
+    def _untag(self, key, entry):
+        for t in entry.tags:
+            keys = self._tags.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[t]
+
+    def _remove(self, keys):
+        for k in keys:
+            e = self._entries.pop(k, None)
+            if e is not None:
+                self._untag(k, e)
+
+    def invalidate(self, ids):
+        """Drops entries referencing any of ids (and one hop further)"""
+        with self._lock:
+            self._generation += 1
+            ids = set(ids)
+            first = set()
+            for i in ids:
+                first.update(self._tags.get(i, ()))
+            for k in first:
+                ids.update(self._entries[k].keyids)
+            drop = set()
+            for i in ids:
+                drop.update(self._tags.get(i, ()))
+            self._remove(drop)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def call(self, fn, method, params=None, auth=None, **kwargs):
+        """Runs fn(method, params=params, auth=auth, **kwargs) through the cache"""
+        if method in READ_METHODS:
+            key = self.key(method, params, auth)
+            try:
+                result = self.get(key)
+                self.hits += 1
+                return result
+            except KeyError:
+                self.misses += 1
+            generation = self._generation
+            result = fn(method, params=params, auth=auth, **kwargs)
+            self.put(key, result, params, generation)
+            return result
+        try:
+            return fn(method, params=params, auth=auth, **kwargs)
+        finally:
+            if method not in NEUTRAL_METHODS:
+                self.invalidate(_ids(params, set()))
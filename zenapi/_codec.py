@@ -0,0 +1,171 @@
+"""Pluggable JSON encoding and decoding of API requests and responses"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+from decimal import Decimal
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import ijson.backends.yajl2_c as ijson # the fastest backend, if built
+except ImportError:
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+# Backends in order of preference when none is named.  ujson is only used
+# when asked for: it differs from json in corner cases (float precision,
+# unicode escapes, big integers)
+PREFERRED = ('simplejson', 'json')
+
+def _number(value):
+    """ijson gives ints for integers and Decimals otherwise; json gives floats"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+class CountingReader(object):
+    """Wraps a file-like response, counting the bytes read through it"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+
+    def read(self, amt=None):
+        data = self.fp.read(amt) if amt is not None else self.fp.read()
+        self.count += len(data)
+        return data
+
+class Codec(object):
+    """Encodes requests and decodes responses with one JSON library
+
+    params:
+    name: 'ujson', 'simplejson' or 'json' (the standard library); by
+    default the first of PREFERRED which is installed.  ujson has no
+    object_hook, so hooked loads (e.g. of snapshots) go through simplejson
+    or json instead, which apply it while parsing
+    stream: if True and ijson is installed, responses are parsed as they
+    arrive from the socket (see load) instead of being read into one
+    string first
+    """
+
+    def __init__(self, name=None, stream=False):
+        if name is None:
+            name = [n for n in PREFERRED if self.available(n)][0]
+        elif not self.available(name):
+            raise ImportError('JSON library %s is not installed'%name)
+        self.name = name
+        self.module = {'json':json, 'simplejson':simplejson,
+                       'ujson':ujson}[name]
+        # Used for loads with an object_hook
+        self.hooked = self.module
+        if self.module is ujson:
+            self.hooked = simplejson or json
+        self.stream = bool(stream) and ijson is not None
+
+    def __repr__(self):
+        return '<Codec %s%s>'%(self.name, ', streaming' if self.stream else '')
+
+    @staticmethod
+    def available(name):
+        return {'json':json, 'simplejson':simplejson, 'ujson':ujson,
+                'ijson':ijson}.get(name) is not None
+
+    def dumps(self, obj):
+        return self.module.dumps(obj)
+
+    def loads(self, s, object_hook=None):
+        if object_hook is None:
+            return self.module.loads(s)
+        return self.hooked.loads(s, object_hook=object_hook)
+
+    def load(self, fp, object_hook=None):
+        """Decodes a file-like object (e.g. a response)
+
+        When streaming, the document is built from parser events as bytes
+        are read, applying object_hook to each object as it is closed, so
+        neither the raw body nor an intermediate dict tree is held in full.
+        Otherwise the body is read and passed to loads.
+        """
+        if not self.stream:
+            return self.loads(fp.read(), object_hook)
+        return _build(ijson.parse(fp), object_hook)
+
+def _build(events, object_hook):
+    """Assembles the document described by ijson.parse events"""
+    stack = []  # containers being filled
+    keys = []   # for each dict on the stack, the key being filled
+    root = []
+    for _, event, value in events:
+        if event == 'map_key':
+            keys[-1] = value
+            continue
+        if event == 'start_map':
+            stack.append({})
+            keys.append(None)
+            continue
+        if event == 'start_array':
+            stack.append([])
+            keys.append(None)
+            continue
+        if event == 'end_map':
+            value = stack.pop()
+            keys.pop()
+            if object_hook is not None:
+                value = object_hook(value)
+        elif event == 'end_array':
+            value = stack.pop()
+            keys.pop()
+        elif event == 'number':
+            value = _number(value)
+        if not stack:
+            root.append(value)
+        elif keys[-1] is None:
+            stack[-1].append(value)
+        else:
+            stack[-1][keys[-1]] = value
+    if len(root) != 1:
+        raise ValueError('Expected one JSON document')
+    return root[0]
+
+# The codec used by MakeRequest and Call
+codec = Codec()
+
+def use_codec(name=None, stream=False):
+    """Switches the JSON library (and streaming) used for API calls
+
+    params: as in Codec; returns the new Codec
+    """
+    global codec
+    codec = Codec(name, stream)
+    return codec
+
+def get_codec():
+    """The Codec used for API calls"""
+    return codec
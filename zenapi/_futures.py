@@ -0,0 +1,342 @@
+"""Minimal futures and bounded thread-pool executor"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import threading
+import Queue
+from time import time
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+CANCELLED = 'CANCELLED'
+FINISHED = 'FINISHED'
+
+FIRST_COMPLETED = 'FIRST_COMPLETED'
+FIRST_EXCEPTION = 'FIRST_EXCEPTION'
+ALL_COMPLETED = 'ALL_COMPLETED'
+
+class CancelledError(Exception):
+    pass
+
+class TimeoutError(Exception):
+    pass
+
+class Future(object):
+    """The eventual result of a call submitted to an Executor"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._state = PENDING
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def __repr__(self):
+        return '<Future %s>'%self._state
+
+    def cancel(self):
+        """Cancels the call if it has not started; returns True on success"""
+        with self._cond:
+            if self._state in (RUNNING, FINISHED):
+                return False
+            if self._state == PENDING:
+                self._state = CANCELLED
+                self._cond.notify_all()
+        self._invoke_callbacks()
+        return True
+
+    def cancelled(self):
+        return self._state == CANCELLED
+
+    def running(self):
+        return self._state == RUNNING
+
+    def done(self):
+        return self._state in (CANCELLED, FINISHED)
+
+    def _wait(self, timeout):
+        with self._cond:
+            if not self.done():
+                if timeout is None:
+                    while not self.done():
+                        self._cond.wait(1) # keeps KeyboardInterrupt working
+                else:
+                    deadline = time() + timeout
+                    while not self.done() and time() < deadline:
+                        self._cond.wait(deadline - time())
+            if self._state == CANCELLED:
+                raise CancelledError()
+            if self._state != FINISHED:
+                raise TimeoutError()
+
+    def result(self, timeout=None):
+        """Waits for and returns the result, re-raising any exception"""
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Waits for the call and returns its exception (or None)"""
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """Calls fn(future) when done; immediately if already done"""
+        with self._cond:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_running_or_notify_cancel(self):
+        with self._cond:
+            if self._state == CANCELLED:
+                return False
+            self._state = RUNNING
+            return True
+
+    def set_result(self, result):
+        with self._cond:
+            self._result = result
+            self._state = FINISHED
+            self._cond.notify_all()
+        self._invoke_callbacks()
+
+    def set_exception(self, exc_info):
+        """Sets the exception from a sys.exc_info() tuple"""
+        if not isinstance(exc_info, tuple):
+            exc_info = (type(exc_info), exc_info, None)
+        with self._cond:
+            self._exc_info = exc_info
+            self._state = FINISHED
+            self._cond.notify_all()
+        self._invoke_callbacks()
+
+    def _invoke_callbacks(self):
+        with self._cond:
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                import logging
+                logging.exception('Exception in future callback %r', fn)
+
+class _WorkItem(object):
+    def __init__(self, future, fn, args, kwargs):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except BaseException:
+            self.future.set_exception(sys.exc_info())
+        else:
+            self.future.set_result(result)
+
+class Executor(object):
+    """Runs callables on a bounded pool of daemon worker threads
+
+    At most max_workers calls run at once; everything else waits in a queue
+    (without a thread of its own) until a worker is free.
+    """
+
+    def __init__(self, max_workers=8, name='zenapi'):
+        if max_workers <= 0:
+            raise ValueError('max_workers must be greater than 0')
+        self.max_workers = max_workers
+        self.name = name
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._shutdown = False
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedules fn(*args, **kwargs); returns a Future"""
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit after shutdown')
+            f = Future()
+            self._queue.put(_WorkItem(f, fn, args, kwargs))
+            if len(self._threads) < self.max_workers:
+                t = threading.Thread(target=self._worker, name='%s-%i'%(
+                    self.name, len(self._threads)))
+                t.setDaemon(True)
+                t.start()
+                self._threads.append(t)
+            return f
+
+    def map(self, fn, *iterables, **kwargs):
+        """Like itertools.imap, but calls run concurrently; results are
+        yielded in input order"""
+        timeout = kwargs.get('timeout')
+        fs = [self.submit(fn, *args) for args in zip(*iterables)]
+        def results():
+            try:
+                for f in fs:
+                    yield f.result(timeout)
+            finally:
+                for f in fs:
+                    f.cancel()
+        return results()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.put(None) # wake the next worker too
+                return
+            item.run()
+            del item
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """Stops the workers once queued calls finish
+
+        cancel_pending: if True, queued calls which have not started are
+        cancelled instead of being run
+        """
+        with self._lock:
+            self._shutdown = True
+            if cancel_pending:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if item is not None:
+                        item.future.cancel()
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
+        return False
+
+def wait(fs, timeout=None, return_when=ALL_COMPLETED):
+    """Waits for futures to finish
+
+    returns: (done, not_done) sets of futures
+    """
+    fs = set(fs)
+    cond = threading.Condition()
+    def _notify(f):
+        with cond:
+            cond.notify_all()
+    def _finished():
+        done = set(f for f in fs if f.done())
+        if return_when == FIRST_COMPLETED and done:
+            return done
+        if return_when == FIRST_EXCEPTION and [
+            f for f in done if not f.cancelled() and f.exception() is not None]:
+            return done
+        if len(done) == len(fs):
+            return done
+        return None
+
+    for f in fs:
+        f.add_done_callback(_notify)
+    deadline = None if timeout is None else time() + timeout
+    with cond:
+        done = _finished()
+        while done is None:
+            if deadline is None:
+                cond.wait(1)
+            else:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    done = set(f for f in fs if f.done())
+                    break
+                cond.wait(remaining)
+            done = _finished()
+    return done, fs - done
+
+def as_completed(fs, timeout=None):
+    """Yields futures as they finish (done or cancelled)"""
+    fs = set(fs)
+    finished = Queue.Queue()
+    for f in fs:
+        f.add_done_callback(finished.put)
+    deadline = None if timeout is None else time() + timeout
+    for i in xrange(len(fs)):
+        if deadline is None:
+            while True:
+                try:
+                    f = finished.get(True, 1)
+                    break
+                except Queue.Empty:
+                    pass
+        else:
+            try:
+                f = finished.get(True, max(0, deadline - time()))
+            except Queue.Empty:
+                raise TimeoutError('%i of %i futures unfinished'%(
+                    len(fs) - i, len(fs)))
+        yield f
+
+class SingleFlight(object):
+    """Coalesces concurrent calls for the same key into a single call
+
+    While a call for a key is running, further do() calls with that key
+    wait for it and get its result (the same object) or exception instead
+    of making their own.  Once it finishes, the next do() calls again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {} # key -> Future of the running call
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Returns fn(*args, **kwargs), shared with concurrent callers of key"""
+        with self._lock:
+            f = self._calls.get(key)
+            leader = f is None
+            if leader:
+                f = self._calls[key] = Future()
+                f.set_running_or_notify_cancel()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return f.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                del self._calls[key]
+            f.set_exception(sys.exc_info())
+            raise
+        with self._lock:
+            del self._calls[key]
+        f.set_result(result)
+        return result
@@ -0,0 +1,309 @@
+"""Constant-time lookups over a loaded group hierarchy"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+
+from ._zapi import Group, PhotoSet, Photo, Snapshot
+
+class HierarchyIndex(object):
+    """Index of a Group tree by Id, title path and photo FileName
+
+    Paths are the titles below the root joined with '/', e.g.
+    'Clients/2024/Smith Wedding' for a photoset and
+    'Clients/2024/Smith Wedding/IMG_0001.jpg' for a photo in it.  When
+    siblings share a title, the path refers to the first one indexed (then,
+    once that is removed, to the next).
+    Groups and photosets are looked up with element(), photos with photo();
+    a photo may belong to several photosets (its gallery and collections).
+
+    The index holds the snapshots themselves and keeps their Elements and
+    Photos lists in step when changed through add/remove/move/update (which
+    ZenConnection calls for you once attached with
+    ZenConnection.index_hierarchy).  Changes about objects outside the
+    indexed tree are ignored.
+
+    params:
+    root: a Group, e.g. from LoadGroupHierarchy, with whatever photosets
+    were loaded with their Photos
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.RLock()
+        self._elements = {}  # id -> Group or PhotoSet
+        self._parent = {}    # element id -> parent Group
+        self._photos = {}    # id -> Photo
+        self._sets = {}      # photo id -> ids of photosets holding it
+        self._members = {}   # photoset id -> ids of its photos
+        self._paths = {}     # title path -> elements or photos, in index order
+        self._filenames = {} # FileName -> photo ids
+        self._link(root, None, '')
+
+    def __len__(self):
+        return len(self._elements) + len(self._photos)
+
+    @staticmethod
+    def _join(path, title):
+        return path + '/' + title if path else title
+
+    def _link(self, obj, parent, path):
+        """Indexes obj, and everything below it, as a child of parent"""
+        if isinstance(obj, Photo):
+            sets = self._sets.setdefault(obj.Id, [])
+            if not sets:
+                self._photos[obj.Id] = obj
+                if obj.FileName:
+                    self._filenames.setdefault(obj.FileName, []).append(obj.Id)
+            if parent.Id not in sets:
+                sets.append(parent.Id)
+            self._members.setdefault(parent.Id, set()).add(obj.Id)
+        else:
+            self._elements[obj.Id] = obj
+            self._parent[obj.Id] = parent
+        self._paths.setdefault(path, []).append(obj)
+        if isinstance(obj, Group):
+            for e in obj.Elements or ():
+                self._link(e, obj, self._join(path, e.Title))
+        elif isinstance(obj, PhotoSet):
+            self._members.setdefault(obj.Id, set())
+            for p in obj.Photos or ():
+                self._link(p, obj, self._join(path, p.Title))
+
+    def _unlink(self, obj, parent, path):
+        """Drops obj, and everything below it, from the index (but not from
+        the tree)"""
+        held = self._paths.get(path)
+        if held is not None:
+            for i, p in enumerate(held):
+                if p.Id == obj.Id and type(p) is type(obj):
+                    del held[i]
+                    break
+            if not held:
+                del self._paths[path]
+        if isinstance(obj, Photo):
+            sets = self._sets.get(obj.Id, [])
+            if parent.Id in sets:
+                sets.remove(parent.Id)
+            self._members.get(parent.Id, set()).discard(obj.Id)
+            if not sets:
+                self._sets.pop(obj.Id, None)
+                self._photos.pop(obj.Id, None)
+                ids = self._filenames.get(obj.FileName)
+                if ids is not None and obj.Id in ids:
+                    ids.remove(obj.Id)
+                    if not ids:
+                        del self._filenames[obj.FileName]
+            return
+        if isinstance(obj, Group):
+            for e in obj.Elements or ():
+                self._unlink(e, obj, self._join(path, e.Title))
+        elif isinstance(obj, PhotoSet):
+            for pid in list(self._members.get(obj.Id, ())):
+                p = self._photoin(obj, pid)
+                self._unlink(p, obj, self._join(path, p.Title))
+            self._members.pop(obj.Id, None)
+        self._elements.pop(obj.Id, None)
+        self._parent.pop(obj.Id, None)
+
+    def _photoin(self, photoset, id):
+        """The snapshot of photo id held in photoset's Photos (or the
+        indexed one if the list was not loaded)"""
+        for p in photoset.Photos or ():
+            if p.Id == id:
+                return p
+        return self._photos[id]
+
+    @staticmethod
+    def _removefrom(children, id, cls):
+        if children is not None:
+            for i, c in enumerate(children):
+                if c.Id == id and isinstance(c, cls):
+                    del children[i]
+                    return
+
+    """
+    Lookups
+    """
+
+    def element(self, id):
+        """The Group or PhotoSet with this Id, or None"""
+        return self._elements.get(int(id))
+
+    def photo(self, id):
+        """The Photo with this Id, or None"""
+        return self._photos.get(int(id))
+
+    def byPath(self, path):
+        """The element or photo at a title path, or None"""
+        held = self._paths.get(path.strip('/'))
+        return held[0] if held else None
+
+    def byFileName(self, filename):
+        """All indexed photos with this FileName"""
+        return [self._photos[i] for i in self._filenames.get(filename, ())]
+
+    def parent(self, obj):
+        """The Group holding a group or photoset (None for the root)"""
+        return self._parent.get(int(obj))
+
+    def photosets(self, photo):
+        """The PhotoSets holding a photo"""
+        return [self._elements[i] for i in self._sets.get(int(photo), ())]
+
+    def path(self, obj, photoset=None):
+        """Title path of an indexed element or photo
+
+        photoset: for a photo, which of its photosets to go through (by
+        default the first one indexed)
+        """
+        if isinstance(obj, Photo):
+            if photoset is None:
+                photoset = self._sets[obj.Id][0]
+            photoset = self._elements[int(photoset)]
+            return self._join(self.path(photoset), obj.Title)
+        obj = self._elements[int(obj)]
+        titles = []
+        while obj is not self.root:
+            titles.append(obj.Title)
+            obj = self._parent[obj.Id]
+        return '/'.join(reversed(titles))
+
+    """
+    Changes
+    """
+
+    def add(self, obj, parent, index=None):
+        """Adds a new Group, PhotoSet or Photo below parent, at position
+        index of its Elements/Photos (by default at the end)"""
+        if isinstance(obj, Photo):
+            return self.addPhoto(obj, parent, index)
+        with self._lock:
+            parent = self._elements.get(int(parent))
+            if not isinstance(parent, Group):
+                return
+            if parent.Elements is None:
+                parent.Elements = []
+            if index is None:
+                parent.Elements.append(obj)
+            else:
+                parent.Elements.insert(index, obj)
+            self._link(obj, parent, self._join(self.path(parent), obj.Title))
+
+    def addPhoto(self, photo, photoset, index=None):
+        """Adds a photo (a Photo, or the Id of an indexed one) to photoset"""
+        with self._lock:
+            photoset = self._elements.get(int(photoset))
+            if not isinstance(photoset, PhotoSet):
+                return
+            if not isinstance(photo, Photo):
+                photo = self._photos.get(int(photo))
+                if photo is None:
+                    return
+            if photo.Id in self._members.get(photoset.Id, ()):
+                return
+            if photoset.Photos is not None:
+                if index is None:
+                    photoset.Photos.append(photo)
+                else:
+                    photoset.Photos.insert(index, photo)
+            self._link(photo, photoset,
+                       self._join(self.path(photoset), photo.Title))
+
+    def remove(self, element):
+        """Removes a group or photoset, and everything below it"""
+        with self._lock:
+            obj = self._elements.get(int(element))
+            if obj is None or obj is self.root:
+                return
+            parent = self._parent[obj.Id]
+            self._unlink(obj, parent, self.path(obj))
+            self._removefrom(parent.Elements, obj.Id, obj.__class__)
+            return obj
+
+    def removePhoto(self, photo, photoset=None):
+        """Removes a photo from photoset (by default from all of them)"""
+        with self._lock:
+            id = int(photo)
+            if photoset is None:
+                setids = list(self._sets.get(id, ()))
+            elif int(photoset) in self._sets.get(id, ()):
+                setids = [int(photoset)]
+            else:
+                return
+            for setid in setids:
+                ps = self._elements[setid]
+                p = self._photoin(ps, id)
+                self._unlink(p, ps, self.path(p, ps))
+                self._removefrom(ps.Photos, id, Photo)
+            return p if setids else None
+
+    def move(self, element, dest, index=None):
+        """Moves a group or photoset into group dest, at position index"""
+        with self._lock:
+            if not isinstance(self._elements.get(int(dest)), Group):
+                self.remove(element)
+                return
+            obj = self.remove(element)
+            if obj is not None:
+                self.add(obj, dest, index)
+
+    def movePhoto(self, photo, src, dest, index=None):
+        """Moves a photo from photoset src to photoset dest"""
+        with self._lock:
+            obj = self.removePhoto(photo, src)
+            if obj is not None:
+                self.addPhoto(obj, dest, index)
+
+    def update(self, snapshot):
+        """Copies the fields of a fresh snapshot (e.g. returned by
+        UpdateGroup/UpdatePhotoSet/UpdatePhoto) onto the indexed one,
+        re-indexing it if its Title or FileName changed"""
+        if not isinstance(snapshot, Snapshot) or snapshot.Id is None:
+            return
+        fields = [(k, v) for k, v in snapshot._items()
+                  if v is not None and k not in ('Elements', 'Photos')]
+        with self._lock:
+            if isinstance(snapshot, Photo):
+                if snapshot.Id not in self._photos:
+                    return
+                held = [(self._elements[i], self._photoin(self._elements[i],
+                                                          snapshot.Id))
+                        for i in self._sets[snapshot.Id]]
+                for ps, p in held:
+                    self._unlink(p, ps, self.path(p, ps))
+                for ps, p in held:
+                    for k, v in fields:
+                        p._dict[k] = v
+                    p.clear_changes(*[k for k, v in fields])
+                    self._link(p, ps, self._join(self.path(ps), p.Title))
+            else:
+                obj = self._elements.get(snapshot.Id)
+                if obj is None or type(obj) is not type(snapshot):
+                    return
+                parent = self._parent[obj.Id]
+                path = self.path(obj)
+                if parent is not None:
+                    self._unlink(obj, parent, path)
+                for k, v in fields:
+                    obj._dict[k] = v
+                obj.clear_changes(*[k for k, v in fields])
+                if parent is not None:
+                    self._link(obj, parent,
+                               self._join(self.path(parent), obj.Title))
@@ -0,0 +1,202 @@
+"""Optional metrics for API calls and photo transfers"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import math
+import threading
+from time import time
+
+# The active MetricsRegistry, or None.  Instrumented code checks this
+# global and does nothing else while metrics are disabled.
+registry = None
+
+def enable_metrics(reg=None):
+    """Starts recording into reg (by default a new MetricsRegistry); returns it"""
+    global registry
+    if reg is None:
+        reg = MetricsRegistry()
+    registry = reg
+    return reg
+
+def disable_metrics():
+    """Stops recording; returns the registry which was active, if any"""
+    global registry
+    reg, registry = registry, None
+    return reg
+
+def get_metrics():
+    """The active MetricsRegistry, or None"""
+    return registry
+
+class Histogram(object):
+    """Durations in seconds, in logarithmic buckets 9% wide from 0.1ms
+    up to about 3.5 minutes"""
+
+    GROWTH = 2**(1/8.)
+    LOWEST = 1e-4
+    BUCKETS = 8*21
+
+    def __init__(self):
+        self.counts = [0]*(self.BUCKETS + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        if seconds <= self.LOWEST:
+            i = 0
+        else:
+            i = min(self.BUCKETS,
+                    int(math.log(seconds/self.LOWEST, self.GROWTH)) + 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile"""
+        if not self.count:
+            return None
+        rank = q/100.*self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                if i == self.BUCKETS: # open-ended: anything slower
+                    return self.max
+                return min(self.max, self.LOWEST*self.GROWTH**i)
+        return self.max
+
+class CallStats(object):
+    """Counters of one API method"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.error_types = {}
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency = Histogram()
+
+    def snapshot(self):
+        h = self.latency
+        return {'calls':self.calls, 'errors':self.errors,
+                'error_types':dict(self.error_types),
+                'bytes_out':self.bytes_out, 'bytes_in':self.bytes_in,
+                'mean':h.total/h.count if h.count else None, 'max':h.max,
+                'p50':h.percentile(50), 'p95':h.percentile(95),
+                'p99':h.percentile(99)}
+
+class TransferStats(CallStats):
+    """Counters of downloads or uploads; bytes moved are in bytes_in (for
+    downloads) or bytes_out (for uploads)"""
+
+    def __init__(self):
+        CallStats.__init__(self)
+        self.first = None
+        self.last = None
+
+    def snapshot(self):
+        d = CallStats.snapshot(self)
+        moved = self.bytes_in + self.bytes_out
+        busy = self.latency.total
+        d['bytes_per_sec'] = moved/busy if busy else None
+        span = (self.last - self.first) if self.first is not None else 0
+        d['wall_bytes_per_sec'] = moved/span if span > 0 else None
+        return d
+
+class MetricsRegistry(object):
+    """Per-method API call and transfer statistics
+
+    snapshot() returns plain dicts for polling; listeners added with
+    add_listener are called after every event as
+    listener(kind, name, seconds, bytes_out, bytes_in, error), where kind
+    is 'call' (name is the API method) or 'transfer' (name is 'download'
+    or 'upload') and error is the exception raised, or None.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.transfers = {}
+        self.listeners = []
+        self.started = time()
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def remove_listener(self, fn):
+        self.listeners.remove(fn)
+
+    def _record(self, table, factory, kind, name, seconds, bytes_out,
+                bytes_in, error):
+        with self._lock:
+            s = table.get(name)
+            if s is None:
+                s = table[name] = factory()
+            s.calls += 1
+            s.bytes_out += bytes_out
+            s.bytes_in += bytes_in
+            s.latency.add(seconds)
+            if error is not None:
+                s.errors += 1
+                t = error.__class__.__name__
+                s.error_types[t] = s.error_types.get(t, 0) + 1
+            if kind == 'transfer':
+                now = time()
+                if s.first is None:
+                    s.first = now - seconds
+                s.last = now
+        for fn in self.listeners:
+            try:
+                fn(kind, name, seconds, bytes_out, bytes_in, error)
+            except Exception:
+                logging.exception('Metrics listener failed')
+
+    def record_call(self, method, seconds, bytes_out=0, bytes_in=0,
+                    error=None):
+        self._record(self.calls, CallStats, 'call', method, seconds,
+                     bytes_out, bytes_in, error)
+
+    def record_transfer(self, direction, seconds, nbytes, error=None):
+        """direction: 'download' or 'upload'"""
+        if direction == 'upload':
+            bytes_out, bytes_in = nbytes, 0
+        else:
+            bytes_out, bytes_in = 0, nbytes
+        self._record(self.transfers, TransferStats, 'transfer', direction,
+                     seconds, bytes_out, bytes_in, error)
+
+    def snapshot(self):
+        """{'calls': {method: stats}, 'transfers': {direction: stats},
+        'uptime': seconds}"""
+        with self._lock:
+            return {'calls':dict((k, s.snapshot())
+                                 for k, s in self.calls.iteritems()),
+                    'transfers':dict((k, s.snapshot())
+                                     for k, s in self.transfers.iteritems()),
+                    'uptime':time() - self.started}
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.transfers.clear()
+            self.started = time()
@@ -0,0 +1,304 @@
+"""Persistent local SQLite mirror of an account's group hierarchy"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import sqlite3
+
+from ._futures import Executor, as_completed
+from ._zapi import (Group, PhotoSet, ResponseObject, InformationLevel,
+                    _datestr)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    title TEXT,
+    path TEXT,
+    created TEXT,
+    modified TEXT,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS photosets (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    title TEXT,
+    path TEXT,
+    type TEXT,
+    created TEXT,
+    modified TEXT,
+    photo_count INTEGER,
+    views INTEGER,
+    photos_modified TEXT,
+    photos_count INTEGER,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS photos (
+    id INTEGER,
+    photoset INTEGER,
+    title TEXT,
+    filename TEXT,
+    views INTEGER,
+    size INTEGER,
+    sequence TEXT,
+    uploaded TEXT,
+    taken TEXT,
+    data TEXT,
+    PRIMARY KEY (photoset, id)
+);
+CREATE INDEX IF NOT EXISTS groups_parent ON groups (parent);
+CREATE INDEX IF NOT EXISTS groups_title ON groups (title);
+CREATE INDEX IF NOT EXISTS photosets_parent ON photosets (parent);
+CREATE INDEX IF NOT EXISTS photosets_title ON photosets (title);
+CREATE INDEX IF NOT EXISTS photosets_views ON photosets (views);
+CREATE INDEX IF NOT EXISTS photos_id ON photos (id);
+CREATE INDEX IF NOT EXISTS photos_title ON photos (title);
+CREATE INDEX IF NOT EXISTS photos_filename ON photos (filename);
+CREATE INDEX IF NOT EXISTS photos_views ON photos (views);
+CREATE INDEX IF NOT EXISTS photos_uploaded ON photos (uploaded);
+CREATE INDEX IF NOT EXISTS photos_taken ON photos (taken);
+"""
+
+def _dumps(obj, skip=()):
+    """JSON of a snapshot, leaving out (without serializing) fields in skip"""
+    if skip:
+        obj = obj.__class__(dict((k, v) for k, v in obj._dict.items()
+                                 if k not in skip))
+    return json.dumps(obj.asdict())
+
+class RefreshStats(object):
+    """What a LocalMirror.refresh did
+
+    changed, unchanged, deleted: photoset ids
+    failed: list of (photoset id, exception)
+    calls: API calls made
+    """
+
+    def __init__(self):
+        self.changed = []
+        self.unchanged = []
+        self.deleted = []
+        self.failed = []
+        self.calls = 0
+
+    def __repr__(self):
+        return ('<%s: %i changed, %i unchanged, %i deleted, %i failed photosets '
+                'in %i calls>'%(self.__class__.__name__, len(self.changed),
+                                len(self.unchanged), len(self.deleted),
+                                len(self.failed), self.calls))
+
+class LocalMirror(object):
+    """Group/PhotoSet/Photo snapshots of an account, kept in SQLite
+
+    refresh() costs one LoadGroupHierarchy call plus one LoadPhotoSet per
+    photoset whose ModifiedOn or PhotoCount changed since the last refresh.
+    Photo-level fields which change without touching their photoset (e.g.
+    photo Views) are therefore only as fresh as the last reload of that
+    photoset; use refresh(full=True) to reload everything.
+
+    Snapshots returned by the query methods are rebuilt from the stored
+    data; the indexed columns (id, parent, title, views, dates, ...) may
+    also be queried directly with query().
+
+    params:
+    zen: the ZenConnection to refresh through (may be None for read-only use)
+    filename: the database file (':memory:' for a throwaway mirror)
+    level: InformationLevel at which photos are stored
+    """
+
+    def __init__(self, zen, filename, level=InformationLevel.Level2):
+        self.zen = zen
+        self.level = level
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def _walk(self, group, parent, path, groups, photosets):
+        """Flattens the hierarchy into (group, parent, path) and
+        (photoset, parent, path) lists"""
+        groups.append((group, parent, path))
+        for e in group.Elements or ():
+            epath = path + '/' + e.Title if path else e.Title
+            if isinstance(e, Group):
+                self._walk(e, group.Id, epath, groups, photosets)
+            elif isinstance(e, PhotoSet):
+                photosets.append((e, group.Id, epath))
+
+    def refresh(self, full=False, workers=8):
+        """Brings the mirror up to date; returns RefreshStats
+
+        full: if True, reloads the photos of every photoset
+        workers: number of concurrent LoadPhotoSet calls
+        """
+        stats = RefreshStats()
+        root = self.zen.LoadGroupHierarchy()
+        stats.calls += 1
+        groups, photosets = [], []
+        self._walk(root, None, '', groups, photosets)
+
+        known = dict((r[0], (r[1], r[2])) for r in self.db.execute(
+            'SELECT id, photos_modified, photos_count FROM photosets'))
+        stale = []
+        for ps, parent, path in photosets:
+            state = (_datestr(ps.ModifiedOn), ps.PhotoCount)
+            if full or known.get(ps.Id) != state:
+                stale.append(ps)
+            else:
+                stats.unchanged.append(ps.Id)
+
+        loaded = {}
+        if stale:
+            pool = Executor(max_workers=workers, name='zenapi-mirror')
+            try:
+                fs = dict((pool.submit(self.zen.LoadPhotoSet, ps, self.level,
+                                       True), ps) for ps in stale)
+                for f in as_completed(fs):
+                    stats.calls += 1
+                    ps = fs[f]
+                    if f.exception() is not None:
+                        logging.warning('Could not load %s: %s', ps, f.exception())
+                        stats.failed.append((ps.Id, f.exception()))
+                    else:
+                        loaded[ps.Id] = f.result()
+            finally:
+                pool.shutdown(wait=False, cancel_pending=True)
+
+        with self.db:
+            self.db.execute('DELETE FROM groups')
+            self.db.executemany(
+                'INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(g.Id, parent, g.Title, path, _datestr(g.CreatedOn),
+                  _datestr(g.ModifiedOn), _dumps(g, ('Elements',)))
+                 for g, parent, path in groups])
+
+            current = set()
+            for ps, parent, path in photosets:
+                current.add(ps.Id)
+                full_ps = loaded.get(ps.Id)
+                if full_ps is not None:
+                    stats.changed.append(ps.Id)
+                    state = (_datestr(ps.ModifiedOn), ps.PhotoCount)
+                    self.db.execute('DELETE FROM photos WHERE photoset=?', (ps.Id,))
+                    self.db.executemany(
+                        'INSERT OR REPLACE INTO photos VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        [(p.Id, ps.Id, p.Title, p.FileName, p.Views, p.Size,
+                          p.Sequence, _datestr(p.UploadedOn),
+                          _datestr(p.TakenOn), _dumps(p))
+                         for p in full_ps.Photos or ()])
+                else:
+                    # Unchanged, or failed to load: keep the old photos state
+                    state = known.get(ps.Id, (None, None))
+                self.db.execute(
+                    'INSERT OR REPLACE INTO photosets VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (ps.Id, parent, ps.Title, path, ps.Type,
+                     _datestr(ps.CreatedOn), _datestr(ps.ModifiedOn),
+                     ps.PhotoCount, ps.Views, state[0], state[1],
+                     _dumps(ps, ('Photos',))))
+
+            for psid in set(known) - current:
+                stats.deleted.append(psid)
+                self.db.execute('DELETE FROM photosets WHERE id=?', (psid,))
+                self.db.execute('DELETE FROM photos WHERE photoset=?', (psid,))
+        return stats
+
+    """
+    Queries
+    """
+
+    def query(self, sql, params=()):
+        """Runs arbitrary SQL against the mirror; returns a list of rows"""
+        return self.db.execute(sql, params).fetchall()
+
+    def _select(self, table, where, params, order_by, limit):
+        sql = 'SELECT data FROM %s'%table
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if order_by:
+            sql += ' ORDER BY ' + order_by
+        if limit is not None:
+            sql += ' LIMIT %i'%limit
+        return [ResponseObject.build(json.loads(r[0]))
+                for r in self.db.execute(sql, params)]
+
+    def groups(self, parent=None, title=None, path=None, order_by='path',
+               limit=None):
+        """Group snapshots (without Elements) matching all given filters"""
+        where, params = [], []
+        for col, val in (('parent', parent), ('title', title), ('path', path)):
+            if val is not None:
+                where.append('%s=?'%col)
+                params.append(val)
+        return self._select('groups', where, params, order_by, limit)
+
+    def photosets(self, parent=None, title=None, path=None, min_views=None,
+                  order_by='path', limit=None):
+        """PhotoSet snapshots (without Photos) matching all given filters"""
+        where, params = [], []
+        for col, val in (('parent', parent), ('title', title), ('path', path)):
+            if val is not None:
+                where.append('%s=?'%col)
+                params.append(val)
+        if min_views is not None:
+            where.append('views>=?')
+            params.append(min_views)
+        return self._select('photosets', where, params, order_by, limit)
+
+    def photos(self, photoset=None, id=None, title=None, filename=None,
+               min_views=None, uploaded_after=None, uploaded_before=None,
+               taken_after=None, taken_before=None, order_by='photoset, rowid',
+               limit=None):
+        """Photo snapshots matching all given filters
+
+        Dates may be datetimes or 'YYYY-MM-DD HH:MM:SS' strings.
+        order_by is an SQL ordering over the photos columns, e.g.
+        'views DESC'
+        """
+        where, params = [], []
+        for col, val in (('photoset', photoset), ('id', id),
+                         ('title', title), ('filename', filename)):
+            if val is not None:
+                where.append('%s=?'%col)
+                params.append(int(val) if col in ('photoset', 'id') else val)
+        for col, op, val in (('views', '>=', min_views),
+                             ('uploaded', '>=', uploaded_after),
+                             ('uploaded', '<', uploaded_before),
+                             ('taken', '>=', taken_after),
+                             ('taken', '<', taken_before)):
+            if val is not None:
+                if hasattr(val, 'strftime'):
+                    val = val.strftime('%Y-%m-%d %H:%M:%S')
+                where.append('%s%s?'%(col, op))
+                params.append(val)
+        return self._select('photos', where, params, order_by, limit)
+
+    def photoset(self, photoset, includePhotos=True):
+        """A stored PhotoSet snapshot, with its Photos unless told otherwise"""
+        rows = self.db.execute('SELECT data FROM photosets WHERE id=?',
+                               (int(photoset),)).fetchall()
+        if not rows:
+            return None
+        ps = ResponseObject.build(json.loads(rows[0][0]))
+        if includePhotos:
+            ps.Photos = self.photos(photoset=ps.Id)
+        return ps
@@ -0,0 +1,115 @@
+"""Iteration across the pages of offset/limit calls"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import uuid
+from collections import deque
+
+from ._futures import Executor
+
+def new_search_id():
+    """A searchId under which the server keeps one consistent result set"""
+    return 'zenapi-' + uuid.uuid4().hex
+
+def pageitems(result):
+    """(items, TotalCount or None) of one page
+
+    Get* calls return a plain list; Search* calls a PhotoResult or
+    PhotoSetResult with Photos or PhotoSets and TotalCount.
+    """
+    if result is None:
+        return [], None
+    if isinstance(result, dict):
+        items = result.get('Photos')
+        if items is None:
+            items = result.get('PhotoSets')
+        return items or [], result.get('TotalCount')
+    return result, None
+
+def _fetchpage(fetch, offset, limit):
+    return pageitems(fetch(offset, limit))
+
+def iterpages(fetch, page_size=100, prefetch=1, max_items=None):
+    """Yields every item of a paged call, loading pages ahead in the background
+
+    Only the first page is requested on its own; after that up to prefetch
+    further pages are kept in flight while the caller consumes the current
+    one (never past TotalCount, when the call reports it).  When the call
+    reports TotalCount, iteration stops there or at an empty page; a page
+    shorter than asked for (the server caps page sizes) has its remainder
+    requested next, and later pages are asked for at the capped size.
+    Without TotalCount iteration stops at the first short page.  It always
+    stops at max_items.  Closing the generator early cancels the pages not
+    yet requested.
+
+    params:
+    fetch: called as fetch(offset, limit); returns what pageitems() takes
+    page_size: items per call
+    prefetch: pages requested ahead of the one being consumed
+    max_items: stop after this many items
+    """
+    if page_size < 1:
+        raise ValueError('page_size must be positive')
+    pool = Executor(max_workers=max(prefetch, 1), name='zenapi-pages')
+    pending = deque() # (offset, limit, future) in request order
+    state = {'offset':0, 'total':None, 'page':page_size}
+
+    def fill(ahead):
+        end = max_items
+        total = state['total']
+        if total is not None:
+            end = total if end is None else min(end, total)
+        while len(pending) < ahead and (end is None or state['offset'] < end):
+            offset = state['offset']
+            n = state['page']
+            if end is not None:
+                n = min(n, end - offset)
+            pending.append((offset, n,
+                            pool.submit(_fetchpage, fetch, offset, n)))
+            state['offset'] = offset + n
+
+    try:
+        fill(1)
+        while pending:
+            start, n, f = pending.popleft()
+            items, count = f.result()
+            if count is not None:
+                state['total'] = count
+            if not items:
+                last = True
+            elif count is None:
+                last = len(items) < n
+            else:
+                last = start + len(items) >= count
+            if not last and len(items) < n:
+                # Capped by the server: the rest of this page comes next
+                state['page'] = len(items)
+                rest = start + len(items)
+                pending.appendleft((rest, n - len(items),
+                                    pool.submit(_fetchpage, fetch, rest,
+                                                n - len(items))))
+            if not last:
+                fill(prefetch)
+            for item in items:
+                yield item
+            if last:
+                return
+            fill(1) # in case prefetch is 0
+    finally:
+        pool.shutdown(wait=False, cancel_pending=True)
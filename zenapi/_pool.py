@@ -0,0 +1,324 @@
+"""Persistent HTTP/1.1 keep-alive connection pool"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno
+import httplib
+import mmap
+import select
+import socket
+import threading
+import urlparse
+from collections import deque
+from time import time
+
+try:
+    from ssl import SSLSocket
+except ImportError:
+    SSLSocket = ()
+
+# Errors which mean a reused keep-alive socket was closed underneath us:
+# while sending, only a refused write proves the server never got the
+# request; once it is sent, a missing response may still mean the request
+# was processed, so only idempotent requests are retried then
+_UNSENT_ERRNOS = (errno.EPIPE, errno.ECONNRESET)
+_STALE_RESPONSE_ERRORS = (httplib.BadStatusLine, socket.error)
+
+def _timedout(e):
+    # ssl reports read timeouts as a plain SSLError
+    return isinstance(e, socket.timeout) or 'timed out' in str(e)
+
+def _unsent(e):
+    """True if exception e, raised while sending, proves nothing was sent"""
+    if isinstance(e, httplib.CannotSendRequest):
+        return True
+    return (isinstance(e, socket.error) and not _timedout(e) and
+            getattr(e, 'errno', None) in _UNSENT_ERRNOS)
+
+BLOCKSIZE = 256*1024 # bytes per send when streaming a file body
+
+class PoolTimeout(Exception):
+    pass
+
+def _iterblocks(f, blocksize=BLOCKSIZE):
+    """Yields the remainder of file f in blocks without reading it all
+
+    Regular files are memory-mapped so that blocks are views onto the page
+    cache rather than copies; anything else is read block by block.
+    """
+    try:
+        start = f.tell()
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError, OverflowError):
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                return
+            yield block
+    else:
+        try:
+            for off in xrange(start, len(mm), blocksize):
+                yield buffer(mm, off, blocksize)
+            f.seek(len(mm))
+        finally:
+            mm.close()
+
+def send_file(conn, f, blocksize=BLOCKSIZE, callback=None):
+    """Streams file object f as the body of the request on conn
+
+    callback: if given, called with the size of every block sent
+    """
+    sock = conn.sock
+    plain = not isinstance(sock, SSLSocket)
+    for block in _iterblocks(f, blocksize):
+        if isinstance(block, buffer) and not plain:
+            block = str(block) # ssl sockets want a string
+        sock.sendall(block)
+        if callback is not None:
+            callback(len(block))
+
+class _HostPool(object):
+    """Idle connections to a single (scheme, host, port)"""
+
+    def __init__(self):
+        self.idle = deque() # (connection, last used) pairs, newest last
+        self.active = 0
+        self.cond = threading.Condition(threading.Lock())
+
+class ConnectionPool(object):
+    """Thread-safe pool of keep-alive HTTP/HTTPS connections, keyed per host
+
+    params:
+    maxsize: number of connections kept open per host
+    idle_timeout: seconds a connection may sit unused before it is closed
+    block: if True, never open more than maxsize connections to a host;
+    callers wait (up to pool_timeout seconds) for one to be released.  If
+    False, extra connections are opened under load but only maxsize are kept
+    timeout: socket timeout for new connections
+    connection_classes: dict mapping url scheme to an httplib connection class
+    """
+
+    def __init__(self, maxsize=4, idle_timeout=30, block=False,
+                 pool_timeout=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                 connection_classes=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.block = block
+        self.pool_timeout = pool_timeout
+        self.timeout = timeout
+        if connection_classes is None:
+            connection_classes = {'http':httplib.HTTPConnection,
+                                  'https':httplib.HTTPSConnection}
+        self.connection_classes = connection_classes
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _hostpool(self, key):
+        with self._lock:
+            hp = self._hosts.get(key)
+            if hp is None:
+                hp = self._hosts[key] = _HostPool()
+            return hp
+
+    @staticmethod
+    def _is_alive(conn):
+        """Health check for an idle connection
+
+        An idle keep-alive socket should have nothing to read; if it is
+        readable the server has either closed it or sent garbage.
+        """
+        if conn.sock is None:
+            return False
+        try:
+            r, w, x = select.select([conn.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        return not r
+
+    def _get(self, key):
+        """Returns (connection, reused) for key, opening one if needed"""
+        hp = self._hostpool(key)
+        with hp.cond:
+            if self.block:
+                deadline = None
+                if self.pool_timeout is not None:
+                    deadline = time() + self.pool_timeout
+                while hp.active >= self.maxsize:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time()
+                        if remaining <= 0:
+                            raise PoolTimeout('No free connection to %s://%s:%s'%key)
+                    hp.cond.wait(remaining)
+            hp.active += 1
+            now = time()
+            while hp.idle:
+                conn, last = hp.idle.pop()
+                if now - last < self.idle_timeout and self._is_alive(conn):
+                    return conn, True
+                conn.close()
+        scheme, host, port = key
+        conn = self.connection_classes[scheme](host, port, timeout=self.timeout)
+        return conn, False
+
+    def _put(self, key, conn, reusable=True):
+        """Releases a connection back to the pool"""
+        hp = self._hostpool(key)
+        with hp.cond:
+            hp.active -= 1
+            if reusable and conn.sock is not None and len(hp.idle) < self.maxsize:
+                hp.idle.append((conn, time()))
+            else:
+                conn.close()
+            hp.cond.notify()
+
+    def evict_idle(self):
+        """Closes every idle connection past idle_timeout"""
+        now = time()
+        with self._lock:
+            hostpools = self._hosts.values()
+        for hp in hostpools:
+            with hp.cond:
+                keep = deque()
+                for conn, last in hp.idle:
+                    if now - last < self.idle_timeout and self._is_alive(conn):
+                        keep.append((conn, last))
+                    else:
+                        conn.close()
+                hp.idle = keep
+
+    def clear(self):
+        """Closes all idle connections"""
+        with self._lock:
+            hostpools = self._hosts.values()
+        for hp in hostpools:
+            with hp.cond:
+                while hp.idle:
+                    hp.idle.pop()[0].close()
+
+    def urlopen(self, method, url, body=None, headers=None, callback=None,
+                idempotent=False):
+        """Sends a request over a pooled connection
+
+        body: a string, or an open file which is streamed (see send_file);
+        a file body needs an explicit Content-Length header
+        callback: with a file body, called with the size of each block sent
+        idempotent: if True, the request is also sent again on a fresh
+        connection when a reused one is found closed after sending (no
+        status line, or a reset; never on a timeout).  Otherwise it is only
+        sent again if it provably never left
+
+        returns: a PooledResponse.  The connection is returned to the pool
+        once the body has been read to the end (or the response is closed).
+        """
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if headers is None:
+            headers = {}
+
+        streamed = hasattr(body, 'read')
+        while True:
+            conn, reused = self._get(key)
+            try:
+                if streamed:
+                    names = [k.lower() for k in headers]
+                    conn.putrequest(method, path,
+                                    skip_host='host' in names,
+                                    skip_accept_encoding='accept-encoding' in names)
+                    for k, v in headers.items():
+                        conn.putheader(k, v)
+                    conn.endheaders()
+                    send_file(conn, body, callback=callback)
+                else:
+                    conn.request(method, path, body, headers)
+            except Exception, e:
+                self._put(key, conn, reusable=False)
+                if reused and not streamed and _unsent(e):
+                    continue # Server dropped an idle connection, retry fresh
+                raise
+            except:
+                self._put(key, conn, reusable=False)
+                raise
+            try:
+                resp = conn.getresponse()
+            except Exception, e:
+                self._put(key, conn, reusable=False)
+                if (reused and idempotent and not streamed and
+                    isinstance(e, _STALE_RESPONSE_ERRORS) and
+                    not _timedout(e)):
+                    continue
+                raise
+            except:
+                self._put(key, conn, reusable=False)
+                raise
+            return PooledResponse(self, key, conn, resp, url)
+
+class PooledResponse(object):
+    """File-like wrapper around httplib.HTTPResponse which hands the
+    connection back to its pool once the response is consumed"""
+
+    def __init__(self, pool, key, conn, resp, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.url = url
+        self.code = self.status = resp.status
+        self.msg = resp.reason
+        self.headers = resp.msg
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getheader(self, name, default=None):
+        return self._resp.getheader(name, default)
+
+    def read(self, amt=None):
+        try:
+            data = self._resp.read(amt)
+        except:
+            self._release(False)
+            raise
+        if amt is None or not data or self._resp.isclosed():
+            self._release(True)
+        return data
+
+    def close(self):
+        self._release(self._resp.isclosed())
+        self._resp.close()
+
+    def _release(self, reusable):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._put(self._key, conn,
+                            reusable and not self._resp.will_close)
+
+    def __del__(self):
+        try:
+            self._release(False)
+        except Exception:
+            pass
@@ -0,0 +1,284 @@
+"""Incremental, manifest-based mirroring of groups and photosets"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from ._futures import Executor, as_completed
+from ._transfers import DownloadEngine, TransferSummary, _makedirs
+from ._zapi import (Group, PhotoSet, Photo, InformationLevel,
+                    _atomicfile, _datestr, _grouplayout)
+
+class SyncManifest(object):
+    """Local record of what a sync has mirrored
+
+    photos: {photo id: {'Sequence', 'Size', 'UploadedOn',
+                        'paths': {photoset id: path relative to the root}}}
+    photosets: {photoset id: {'ModifiedOn', 'PhotoCount', 'path'}}
+
+    Ids are stored as strings (JSON object keys).  A photo appears under
+    every photoset (gallery or collection) it was synced from.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.photos = {}
+        self.photosets = {}
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                d = json.load(f)
+            if d.get('version') != self.VERSION:
+                raise ValueError('Unsupported sync manifest version in %s'%filename)
+            self.photos = d['photos']
+            self.photosets = d['photosets']
+
+    @staticmethod
+    def default_filename(root, element):
+        return os.path.join(root, '.zenapi-sync-%s.json'%int(element))
+
+    def save(self):
+        """Atomically rewrites the manifest file"""
+        with _atomicfile(self.filename) as f:
+            json.dump({'version':self.VERSION, 'photos':self.photos,
+                       'photosets':self.photosets}, f)
+
+class SyncSummary(TransferSummary):
+    """TransferSummary of a sync; additionally
+
+    unchanged: number of photos which needed no transfer
+    renamed: list of (photo, old path, new path) moved locally
+    deleted: list of local paths removed because the photo is gone
+    """
+
+    def __init__(self):
+        TransferSummary.__init__(self)
+        self.unchanged = 0
+        self.renamed = []
+        self.deleted = []
+
+    def __repr__(self):
+        return ('<%s: %i downloaded, %i unchanged, %i renamed, %i deleted, '
+                '%i failed>'%(self.__class__.__name__, len(self.downloaded),
+                              self.unchanged, len(self.renamed),
+                              len(self.deleted), len(self.failed)))
+
+class Sync(object):
+    """Brings a local directory in line with a group or photoset
+
+    The groups come from one LoadGroupHierarchy call, and every photoset's
+    photos from up to workers concurrent LoadPhotoSet calls.  Only photos
+    which are new, whose Sequence or Size changed (e.g. after ReplacePhoto)
+    or whose local copy is missing are transferred.  Renamed photos are
+    moved locally, and photos no longer on Zenfolio are deleted.
+
+    params:
+    zen: the ZenConnection to sync through
+    root: local parent directory (the element's folder is created below it,
+    using the same layout as ZenConnection.download_group)
+    manifest: a SyncManifest
+    delete: if False, local copies of deleted photos are kept
+    quick: if True, photosets whose ModifiedOn, PhotoCount and folder match
+    the manifest are not loaded at all.  Faster, but photos replaced or
+    renamed without changing those are missed
+    workers, per_host, size, set_mtime, progress: as in DownloadEngine
+    """
+
+    def __init__(self, zen, root, manifest, delete=True, quick=False,
+                 workers=4, per_host=4, size=Photo.Original, set_mtime=True,
+                 progress=None):
+        self.zen = zen
+        self.root = root
+        self.manifest = manifest
+        self.delete = delete
+        self.quick = quick
+        self.workers = workers
+        self.per_host = per_host
+        self.size = size
+        self.set_mtime = set_mtime
+        self.progress = progress
+        self.summary = SyncSummary()
+        self._lock = threading.Lock()
+        self._pending = {}      # local path -> (photoset key, relative path)
+        self._failedsets = set()
+        self._changedsets = []  # (photoset key, manifest entry) to commit
+        self._bysets = {}       # photoset key -> photo keys in the manifest
+
+    def _rel(self, path):
+        return os.path.relpath(path, self.root)
+
+    def _abs(self, rel):
+        return os.path.join(self.root, rel)
+
+    def _photosets(self, element, path):
+        """(photoset, parent directory) pairs below element"""
+        if isinstance(element, PhotoSet):
+            return [(element, path)]
+        group = _findgroup(self.zen.LoadGroupHierarchy(), int(element))
+        if group is None:
+            raise ValueError('Group %s is not in the hierarchy'%int(element))
+        photosets = []
+        self._walk(group, path, photosets)
+        return photosets
+
+    def _walk(self, group, path, photosets):
+        for child, p in _grouplayout(group, path):
+            if isinstance(child, PhotoSet):
+                photosets.append((child, p))
+            elif isinstance(child, Group):
+                self._walk(child, p, photosets)
+
+    def _record(self, photo, setkey, rel):
+        with self._lock:
+            entry = self.manifest.photos.setdefault(str(photo.Id), {'paths':{}})
+            entry['Sequence'] = photo.Sequence
+            entry['Size'] = photo.Size
+            entry['UploadedOn'] = _datestr(photo.UploadedOn)
+            entry['paths'][setkey] = rel
+
+    def _progress(self, event, photo, path, error):
+        setkey, rel = self._pending[path]
+        if event == 'downloaded':
+            self._record(photo, setkey, rel)
+        elif event == 'failed':
+            with self._lock:
+                self._failedsets.add(setkey)
+        if self.progress is not None:
+            self.progress(event, photo, path, error)
+
+    def _unchanged(self, photoset, path, seen):
+        """With quick, True if the manifest shows photoset as synced already"""
+        setkey = str(photoset.Id)
+        entry = self.manifest.photosets.get(setkey)
+        if (entry is None or
+            entry['ModifiedOn'] != _datestr(photoset.ModifiedOn) or
+            entry['PhotoCount'] != photoset.PhotoCount or
+            entry['path'] != self._rel(os.path.join(path, photoset.Title))):
+            return False
+        for key in self._bysets.get(setkey, ()):
+            seen.add((key, setkey))
+            self.summary.unchanged += 1
+        return True
+
+    def _photoset(self, photoset, path, engine, seen):
+        """Queues or moves the photos of a loaded photoset as needed"""
+        setkey = str(photoset.Id)
+        setdir = os.path.join(path, photoset.Title)
+        _makedirs(setdir)
+        for photo in photoset.Photos:
+            key = str(photo.Id)
+            rel = self._rel(os.path.join(setdir, photo.Title))
+            seen.add((key, setkey))
+            p = self.manifest.photos.get(key)
+            if (p is not None and p.get('Sequence') == photo.Sequence and
+                p.get('Size') == photo.Size):
+                old = p['paths'].get(setkey)
+                if old == rel and os.path.isfile(self._abs(rel)):
+                    self.summary.unchanged += 1
+                    continue
+                if old is not None and os.path.isfile(self._abs(old)):
+                    if os.path.exists(self._abs(rel)):
+                        os.remove(self._abs(rel))
+                    os.rename(self._abs(old), self._abs(rel))
+                    self._record(photo, setkey, rel)
+                    self.summary.renamed.append((photo, old, rel))
+                    continue
+            self._pending[os.path.join(setdir, photo.Title)] = (setkey, rel)
+            engine.add_photo(photo, setdir)
+
+        # Only trusted as up to date once all its photos transferred
+        self._changedsets.append((setkey, {
+            'ModifiedOn':_datestr(photoset.ModifiedOn),
+            'PhotoCount':photoset.PhotoCount,
+            'path':self._rel(setdir)}))
+
+    def _prune(self, seen, seensets):
+        for key, p in self.manifest.photos.items():
+            for setkey, rel in p['paths'].items():
+                if (key, setkey) in seen:
+                    continue
+                if self.delete and os.path.isfile(self._abs(rel)):
+                    os.remove(self._abs(rel))
+                    self.summary.deleted.append(rel)
+                del p['paths'][setkey]
+            if not p['paths']:
+                del self.manifest.photos[key]
+        for setkey in self.manifest.photosets.keys():
+            if setkey not in seensets:
+                del self.manifest.photosets[setkey]
+
+    def run(self, element):
+        """Syncs element (a Group, PhotoSet or group id); returns a SyncSummary"""
+        engine = DownloadEngine(self.zen, workers=self.workers,
+                                per_host=self.per_host, progress=self._progress,
+                                size=self.size, set_mtime=self.set_mtime)
+        engine.summary = self.summary
+        seen = set()
+        seensets = set()
+        self._changedsets = []
+        self._bysets = {}
+        for key, p in self.manifest.photos.iteritems():
+            for setkey in p['paths']:
+                self._bysets.setdefault(setkey, []).append(key)
+        pool = Executor(max_workers=self.workers, name='zenapi-sync')
+        try:
+            todo = {}
+            for photoset, path in self._photosets(element, self.root):
+                seensets.add(str(photoset.Id))
+                if not (self.quick and self._unchanged(photoset, path, seen)):
+                    f = pool.submit(self.zen.LoadPhotoSet, photoset,
+                                    InformationLevel.Level2, True)
+                    todo[f] = (photoset, path)
+            for f in as_completed(todo):
+                photoset, path = todo[f]
+                try:
+                    self._photoset(f.result(), path, engine, seen)
+                except Exception, e:
+                    logging.warning('Could not sync %s: %s', photoset, e)
+                    self.summary._add('failed', (photoset, None, e))
+                    self._failedsets.add(str(photoset.Id))
+        finally:
+            pool.shutdown(wait=False, cancel_pending=True)
+            engine.join()
+            for setkey, entry in self._changedsets:
+                if setkey not in self._failedsets:
+                    self.manifest.photosets[setkey] = entry
+            self.manifest.save()
+        # Keep the manifest entries of photos we could not check
+        for setkey in self._failedsets:
+            for key in self._bysets.get(setkey, ()):
+                seen.add((key, setkey))
+        self._prune(seen, seensets)
+        self.manifest.save()
+        return self.summary
+
+def _findgroup(group, id):
+    """The group with this id in the tree below group, or None"""
+    if group.Id == id:
+        return group
+    for e in group.Elements or ():
+        if isinstance(e, Group):
+            found = _findgroup(e, id)
+            if found is not None:
+                return found
+    return None
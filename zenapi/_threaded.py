@@ -0,0 +1,144 @@
+"""Thread-pool client returning futures for every ZenConnection call"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from ._futures import Executor, Future, wait, as_completed
+from ._zapi import ZenConnection, API_METHODS
+
+# Queued on the workers: the API calls and the transfers built on them.
+# The rest of ZenConnection's public methods run on the caller's thread
+QUEUED_METHODS = API_METHODS + (
+    'download', 'download_photoset', 'download_group', 'sync', 'upload',
+    'upload_directory', 'load_photos', 'load_photosets',
+    'loadFullGroupHierarchy', 'update_many',
+)
+LOCAL_METHODS = (
+    'enable_cache', 'disable_cache', 'ensure_auth', 'keep_authenticated',
+    'stop_auth_refresh', 'index_hierarchy', 'mirror', 'save',
+    'iterate', # pages load in the background already
+)
+
+class ThreadPoolZenConnection(object):
+    """ZenConnection whose API calls return immediately with a Future
+
+    The API calls (LoadGroup, LoadPhotoSet, Search*, Update*, ...) and
+    transfers (download*, upload*, sync, update_many, ...) take the same
+    arguments as on ZenConnection, but are queued on a pool of max_workers
+    threads and return a Future; call .result() to wait for it, or
+    .cancel() to drop a call which has not started yet.  Any number of
+    calls may be queued.  The local helpers (enable_cache, set_limits,
+    ensure_auth, index_hierarchy, mirror, iterate, ...) run directly and
+    return their usual results.
+
+    The I/O itself is the blocking ZenConnection code: each call on the
+    wire occupies one worker thread, so at most max_workers are in flight
+    and keeping hundreds in flight takes hundreds of threads (see
+    AsyncZenConnection for a client which needs none).  All of them share
+    the keep-alive connection pool (see build_pool: its maxsize should be
+    at least max_workers to avoid reconnecting), and any adaptive
+    concurrency limit of the connection's throttle is widened to
+    max_workers.
+
+    >>> zen = ThreadPoolZenConnection(username='demo', max_workers=32)
+    >>> fs = [zen.LoadPhoto(i) for i in ids]
+    >>> photos = [f.result() for f in fs]
+    """
+
+    def __init__(self, username=None, password=None, filename=None,
+                 max_workers=16, connection=None):
+        """
+        params:
+        connection: an existing ZenConnection to wrap.  If None, one is built
+        from username/password/filename
+        max_workers: number of worker threads, i.e. calls in flight at once
+        """
+        if connection is None:
+            connection = ZenConnection(username=username, password=password,
+                                       filename=filename)
+        self.connection = connection
+        self.max_workers = max_workers
+        self._widen()
+        self.executor = Executor(max_workers=max_workers, name='zenapi-threads')
+
+    def _widen(self):
+        limiter = getattr(self.connection.throttle, 'limiter', None)
+        if limiter is not None:
+            # Otherwise its limit would idle most of the workers
+            limiter.widen(self.max_workers)
+
+    def _getauth(self):
+        return self.connection.auth
+    def _setauth(self, val):
+        self.connection.auth = val
+    auth = property(fget=_getauth, fset=_setauth)
+
+    @staticmethod
+    def load(filename, max_workers=16):
+        """Loads a connection saved with save()"""
+        return ThreadPoolZenConnection(connection=ZenConnection.load(filename),
+                                       max_workers=max_workers)
+
+    def set_limits(self, *args, **kwargs):
+        """ZenConnection.set_limits, keeping any adaptive limit at least
+        max_workers wide"""
+        throttle = self.connection.set_limits(*args, **kwargs)
+        self._widen()
+        return throttle
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs any callable on the client's workers; returns a Future"""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def close(self, wait=True, cancel_pending=False):
+        """Shuts down the workers
+
+        cancel_pending: if True, cancels queued calls which have not started
+        """
+        self.executor.shutdown(wait=wait, cancel_pending=cancel_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(cancel_pending=exc_type is not None)
+        return False
+
+def _syncmethod(name, method):
+    def _call(self, *args, **kwargs):
+        return getattr(self.connection, name)(*args, **kwargs)
+    _call.__name__ = name
+    _call.__doc__ = method.__doc__
+    return _call
+
+def _asyncmethod(name, method):
+    def _call(self, *args, **kwargs):
+        return self.executor.submit(getattr(self.connection, name),
+                                    *args, **kwargs)
+    _call.__name__ = name
+    _call.__doc__ = ((method.__doc__ or '').rstrip() +
+                     '\n\n(Runs on a worker thread: returns a Future)')
+    return _call
+
+for _name in QUEUED_METHODS:
+    setattr(ThreadPoolZenConnection, _name,
+            _asyncmethod(_name, ZenConnection.__dict__[_name]))
+for _name in LOCAL_METHODS:
+    setattr(ThreadPoolZenConnection, _name,
+            _syncmethod(_name, ZenConnection.__dict__[_name]))
+del _name
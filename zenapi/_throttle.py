@@ -0,0 +1,203 @@
+"""Rate limiting primitives shared by connections and transfers"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+import threading
+from time import time, sleep
+
+class TokenBucket(object):
+    """Thread-safe token bucket
+
+    Tokens accrue at rate per second up to burst; consume(n) blocks until n
+    tokens are available.  Requests larger than burst are allowed through
+    once the bucket is full, leaving it in debt, so the long-run rate still
+    holds.
+
+    params:
+    rate: tokens per second (e.g. bytes/s for bandwidth, calls/s for requests)
+    burst: bucket capacity.  Defaults to one second's worth of tokens
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._stamp = time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._stamp)*self.rate)
+        self._stamp = now
+
+    def consume(self, n=1):
+        """Takes n tokens, sleeping as long as needed"""
+        while True:
+            with self._lock:
+                self._refill(time())
+                if self._tokens >= min(n, self.burst):
+                    self._tokens -= n
+                    return
+                wait = (min(n, self.burst) - self._tokens)/self.rate
+            sleep(wait)
+
+    def try_consume(self, n=1):
+        """Takes n tokens if available now; returns True on success"""
+        with self._lock:
+            self._refill(time())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self._refill(time())
+            self.rate = float(rate)
+            if burst is not None:
+                self.burst = float(burst)
+
+class AdaptiveLimiter(object):
+    """Thread-safe concurrency limit which adapts by AIMD
+
+    Each success raises the limit by 1/limit (about +1 per round of
+    calls), up to maximum; an overload signal (a throttling or server
+    error, or a call slower than latency_target) multiplies it by
+    decrease, down to minimum, at most once per latency of the call that
+    triggered it so a burst of failures from one round counts once.
+
+    params:
+    initial, minimum, maximum: calls allowed in flight
+    latency_target: seconds; slower calls count as overload (None to
+    react to errors only)
+    decrease: factor applied to the limit on overload
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64, latency_target=None,
+                 decrease=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.inflight = 0
+        self._lastcut = 0
+        self._cond = threading.Condition()
+
+    def widen(self, n):
+        """Raises the limit (and maximum) to at least n calls"""
+        with self._cond:
+            self.maximum = max(self.maximum, n)
+            self.limit = max(self.limit, float(n))
+            self._cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    def release(self, latency, overloaded=False):
+        """Returns a slot; latency is how long the call took"""
+        with self._cond:
+            self.inflight -= 1
+            if (not overloaded and self.latency_target is not None and
+                latency > self.latency_target):
+                overloaded = True
+            now = time()
+            if overloaded:
+                if now - self._lastcut > latency:
+                    self.limit = max(self.minimum, self.limit*self.decrease)
+                    self._lastcut = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0/self.limit)
+            self._cond.notify_all()
+
+class CallThrottle(object):
+    """Rate limit, adaptive concurrency and retries for API calls
+
+    Every call first takes a token from a TokenBucket (if rate is set) and
+    a slot from an AdaptiveLimiter (if adaptive).  Calls marked idempotent
+    which fail with a transient error are retried up to retries times,
+    sleeping a random time up to backoff*2**attempt (capped at
+    max_backoff), or as long as a Retry-After header asks.  Share one
+    throttle between all threads using a connection.
+
+    params:
+    rate, burst: calls per second allowed (None for no rate limit)
+    retries: retries of idempotent calls after transient errors
+    backoff, max_backoff: seconds, see above
+    adaptive: if True, bounds calls in flight with an AdaptiveLimiter;
+    initial/minimum/maximum/latency_target are passed to it
+    transient: transient(exc) tells retryable errors apart; also used as
+    the limiter's overload signal
+    """
+
+    def __init__(self, rate=None, burst=None, retries=3, backoff=0.5,
+                 max_backoff=30., adaptive=True, initial=8, minimum=1,
+                 maximum=64, latency_target=None, transient=None):
+        self.bucket = None if rate is None else TokenBucket(rate, burst)
+        self.limiter = None
+        if adaptive:
+            self.limiter = AdaptiveLimiter(initial, minimum, maximum,
+                                           latency_target)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.transient = transient or (lambda e: False)
+        self.retried = 0
+
+    def delay(self, attempt, exc=None):
+        """Seconds to wait before retry number attempt (from 0)"""
+        headers = getattr(exc, 'headers', None)
+        if headers is not None:
+            try:
+                return min(self.max_backoff, float(headers.get('Retry-After')))
+            except (TypeError, ValueError, AttributeError):
+                pass
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff*2**attempt))
+
+    def call(self, idempotent, fn, *args, **kwargs):
+        """Returns fn(*args, **kwargs), rate limited and retried"""
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                self.bucket.consume()
+            if self.limiter is not None:
+                self.limiter.acquire()
+            t0 = time()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception, e:
+                transient = self.transient(e)
+                if self.limiter is not None:
+                    self.limiter.release(time() - t0, transient)
+                if not (idempotent and transient and attempt < self.retries):
+                    raise
+                self.retried += 1
+                sleep(self.delay(attempt, e))
+                attempt += 1
+                continue
+            if self.limiter is not None:
+                self.limiter.release(time() - t0)
+            return result
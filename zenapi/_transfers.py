@@ -0,0 +1,375 @@
+"""Concurrent bulk transfers between Zenfolio and local disk"""
+"""
+    Copyright 2009 Scott Gorlin
+
+    This file is part of the python package Zenapi.
+
+    Zenapi is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Zenapi is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Zenapi.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno
+import logging
+import os
+import threading
+import urlparse
+
+from ._futures import Executor
+from ._zapi import Group, PhotoSet, Photo, InformationLevel, _grouplayout
+
+def _makedirs(path):
+    """os.makedirs which tolerates another thread creating path first"""
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+class TransferSummary(object):
+    """Outcome of a bulk transfer
+
+    downloaded, skipped: lists of (photo, local path)
+    failed: list of (object, local path or None, exception); object is a
+    Photo for failed transfers, or the Group/PhotoSet which could not be
+    loaded
+    """
+
+    def __init__(self):
+        self.downloaded = []
+        self.skipped = []
+        self.failed = []
+        self._lock = threading.Lock()
+
+    def _add(self, outcome, item):
+        with self._lock:
+            getattr(self, outcome).append(item)
+
+    def __repr__(self):
+        return '<%s: %i downloaded, %i skipped, %i failed>'%(
+            self.__class__.__name__, len(self.downloaded), len(self.skipped),
+            len(self.failed))
+
+class DownloadEngine(object):
+    """Mirrors groups and photosets to disk with a bounded worker pool
+
+    Photoset and group listings are loaded on their own small pool so that
+    traversal of the hierarchy overlaps with the photo transfers.
+
+    params:
+    zen: the ZenConnection to download through (its auth is used)
+    workers: number of concurrent photo transfers
+    per_host: maximum concurrent transfers to any one image host
+    progress: optional callable progress(event, photo, path, error) where
+    event is one of 'downloaded', 'skipped' or 'failed'.  Called from
+    worker threads.
+    size, skip_existing, set_mtime: as in Photo.download
+    """
+
+    def __init__(self, zen, workers=8, per_host=4, progress=None,
+                 size=Photo.Original, skip_existing=False, set_mtime=False,
+                 traverse_workers=2):
+        self.zen = zen
+        self.per_host = per_host
+        self.progress = progress
+        self.size = size
+        self.skip_existing = skip_existing
+        self.set_mtime = set_mtime
+        self.summary = TransferSummary()
+        self._transfers = Executor(max_workers=workers, name='zenapi-download')
+        self._listings = Executor(max_workers=traverse_workers,
+                                  name='zenapi-listing')
+        self._hosts = {}
+        self._outstanding = 0
+        self._cond = threading.Condition()
+
+    def _spawn(self, executor, fn, *args):
+        with self._cond:
+            self._outstanding += 1
+        def task():
+            try:
+                fn(*args)
+            finally:
+                with self._cond:
+                    self._outstanding -= 1
+                    self._cond.notify_all()
+        executor.submit(task)
+
+    def _hostlock(self, photo):
+        host = photo.UrlHost
+        if host is None:
+            host = urlparse.urlsplit(photo.getUrl(size=self.size)).hostname
+        with self._cond:
+            sem = self._hosts.get(host)
+            if sem is None:
+                sem = self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return sem
+
+    def _report(self, event, photo, path, error=None):
+        if event == 'failed':
+            self.summary._add(event, (photo, path, error))
+        else:
+            self.summary._add(event, (photo, path))
+        if self.progress is not None:
+            try:
+                self.progress(event, photo, path, error)
+            except Exception:
+                logging.exception('Download progress callback failed')
+
+    def add_photoset(self, photoset, path):
+        """Schedules a photoset for download into path/photoset.Title"""
+        self._spawn(self._listings, self._photoset, photoset, path)
+
+    def add_group(self, group, path):
+        """Schedules a group and everything below it for download"""
+        self._spawn(self._listings, self._group, group, path)
+
+    def add_photo(self, photo, path):
+        """Schedules a single photo for download into path"""
+        self._spawn(self._transfers, self._photo, photo, path)
+
+    def _photoset(self, photoset, path):
+        try:
+            if not photoset.Photos:
+                photoset = self.zen.LoadPhotoSet(
+                    photoset, level=InformationLevel.Level2, includePhotos=True)
+            fp = os.path.join(path, photoset.Title)
+            _makedirs(fp)
+        except Exception, e:
+            logging.warning('Could not load %s: %s', photoset, e)
+            self.summary._add('failed', (photoset, None, e))
+            return
+        logging.info('Downloading %s...'%photoset)
+        for photo in photoset.Photos:
+            self.add_photo(photo, fp)
+
+    def _group(self, group, path):
+        try:
+            if (not isinstance(group, Group)) or (not group.Elements):
+                group = self.zen.LoadGroup(group, level=InformationLevel.Level2,
+                                           includeChildren=True)
+        except Exception, e:
+            logging.warning('Could not load %s: %s', group, e)
+            self.summary._add('failed', (group, None, e))
+            return
+        for element, p in _grouplayout(group, path):
+            if isinstance(element, PhotoSet):
+                self.add_photoset(element, p)
+            elif isinstance(element, Group):
+                self.add_group(element, p)
+            else:
+                self.summary._add('failed', (element, None, TypeError(
+                    'Unknown element type %s'%element.__class__.__name__)))
+
+    def _photo(self, photo, path):
+        fp = None
+        try:
+            fp = os.path.join(path, photo.Title)
+            with self._hostlock(photo):
+                done = self.zen.download(photo, path=path, size=self.size,
+                                         set_mtime=self.set_mtime,
+                                         skip_existing=self.skip_existing)
+        except Exception, e:
+            logging.warning('Failed to download %s: %s', photo, e)
+            self._report('failed', photo, fp, e)
+        else:
+            if done:
+                logging.info(' + %s'%photo)
+            self._report('downloaded' if done else 'skipped', photo, fp)
+
+    def join(self):
+        """Waits until every scheduled transfer finishes
+
+        returns: the TransferSummary
+        """
+        try:
+            with self._cond:
+                while self._outstanding:
+                    self._cond.wait(1)
+        finally:
+            self._listings.shutdown(wait=False, cancel_pending=True)
+            self._transfers.shutdown(wait=False, cancel_pending=True)
+        return self.summary
+
+def listfiles(directory, recursive=False, extensions=None):
+    """Sorted paths of the regular, non-hidden files in directory
+
+    extensions: if given, only files whose lower-cased extension is listed
+    """
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for fn in sorted(files):
+            if fn.startswith('.'):
+                continue
+            if (extensions is not None and
+                os.path.splitext(fn)[1].lower() not in extensions):
+                continue
+            paths.append(os.path.join(root, fn))
+        if not recursive:
+            break
+    return paths
+
+class UploadResult(object):
+    """Outcome of uploading one file
+
+    path: the local file
+    photo: the updated Photo snapshot, or None if the upload failed
+    photo_id: id of the new photo, once its bytes were accepted
+    stage: where it failed, 'upload' or 'update' (None on success)
+    error: the exception, or None on success
+    bytes: size of the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.photo = None
+        self.photo_id = None
+        self.stage = None
+        self.error = None
+        self.bytes = 0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return '<UploadResult %s: photo %s>'%(self.path, self.photo_id)
+        return '<UploadResult %s: %s failed: %s>'%(self.path, self.stage,
+                                                   self.error)
+
+class UploadReport(object):
+    """Per-file UploadResults of a bulk upload, in input order"""
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def bytes(self):
+        return sum(r.bytes for r in self.results if r.photo_id is not None)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return '<%s: %i uploaded, %i failed, %i bytes in %.1fs>'%(
+            self.__class__.__name__, len(self.succeeded), len(self.failed),
+            self.bytes, self.elapsed)
+
+class UploadEngine(object):
+    """Uploads files into one gallery, pipelining the metadata updates
+
+    Byte transfers run on a pool of workers; as each completes, its
+    UpdatePhoto call is queued on a separate pool of update_workers.
+
+    params:
+    zen: an authenticated ZenConnection
+    photoset: the target Gallery
+    max_bytes_per_sec: if given, the combined upload rate is capped with a
+    TokenBucket shared by all workers
+    updater: None, or callable updater(path) -> PhotoUpdater
+    progress: called as progress(result) when each file finishes
+    autoFillUpdater, filenameStripRoot: as in ZenConnection.upload
+    """
+
+    def __init__(self, zen, photoset, workers=4, update_workers=2,
+                 max_bytes_per_sec=None, autoFillUpdater=True, updater=None,
+                 filenameStripRoot=True, progress=None):
+        if not photoset.Type == 'Gallery':
+            raise TypeError('Photoset must be a gallery to support uploads')
+        self.zen = zen
+        self.photoset = photoset
+        self.workers = workers
+        self.update_workers = update_workers
+        self.autoFillUpdater = autoFillUpdater
+        self.updater = updater
+        self.filenameStripRoot = filenameStripRoot
+        self.progress = progress
+        self.bandwidth = None
+        if max_bytes_per_sec:
+            from ._throttle import TokenBucket
+            self.bandwidth = TokenBucket(max_bytes_per_sec)
+
+    def _finish(self, result, stage=None, error=None):
+        if error is not None:
+            logging.warning('Upload of %s failed (%s): %s', result.path,
+                            stage, error)
+            result.stage = stage
+            result.error = error
+        if self.progress is not None:
+            try:
+                self.progress(result)
+            except Exception:
+                logging.exception('Upload progress callback failed')
+
+    def _update(self, result, zfilename):
+        try:
+            updater = None
+            if self.updater is not None:
+                updater = self.updater(result.path)
+            updater = self.zen._uploadupdater(result.path, zfilename,
+                                              self.autoFillUpdater, updater)
+            result.photo = self.zen.UpdatePhoto(Photo({'Id':result.photo_id}),
+                                                updater)
+            if self.zen.index is not None:
+                self.zen.index.addPhoto(result.photo, self.photoset)
+        except Exception, e:
+            self._finish(result, 'update', e)
+        else:
+            self._finish(result)
+
+    def _upload(self, result, updates):
+        callback = None
+        if self.bandwidth is not None:
+            callback = self.bandwidth.consume
+        try:
+            result.bytes = os.path.getsize(result.path)
+            result.photo_id, zfilename = self.zen._uploadfile(
+                self.photoset, result.path, self.filenameStripRoot,
+                callback=callback)
+        except Exception, e:
+            self._finish(result, 'upload', e)
+            return None
+        return updates.submit(self._update, result, zfilename)
+
+    def run(self, paths):
+        """Uploads every path; returns an UploadReport"""
+        from time import time
+        t0 = time()
+        results = [UploadResult(p) for p in paths]
+        uploads = Executor(max_workers=self.workers, name='zenapi-upload')
+        updates = Executor(max_workers=self.update_workers,
+                           name='zenapi-update')
+        try:
+            transfers = [uploads.submit(self._upload, r, updates)
+                         for r in results]
+            for f in transfers:
+                update = f.result()
+                if update is not None:
+                    update.result()
+        finally:
+            uploads.shutdown(wait=False, cancel_pending=True)
+            updates.shutdown(wait=False, cancel_pending=True)
+        return UploadReport(results, time() - t0)
@@ -20,18 +20,32 @@
 
 # Inspired by Michael J. Wiacek Jr.
 
+import contextlib
 import hashlib
 import logging
 import json
 import struct
 import urllib
 import urllib2
+import urlparse
 import os
 import re
 import random
 import httplib
 import operator
+import socket
+import threading
+import weakref
+from collections import MutableMapping, MutableSequence, deque
 from datetime import datetime
+from time import time
+from itertools import izip
+
+from . import _codec, _metrics
+from ._pool import ConnectionPool
+from ._futures import Executor, SingleFlight, as_completed
+from ._cache import READ_METHODS, ResponseCache
+from ._throttle import CallThrottle
 
 USE_TLS = True # If getting errors on https connectivity, specify as True
 
@@ -54,6 +68,13 @@ class TLSConnection(httplib.HTTPSConnection):
 class TLSHandler(urllib2.HTTPSHandler):
     def https_open(self, req):
         return self.do_open(TLSConnection, req)    
+
+# Redirects followed when downloading, and how many in a row
+REDIRECT_CODES = frozenset([301, 302, 303, 307, 308])
+MAX_REDIRECTS = 5
+
+class RedirectHandler(urllib2.HTTPRedirectHandler):
+    max_redirections = MAX_REDIRECTS
     
 def build_opener(use_tls=USE_TLS):
     """Build the opener to handle all HTTP/HTTPS requests
@@ -65,11 +86,43 @@ def build_opener(use_tls=USE_TLS):
     """
     global _opener
     if USE_TLS:
-        _opener = urllib2.build_opener(TLSHandler)
+        _opener = urllib2.build_opener(TLSHandler, RedirectHandler)
     else:
-        _opener = urllib2.build_opener()
+        _opener = urllib2.build_opener(RedirectHandler)
 build_opener()
 
+def build_pool(maxsize=4, idle_timeout=30, block=False, use_tls=USE_TLS,
+               enabled=True, **kwargs):
+    """Build the keep-alive connection pool used for all API calls
+
+    params:
+    maxsize: number of persistent connections kept per host
+    idle_timeout: seconds before an unused connection is closed
+    block: if True, maxsize is a hard limit on concurrent connections per host
+    use_tls: as in build_opener
+    enabled: if False, requests go through the urllib2 opener instead (a
+    fresh connection per call)
+    
+    Other keyword arguments are passed to ConnectionPool
+    """
+    global _pool
+    if not enabled:
+        _pool = None
+        return
+    if use_tls:
+        classes = {'http':httplib.HTTPConnection, 'https':TLSConnection}
+    else:
+        classes = {'http':httplib.HTTPConnection,
+                   'https':httplib.HTTPSConnection}
+    _pool = ConnectionPool(maxsize=maxsize, idle_timeout=idle_timeout,
+                           block=block, connection_classes=classes, **kwargs)
+build_pool()
+
+# JSON-RPC endpoints, plain and for authenticated calls.  May be pointed
+# elsewhere, e.g. at the stand-in server in benchmarks/fakeserver.py
+API_URL = 'http://www.zenfolio.com/api/1.8/zfapi.asmx'
+API_SSL_URL = 'https://www.zenfolio.com/api/1.8/zfapi.asmx'
+
 class Error(Exception):
     pass
 
@@ -96,24 +149,41 @@ def MakeHeaders(auth=None):
         
     return headers
 
-def MakeRequest(method, params, auth=None, use_ssl=True):
+def EncodeRequest(method, params, auth=None, use_ssl=True):
+    """The url, headers and encoded body of a JSON-RPC request"""
     headers=MakeHeaders(auth=auth)
     headers['Content-Type'] = 'application/json'
-    global _opener
-    ver='1.8'
-    #ver='1.2'
     if use_ssl is False and auth is None:
-        url = 'http://www.zenfolio.com/api/%s/zfapi.asmx'%ver
+        url = API_URL
     else:
-        url = 'https://www.zenfolio.com/api/%s/zfapi.asmx'%ver
+        url = API_SSL_URL
 
     body = {
         'method':method, 
         'params':params,
         'id':random.randint(1, 2**16 - 1)
     }
-    data = json.dumps(body)
+    data = _codec.codec.dumps(body)
     headers['Content-Length'] = len(data)
+    return url, headers, data
+
+def MakeRequest(method, params, auth=None, use_ssl=True, sizes=None):
+    """POSTs a JSON-RPC request; returns the file-like response
+    
+    sizes: if a dict, receives the request body size as sizes['out']
+    """
+    global _opener
+    url, headers, data = EncodeRequest(method, params, auth, use_ssl)
+    if sizes is not None:
+        sizes['out'] = len(data)
+
+    if _pool is not None:
+        resp = _pool.urlopen('POST', url, body=data, headers=headers,
+                             idempotent=method.startswith(IDEMPOTENT_PREFIXES))
+        if resp.status >= 400:
+            raise HttpError(code=resp.status, headers=resp.headers, url=url,
+                            body=resp.read())
+        return resp
 
     try:
         req = urllib2.Request(url, data=data, headers=headers)
@@ -122,12 +192,98 @@ def MakeRequest(method, params, auth=None, use_ssl=True):
     except urllib2.HTTPError, e:
         raise HttpError(code=e.code, headers=e.headers, url=e.url, body=e.read())
 
+# Statuses whose Location is followed by GETs, and how many times
+
+def OpenUrl(url, headers=None):
+    """GETs a url through the connection pool (or the urllib2 opener)
+    
+    Redirects are followed up to MAX_REDIRECTS times; any other status of
+    300 or above (or a redirect beyond that) raises HttpError
+    
+    returns a file-like response with read(amt) and close()
+    """
+    if headers is None:
+        headers = {}
+    if _pool is not None:
+        for hop in xrange(MAX_REDIRECTS + 1):
+            resp = _pool.urlopen('GET', url, headers=headers, idempotent=True)
+            if resp.status < 300:
+                return resp
+            body = resp.read()
+            location = resp.getheader('Location')
+            if (resp.status not in REDIRECT_CODES or not location or
+                hop == MAX_REDIRECTS):
+                raise HttpError(code=resp.status, headers=resp.headers,
+                                url=url, body=body)
+            url = urlparse.urljoin(url, location)
+    try:
+        return _opener.open(urllib2.Request(url, headers=headers))
+    except urllib2.HTTPError, e:
+        raise HttpError(code=e.code, headers=e.headers, url=e.url, body=e.read())
+
+class _CallbackFile(object):
+    """Read-only wrapper of a file which reports the size of each block read"""
+    
+    def __init__(self, f, callback):
+        self.f = f
+        self.callback = callback
+    
+    def read(self, amt=-1):
+        block = self.f.read(amt)
+        if block:
+            self.callback(len(block))
+        return block
+
+def PostFile(url, f, headers, callback=None):
+    """POSTs the contents of open file f to url without reading it into memory
+    
+    headers must include Content-Length.  callback, if given, is called with
+    the size of every block sent
+    
+    returns a file-like response
+    """
+    if _pool is not None:
+        resp = _pool.urlopen('POST', url, body=f, headers=headers,
+                             callback=callback)
+        if resp.status >= 400:
+            raise HttpError(code=resp.status, headers=resp.headers, url=url,
+                            body=resp.read())
+        return resp
+    if callback is not None:
+        f = _CallbackFile(f, callback)
+    try:
+        # httplib streams file-like request bodies in blocks
+        return _opener.open(urllib2.Request(url, data=f, headers=headers))
+    except urllib2.HTTPError, e:
+        raise HttpError(code=e.code, headers=e.headers, url=e.url, body=e.read())
+
 class RpcError(Error):
     def __init__(self, code=None, message=None):
         Error.__init__(self)
         self.code = code
         self.message = message
 
+# Calls which are safe to repeat after a failure
+IDEMPOTENT_PREFIXES = ('Load', 'Get', 'Search')
+
+# Calls which make a new token, and the errors which mean one is needed
+AUTH_METHODS = frozenset(['GetChallenge', 'Authenticate', 'AuthenticatePlain'])
+AUTH_ERRORS = frozenset(['E_NOTAUTHENTICATED'])
+
+def IsTransient(e):
+    """Whether an error from Call is worth retrying: throttling, server
+    errors, timeouts and dropped connections"""
+    if isinstance(e, HttpError):
+        return e.code == 429 or e.code >= 500
+    return isinstance(e, (socket.error, httplib.HTTPException,
+                          urllib2.URLError))
+
+def DefaultThrottle():
+    """CallThrottle each ZenConnection starts with: no rate limit, no bound
+    on calls in flight and 3 retries of idempotent calls.  Use
+    ZenConnection.set_limits for a rate limit or adaptive concurrency."""
+    return CallThrottle(adaptive=False, transient=IsTransient)
+
 def PackParams(*args):
     def pullResponse(a):
         if isinstance(a, ResponseObject):
@@ -139,23 +295,31 @@ def PackParams(*args):
 Meta framework
 """
 class ResponseObjectBuilder(type):
+    """Generates field properties and compact storage for ResponseObjects
+    
+    Field values live in a per-instance list (_values) indexed by position in
+    __allfields__; parent fields come first, so a property defined on a base
+    class is valid for every subclass.  Classes defined in this module get
+    __slots__, so snapshots carry no per-instance __dict__ either.
+    """
     __registered_types__={}
         
     def __new__(cls, name, bases, attrs):
-        parentfields = []
-        b = bases[0] #only support 1st base for now
-        while b:
-            if hasattr(b, '__fields__'):
-                parentfields.extend(b.__fields__)
-                pass
-            b = b.__base__
+        parentfields = list(getattr(bases[0], '__allfields__', []))
             
-        myfields = list(tuple(attrs.get('__fields__', [])))# lazy copy
+        myfields = [f for f in attrs.get('__fields__', [])
+                    if f not in parentfields]
         
         attrs['__allfields__'] = parentfields + myfields
+        attrs['__fieldindex__'] = dict(
+            (f, i) for i, f in enumerate(attrs['__allfields__']))
+        
+        for i, f in enumerate(myfields):
+            if f not in attrs: # Classes may define their own accessor
+                attrs[f] = cls.getMethod(f, len(parentfields) + i)
         
-        for f in myfields:
-            attrs[f] = cls.getMethod(f)
+        if '__slots__' not in attrs and attrs.get('__module__') == __name__:
+            attrs['__slots__'] = ()
             
         new_class = super(ResponseObjectBuilder, cls).__new__(cls, name,
                                                               bases, attrs)
@@ -163,46 +327,324 @@ class ResponseObjectBuilder(type):
         return new_class
     
     @staticmethod
-    def getMethod(name):
+    def getMethod(name, index):
         def _get(self):
-            return self._dict[name]
+            return self._values[index]
         def _set(self, val):
-            self._dict[name] = val
+            self._track(name, self._values[index])
+            self._values[index] = val
         return property(fget=_get, fset=_set)
+
+class FieldDict(MutableMapping):
+    """Dict-like view of a ResponseObject's fields (and any extra keys)
+    
+    This is what ResponseObject._dict returns; reads and writes go straight
+    to the object's compact storage.
+    """
+    __slots__ = ('_obj',)
+    
+    def __init__(self, obj):
+        self._obj = obj
+    
+    def __getitem__(self, key):
+        obj = self._obj
+        i = obj.__fieldindex__.get(key)
+        if i is not None:
+            return obj._values[i]
+        if key == '$type':
+            return obj.__class__.__name__
+        if obj._extra is None:
+            raise KeyError(key)
+        return obj._extra[key]
+    
+    def __setitem__(self, key, val):
+        obj = self._obj
+        i = obj.__fieldindex__.get(key)
+        if i is not None:
+            obj._track(key, obj._values[i])
+            obj._values[i] = val
+        elif key != '$type':
+            if obj._extra is None:
+                obj._extra = {}
+            obj._extra[key] = val
+    
+    def __delitem__(self, key):
+        obj = self._obj
+        i = obj.__fieldindex__.get(key)
+        if i is not None:
+            obj._track(key, obj._values[i])
+            obj._values[i] = None
+        elif obj._extra is None:
+            raise KeyError(key)
+        else:
+            del obj._extra[key]
+    
+    def __iter__(self):
+        obj = self._obj
+        for f in obj.__allfields__:
+            yield f
+        if obj._extra:
+            for k in obj._extra:
+                yield k
+    
+    def __len__(self):
+        obj = self._obj
+        return len(obj._values) + len(obj._extra or ())
+    
+    def __contains__(self, key):
+        obj = self._obj
+        return key in obj.__fieldindex__ or key in (obj._extra or ())
+    
+    def items(self):
+        return list(self._obj._items())
+    
+    def iteritems(self):
+        return self._obj._items()
+    
+    def copy(self):
+        return dict(self._obj._items())
+    
+    def __repr__(self):
+        return repr(self.copy())
+    
+class LazyList(MutableSequence):
+    """List of snapshots which are built from raw decoded data on first use
+    
+    len() and truth tests are answered from the raw data; anything that
+    reads or changes the items (iteration, indexing, in, append, ...) first
+    builds them all, lazily again for their own nested lists.  This is a
+    sequence rather than a list subclass, so code reading lists directly in
+    C (json.dumps, str.join, ...) cannot mistake it for an empty list; use
+    list(lazylist) where a real list is required.  Pickles as a plain list.
+    """
+    __slots__ = ('_raw', '_items', '_lock')
+    __hash__ = None
+    
+    def __init__(self, raw):
+        self._raw = raw
+        self._items = None
+        self._lock = threading.Lock()
+    
+    def _materialize(self):
+        items = self._items
+        if items is None:
+            with self._lock:
+                if self._items is None:
+                    self._items = [ResponseObject.build(o, lazy=True)
+                                   for o in self._raw]
+                    self._raw = None
+                items = self._items
+        return items
+    
+    def __len__(self):
+        items = self._items
+        if items is not None:
+            return len(items)
+        raw = self._raw
+        if raw is not None:
+            return len(raw)
+        return len(self._items)
+    
+    def __getitem__(self, index):
+        return self._materialize()[index]
+    
+    def __setitem__(self, index, value):
+        self._materialize()[index] = value
+    
+    def __delitem__(self, index):
+        del self._materialize()[index]
+    
+    def insert(self, index, value):
+        self._materialize().insert(index, value)
+    
+    def __iter__(self):
+        return iter(self._materialize())
+    
+    def __reversed__(self):
+        return reversed(self._materialize())
+    
+    def __contains__(self, value):
+        return value in self._materialize()
+    
+    def sort(self, *args, **kwargs):
+        self._materialize().sort(*args, **kwargs)
     
+    def __eq__(self, other):
+        if isinstance(other, LazyList):
+            other = other._materialize()
+        return self._materialize() == other
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __add__(self, other):
+        return self._materialize() + list(other)
+    
+    def __radd__(self, other):
+        return list(other) + self._materialize()
+    
+    def __reduce_ex__(self, protocol):
+        return (list, (list(self),))
+    
+    def __repr__(self):
+        raw = self._raw
+        if raw is not None:
+            return '<%s of %i unbuilt items>'%(self.__class__.__name__,
+                                               len(raw))
+        return repr(self._items)
+
+# Stands for the unknown original value of a field changed in place
+_CHANGED = object()
+
 class ResponseObject(object):
+    """Base of snapshots and updaters
+    
+    Assigning a field (obj.Title = ..., or obj._dict['Title'] = ...)
+    records its previous value, so changes() and updater() can tell what was
+    edited since the object was loaded.  Lists changed in place (e.g.
+    obj.Keywords.append(...)) are not noticed unless marked with
+    mark_changed.
+    """
     __fields__ = []
     __metaclass__ = ResponseObjectBuilder
+    __slots__ = ('_values', '_extra', '_dirty')
+    __updater__ = None # Updater class for changes to this type
     
     def __init__(self, *anydicts, **kwargs):
         for d in anydicts:
             kwargs.update(d)
-        self._dict = kwargs
         if '$type' in kwargs:
-            assert kwargs['$type'] == self.__class__.__name__
-            
-        for f in self.__allfields__:
-            self._dict[f] = kwargs.get(f, None)
-        extra = set(kwargs.keys()) - set(self.__allfields__)
-        if len(extra):
+            assert kwargs.pop('$type') == self.__class__.__name__
+        
+        index = self.__fieldindex__
+        values = [None]*len(index)
+        extra = None
+        for k, v in kwargs.iteritems():
+            i = index.get(k)
+            if i is None:
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+            else:
+                values[i] = v
+        self._values = values
+        self._extra = extra
+        if extra:
             Warning('No fields %s in class %s'%(list(extra),
                                                 self.__class__.__name__))
+    
+    @classmethod
+    def _fromjson(cls, d):
+        """Fast constructor from an already decoded JSON object (see
+        DecodeHook); d is not modified"""
+        obj = cls.__new__(cls)
+        index = cls.__fieldindex__
+        values = [None]*len(index)
+        extra = None
+        for k, v in d.iteritems():
+            i = index.get(k)
+            if i is not None:
+                values[i] = v
+            elif k != '$type':
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+        obj._values = values
+        obj._extra = extra
+        return obj
+    
+    def _getdict(self):
+        return FieldDict(self)
+    _dict = property(fget=_getdict)
+    
+    def _track(self, name, old):
+        # _dirty is left unset until the first change, so building
+        # snapshots costs nothing extra
+        dirty = getattr(self, '_dirty', None)
+        if dirty is None:
+            dirty = self._dirty = {}
+        if name not in dirty:
+            dirty[name] = old
+    
+    def changes(self):
+        """{field: (original, current)} of fields whose value was changed"""
+        dirty = getattr(self, '_dirty', None)
+        if not dirty:
+            return {}
+        values = self._values
+        index = self.__fieldindex__
+        return dict((k, (None if old is _CHANGED else old, values[index[k]]))
+                    for k, old in dirty.iteritems()
+                    if old is _CHANGED or old != values[index[k]])
+    
+    def mark_changed(self, *names):
+        """Marks fields as changed, e.g. lists which were edited in place"""
+        for k in names:
+            if k not in self.__fieldindex__:
+                raise KeyError(k)
+            self._track(k, None)
+            self._dirty[k] = _CHANGED
+    
+    def clear_changes(self, *names):
+        """Forgets the changes to the named fields (by default to all), e.g.
+        once they are saved"""
+        dirty = getattr(self, '_dirty', None)
+        if not dirty:
+            return
+        if not names:
+            self._dirty = None
+        else:
+            for k in names:
+                dirty.pop(k, None)
+    
+    def updater(self):
+        """A minimal Updater (of class __updater__) holding only the changed
+        fields it can carry, or None if none of them changed
+        
+        Note that updaters do not send None; clear a text field with ''.
+        """
+        cls = self.__updater__
+        if cls is None:
+            raise TypeError('%s has no updater'%self.__class__.__name__)
+        index = cls.__fieldindex__
+        fields = dict((k, new) for k, (old, new) in self.changes().iteritems()
+                      if k in index and new is not None)
+        if not fields:
+            return None
+        return cls(fields)
+    
+    def _items(self):
+        """Iterates (name, value) over all fields and extra keys"""
+        for item in izip(self.__allfields__, self._values):
+            yield item
+        if self._extra:
+            for item in self._extra.iteritems():
+                yield item
+    
+    def __getstate__(self):
+        return dict((k, v) for k, v in self._items() if v is not None)
+    
+    def __setstate__(self, state):
+        ResponseObject.__init__(self, state)
             
     def update(self, dictOrRO):
         if isinstance(dictOrRO, ResponseObject):
             ro = dictOrRO.asdict()
         else:
             ro = dictOrRO
+        mine = self._dict
         for k,v in ro.items():
-            if isinstance(self._dict[k], ResponseObject):
-                self._dict[k].update(v)
-            elif isinstance(v, list) or isinstance(v, tuple):
-                if self._dict[k] and isinstance(self._dict[k][0], ResponseObject):
-                    [ss.update(vv) for (ss, vv) in zip(self._dict[k], v)]
+            if k == '$type':
+                continue
+            if isinstance(mine[k], ResponseObject):
+                mine[k].update(v)
+            elif isinstance(v, (list, tuple, LazyList)):
+                if mine[k] and isinstance(mine[k][0], ResponseObject):
+                    [ss.update(vv) for (ss, vv) in zip(mine[k], v)]
                 else:
-                    self._dict[k] = ResponseObject.build(v)
+                    mine[k] = ResponseObject.build(v)
             else:
-                self._dict[k] = v
+                mine[k] = v
                 
     def setIfNone(self, key, val):
         if hasattr(self._dict, key) and self._dict[key] is None:
@@ -211,8 +653,8 @@ class ResponseObject(object):
     
     def asdict(self):
         d = {'$type':self.__class__.__name__}
-        for k,v in self._dict.items():
-            if isinstance(v, list) or isinstance(v, tuple):
+        for k,v in self._items():
+            if isinstance(v, (list, tuple, LazyList)):
                 d[k] = [ResponseObject.__singulartodict(vv) for vv in v]
             elif v is not None:
                 d[k] = ResponseObject.__singulartodict(v)
@@ -225,55 +667,79 @@ class ResponseObject(object):
         return obj
         
     @staticmethod
-    def build(obj):
-        """Builds a response object from a dictionary"""
+    def build(obj, lazy=False):
+        """Builds a response object from a dictionary
+        
+        lazy: if True, nested lists of objects (e.g. PhotoSet.Photos,
+        Group.Elements) become LazyLists, built only when first used
+        """
 
         if isinstance(obj, list) or isinstance(obj, tuple):
-            return [ResponseObject.build(o) for o in obj]
+            return [ResponseObject.build(o, lazy) for o in obj]
         if not isinstance(obj, dict):
             return obj
         
         rodict = {}
-        for k,v in obj.items(): # Recursively builds responses
-            rodict[k] = ResponseObject.build(v)
-            
-        try:
-            types = ResponseObject.__metaclass__.__registered_types__
-            return types[rodict['$type']](rodict)
-        except KeyError:
+        for k,v in obj.iteritems(): # Recursively builds responses
+            if lazy and isinstance(v, list) and v and isinstance(v[0], dict):
+                rodict[k] = LazyList(v)
+            else:
+                rodict[k] = ResponseObject.build(v, lazy)
+        
+        cls = _types.get(rodict.get('$type'))
+        if cls is None:
             return rodict
+        return cls._fromjson(rodict)
         
     
 class DateTime(ResponseObject):
+    """A date from the API
+    
+    The raw 'YYYY-MM-DD HH:MM:SS' string is kept as received and only parsed
+    into a datetime the first time Value is read; asdict() returns the raw
+    string untouched if Value was never read.
+    """
     __fields__ = ['Value']
-    #d4=r'(\d{4,})'
-    #d2=r'(\d{2,})'
     FORMAT = '%Y-%m-%d %H:%M:%S'
-    #datematch = re.compile(''.join([d4,'-',d2,'-',d2,' ',d2,':',d2,':',d2]))
     
-    def __init__(self, *args, **kwargs):
-        ResponseObject.__init__(self, *args, **kwargs)
-        if not isinstance(self.Value, datetime):
-            self.Value = DateTime.str2d(self.Value)
+    def _getvalue(self):
+        v = self._values[0]
+        if isinstance(v, basestring):
+            v = self._values[0] = DateTime.str2d(v)
+        return v
+    def _setvalue(self, val):
+        self._values[0] = val
+    Value = property(fget=_getvalue, fset=_setvalue)
         
     def asdict(self):
-        return {'$type':'DateTime', 'Value':self.Value.strftime(self.FORMAT)}#DateTime.d2str(self.Value)}
+        v = self._values[0]
+        if not isinstance(v, basestring):
+            v = DateTime.d2str(v)
+        return {'$type':'DateTime', 'Value':v}
     
     @classmethod
     def str2d(cls, s):
-        #groups = DateTime.datematch.match(s).groups()
-        #return datetime.datetime(*[int(ss) for ss in groups])
+        # Fixed positions are several times faster than strptime
+        if (len(s) == 19 and s[4] == '-' and s[7] == '-' and s[10] == ' ' and
+            s[13] == ':' and s[16] == ':'):
+            try:
+                return datetime(int(s[:4]), int(s[5:7]), int(s[8:10]),
+                                int(s[11:13]), int(s[14:16]), int(s[17:]))
+            except ValueError:
+                pass
         return datetime.strptime(s, cls.FORMAT)
     
     @classmethod
     def d2str(cls, d):
-        #return '%04i-%02i-%02i %02i:%02i:%02i'%(d.year,
-                                                #d.month,
-                                                #d.day,
-                                                #d.hour,
-                                                #d.minute, 
-                                                #d.second)
-        return d.strftime(cls.FORMAT)
+        return '%04i-%02i-%02i %02i:%02i:%02i'%(d.year, d.month, d.day,
+                                                d.hour, d.minute, d.second)
+
+def _datestr(d):
+    """'YYYY-MM-DD HH:MM:SS' form of a DateTime field (or None), which sorts
+    correctly; the raw string is returned without parsing it"""
+    if d is None:
+        return None
+    return d.asdict()['Value']
                                         
     
 """
@@ -318,20 +784,73 @@ class PhotoUpdater(CommonUpdater):
     __fields__ = ['Keywords', 'Categories', 'Copyright', 'FileName']
 
 
-def Call(method, auth=None, use_ssl=False, params=None):
+_types = ResponseObjectBuilder.__registered_types__
+
+def DecodeHook(d):
+    """json object_hook building snapshots while the response is parsed
+    
+    Objects with a registered $type become instances of that class as soon
+    as the parser finishes them (children first), so a response is turned
+    into snapshots in a single pass instead of being decoded to dicts and
+    then copied again by ResponseObject.build.
+    """
+    cls = _types.get(d.get('$type'))
+    if cls is None:
+        return d
+    return cls._fromjson(d)
+
+def Call(method, auth=None, use_ssl=False, params=None, object_hook=None):
+    """Makes a JSON-RPC call and returns its decoded result
+    
+    object_hook: applied to every decoded object (e.g. DecodeHook to get
+    snapshots directly); by default the result is plain dicts and lists.
+    Encoding and decoding go through the codec set with use_codec
+    """
+    m = _metrics.registry
+    if m is None:
+        return _Call(method, auth, use_ssl, params, object_hook)
+    sizes = {}
+    t0 = time()
+    try:
+        result = _Call(method, auth, use_ssl, params, object_hook, sizes)
+    except Exception, e:
+        m.record_call(method, time() - t0, sizes.get('out', 0),
+                      sizes.get('in', 0), e)
+        raise
+    m.record_call(method, time() - t0, sizes.get('out', 0), sizes.get('in', 0))
+    return result
+
+def _Call(method, auth, use_ssl, params, object_hook, sizes=None):
     if params is None:
         params = []
 
     try:
-        resp = MakeRequest(method, params, auth, use_ssl)
+        resp = MakeRequest(method, params, auth, use_ssl, sizes)
     except HttpError, e:
         logging.warning('ZenFolio API Call for %s failed with params: %s\n'
                         'response code %d with body:\n %s', method, params,
                         e.code, e.body)
         raise e
     
-    response = resp.read()
-    rpc_obj = json.loads(response)
+    codec = _codec.codec
+    if codec.stream:
+        # Parse from the socket as the body arrives
+        reader = _codec.CountingReader(resp)
+        try:
+            rpc_obj = codec.load(reader, object_hook)
+        finally:
+            resp.close()
+        if sizes is not None:
+            sizes['in'] = reader.count
+    else:
+        response = resp.read()
+        if sizes is not None:
+            sizes['in'] = len(response)
+        rpc_obj = codec.loads(response, object_hook)
+    return RpcResult(rpc_obj)
+
+def RpcResult(rpc_obj):
+    """The result of a decoded JSON-RPC response, or raises its RpcError"""
     if rpc_obj['error'] is None:
         return rpc_obj['result']
     else:
@@ -388,6 +907,7 @@ class GroupElement(Snapshot):
         return objs[0]
     
 class Group(GroupElement):
+    __updater__ = GroupUpdater
     __fields__ = [
         #
         # Level 1 fields
@@ -427,6 +947,7 @@ class Group(GroupElement):
         return self.get(title, 'Elements', PhotoSet)
     
 class PhotoSet(GroupElement):
+    __updater__ = PhotoSetUpdater
     __fields__ = [
         #
         # Level 1 fields
@@ -468,6 +989,7 @@ class PhotoSet(GroupElement):
         return self.get(title, 'Photos', Photo)
         
 class Photo(Snapshot):
+    __updater__ = PhotoUpdater
     __reprkeys__=['Title', 'FileName', 'Id']
     __fields__ = [
         #
@@ -512,6 +1034,8 @@ class Photo(Snapshot):
     
     Original = None
     
+    CHUNK_SIZE = 64*1024 # bytes held in memory at once while downloading
+    
     ThumbRegular = 0
     ThumbSquare = 1
     ThumbLarge = 10
@@ -560,32 +1084,134 @@ class Photo(Snapshot):
         if not os.path.isdir(base):
             os.makedirs(base)
             
-        if os.path.isfile(fp):
-            if skip_existing:
-                return False
-            else:
-                os.remove(fp)
-
-        data = urllib2.urlopen(
-            urllib2.Request(
-                self.getUrl(size=size), headers=MakeHeaders(auth=auth))).read() 
-        
-        with open(fp, 'wb') as f:
-            f.write(data)
-            
+        if skip_existing and os.path.isfile(fp):
+            return False
+
+        m = _metrics.registry
+        if m is None:
+            self._fetch(fp, size, auth, set_mtime)
+            return True
+        t0 = time()
+        try:
+            received = self._fetch(fp, size, auth, set_mtime)
+        except Exception, e:
+            m.record_transfer('download', time() - t0, 0, e)
+            raise
+        m.record_transfer('download', time() - t0, received)
+        return True
+    
+    def _fetch(self, fp, size, auth, set_mtime):
+        """Downloads to fp via a temporary file; returns the bytes received"""
         if set_mtime:
             from time import mktime
             ts = mktime(self.UploadedOn.Value.timetuple())
+        resp = OpenUrl(self.getUrl(size=size), headers=MakeHeaders(auth=auth))
+        
+        # Stream into a temporary file next to fp, and only replace any
+        # existing file once the whole photo has arrived
+        try:
+            with _atomicfile(fp, suffix='.part') as f:
+                received = 0
+                while True:
+                    chunk = resp.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+                expected = resp.info().getheader('Content-Length')
+                if expected is not None and int(expected) != received:
+                    raise httplib.IncompleteRead('%i bytes'%received,
+                                                 int(expected) - received)
+        finally:
+            resp.close()
+        
+        if set_mtime:
             os.utime(fp, (ts, ts))
             
-        return True
+        return received
+
+@contextlib.contextmanager
+def _atomicfile(filename, perms=0666, suffix='.tmp'):
+    """Yields a file to write which replaces filename only once the block
+    completes; until then the data goes to a uniquely named temporary file
+    next to it, which is removed on error"""
+    tmp = '%s.%08x%s'%(filename, random.randint(0, 2**32 - 1), suffix)
+    fd = os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_EXCL|
+                 getattr(os, 'O_BINARY', 0), perms)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename) # rename won't replace a file on windows
+        os.rename(tmp, filename)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def _grouplayout(group, path):
+    """Yields (element, parent directory) for each element of a loaded
+    group, in the layout used by downloads and syncs: the group gets the
+    folder path/group.Title, holding its subgroups and photosets, except
+    that a photoset titled like the group goes in path itself"""
+    mypath = os.path.join(path, group.Title)
+    for element in group.Elements:
+        # Put photoset in this directory if title matches
+        if isinstance(element, PhotoSet) and element.Title == group.Title:
+            yield element, path
+        else:
+            yield element, mypath
 
 """
 Formal API
 """
 
+def _refreshauth(ref, stop):
+    """Background renewal of a ZenConnection's token (holds it weakly)"""
+    while True:
+        zen = ref()
+        if zen is None:
+            return
+        wait = 60
+        if zen.auth_expires is not None:
+            wait = zen.auth_expires - zen.auth_margin - time()
+            if wait <= 0: # the last renewal failed
+                wait = 60
+        del zen
+        stop.wait(wait)
+        if stop.is_set():
+            return
+        zen = ref()
+        if zen is None:
+            return
+        try:
+            zen.ensure_auth()
+        except Exception:
+            logging.exception('Could not renew the auth token')
+        del zen
+
 class ZenConnection(object):
-    def __init__(self, username=None, password=None, filename=None):
+    # Runtime state which is not pickled by save(), and its defaults
+    # (callables are called for a fresh value per connection)
+    __transient__ = {'cache':None, 'index':None, 'flights':SingleFlight,
+                     'throttle':DefaultThrottle, 'auth_expires':None,
+                     '_authlock':threading.RLock, '_refresher':None}
+    lazy = False
+    
+    # Token lifecycle, see keep_authenticated
+    auth_lifetime = 12*3600 # seconds a new token is assumed to stay valid
+    auth_margin = 600       # renew this long before it would expire
+    token_file = None
+    
+    def __init__(self, username=None, password=None, filename=None, cache=None,
+                 lazy=False):
+        """
+        params:
+        cache: an optional ResponseCache for read-only calls (see enable_cache)
+        lazy: if True, nested Photos/Elements lists of results are only
+        built into snapshots when first used (see LazyList).  Saves time
+        and memory when e.g. only photoset titles or counts are needed
+        """
         self.auth = None
         if filename:
             z = ZenConnection.load(filename)
@@ -593,6 +1219,74 @@ class ZenConnection(object):
             password = z.__password
         self.__username = username
         self.__password = password
+        self.__setstate__({})
+        self.cache = cache
+        self.lazy = lazy
+    
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        for k in self.__transient__:
+            d.pop(k, None)
+        return d
+    
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        for k, v in self.__transient__.items():
+            if k not in d:
+                setattr(self, k, v() if callable(v) else v)
+    
+    def enable_cache(self, ttl=60, maxsize=1024):
+        """Caches results of the read-only Load*/Get* calls
+        
+        Entries are keyed on method, params (including the information
+        level) and auth token, and are dropped after ttl seconds, when more
+        than maxsize are held, or when a mutating call (Update*, Move*,
+        Delete*, SetGroupTitlePhoto, ...) touches an object they reference.
+        See ResponseCache.  Returns the cache.
+        """
+        self.cache = ResponseCache(ttl=ttl, maxsize=maxsize)
+        return self.cache
+    
+    def disable_cache(self):
+        self.cache = None
+    
+    def set_limits(self, rate=None, burst=None, retries=3, backoff=0.5,
+                   max_backoff=30., adaptive=True, initial=8, minimum=1,
+                   maximum=64, latency_target=None):
+        """Replaces the throttle shared by all calls on this connection
+        
+        rate, burst: calls per second allowed (None for no limit)
+        retries, backoff, max_backoff: how often, and after how long, Load*,
+        Get* and Search* calls are retried after transient errors
+        (throttling, 5xx, timeouts, dropped connections)
+        adaptive: bounds calls in flight, growing the bound while calls
+        succeed and halving it on errors or calls slower than
+        latency_target seconds; initial/minimum/maximum bound it
+        
+        Set self.throttle = None to send calls unthrottled and unretried.
+        Returns the CallThrottle.
+        """
+        self.throttle = CallThrottle(
+            rate=rate, burst=burst, retries=retries, backoff=backoff,
+            max_backoff=max_backoff, adaptive=adaptive, initial=initial,
+            minimum=minimum, maximum=maximum, latency_target=latency_target,
+            transient=IsTransient)
+        return self.throttle
+    
+    def index_hierarchy(self, root=None):
+        """Builds a HierarchyIndex and attaches it to this connection
+        
+        Groups, photosets and photos created, deleted, moved, updated or
+        uploaded through this connection from then on are reflected in the
+        index (and in its tree).  Returns the index.
+        
+        root: the Group tree to index; by default LoadGroupHierarchy()
+        """
+        from ._index import HierarchyIndex
+        if root is None:
+            root = self.LoadGroupHierarchy()
+        self.index = HierarchyIndex(root)
+        return self.index
                                       
     def save(self, filename):
         import cPickle
@@ -612,9 +1306,45 @@ class ZenConnection(object):
         return zapi
     
     def call(self, method, useMyAuthentication=True, **kwargs):
-        if useMyAuthentication:
-            kwargs['auth']=self.auth
-        return ResponseObject.build(Call(method, **kwargs))
+        if not useMyAuthentication:
+            return self._dispatch(method, **kwargs)
+        token = kwargs['auth'] = self.auth
+        if method in AUTH_METHODS:
+            return self._dispatch(method, **kwargs)
+        try:
+            return self._dispatch(method, **kwargs)
+        except RpcError, e:
+            if e.code not in AUTH_ERRORS or self.__password is None:
+                raise
+        # The token expired or was revoked: get a new one (unless another
+        # thread already has) and try once more
+        self._reauthenticate(token)
+        kwargs['auth'] = self.auth
+        return self._dispatch(method, **kwargs)
+    
+    def _dispatch(self, method, **kwargs):
+        if self.flights is not None and method in READ_METHODS:
+            # Identical reads already in flight are shared, not repeated
+            key = ResponseCache.key(method, kwargs.get('params'),
+                                    kwargs.get('auth'))
+            return self.flights.do(key, self._throttledcall, method, **kwargs)
+        return self._throttledcall(method, **kwargs)
+    
+    def _throttledcall(self, method, **kwargs):
+        if self.throttle is None:
+            return self._call(method, **kwargs)
+        return self.throttle.call(method.startswith(IDEMPOTENT_PREFIXES),
+                                  self._call, method, **kwargs)
+    
+    def _call(self, method, **kwargs):
+        if self.cache is not None:
+            # The cache keeps plain results; each hit gets fresh snapshots
+            return ResponseObject.build(self.cache.call(Call, method, **kwargs),
+                                        self.lazy)
+        if self.lazy:
+            # Nested lists are built later, so keep the plain decode here
+            return ResponseObject.build(Call(method, **kwargs), lazy=True)
+        return Call(method, object_hook=DecodeHook, **kwargs)
     
     """
     Authentication
@@ -624,8 +1354,8 @@ class ZenConnection(object):
         return self.call('GetChallenge', params=PackParams(self.__username))
 
     def AuthenticatePlain(self):
-        self.auth = self.call('AuthenticatePlain', use_ssl=True, 
-                              params=PackParams(self.__username, self.__password))
+        self._settoken(self.call('AuthenticatePlain', use_ssl=True, 
+                                 params=PackParams(self.__username, self.__password)))
         
     def Authenticate(self):
         auth_challenge = self.GetChallenge()
@@ -649,7 +1379,96 @@ class ZenConnection(object):
                 'Authentication failed code: %s and message: %s', e.code, e.message)
         
         else:
-            self.auth = resp
+            self._settoken(resp)
+    
+    def _settoken(self, token):
+        self.auth = token
+        self.auth_expires = time() + self.auth_lifetime
+        if self.token_file:
+            self._savetoken()
+    
+    def _authvalid(self):
+        return self.auth is not None and (
+            self.auth_expires is None or
+            self.auth_expires - self.auth_margin > time())
+    
+    def ensure_auth(self):
+        """Authenticates unless the current token is still good for a while
+        (longer than auth_margin); concurrent callers share one
+        authentication.  Returns the token."""
+        if not self._authvalid():
+            with self._authlock:
+                if not self._authvalid():
+                    self.Authenticate()
+        return self.auth
+    
+    def _reauthenticate(self, stale):
+        with self._authlock:
+            if self.auth == stale or not self._authvalid():
+                self.Authenticate()
+    
+    def keep_authenticated(self, token_file=None, lifetime=None, margin=None,
+                           background=True):
+        """Manages the auth token for long or repeated jobs
+        
+        Calls already re-authenticate once when the server reports an
+        expired token, and ensure_auth() (used by auto_auth downloads) only
+        authenticates when needed.  This additionally
+        
+        token_file: if given, keeps the token in this file (readable by the
+        owner only) so later processes reuse it instead of authenticating
+        lifetime, margin: override auth_lifetime and auth_margin
+        background: renews the token in a background thread auth_margin
+        seconds before it expires (see stop_auth_refresh)
+        
+        Returns the token.
+        """
+        if lifetime is not None:
+            if self.auth_expires is not None:
+                # The token held was assumed to last the old lifetime
+                self.auth_expires += lifetime - self.auth_lifetime
+            self.auth_lifetime = lifetime
+        if margin is not None:
+            self.auth_margin = margin
+        if token_file is not None:
+            self.token_file = token_file
+            self._loadtoken()
+        token = self.ensure_auth()
+        if token_file is not None:
+            # Also when the token held was still good and so not renewed
+            self._savetoken()
+        if background and self._refresher is None:
+            stop = threading.Event()
+            t = threading.Thread(target=_refreshauth,
+                                 args=(weakref.ref(self), stop),
+                                 name='zenapi-auth')
+            t.setDaemon(True)
+            self._refresher = stop
+            t.start()
+        return token
+    
+    def stop_auth_refresh(self):
+        """Stops the background renewal started by keep_authenticated"""
+        if self._refresher is not None:
+            self._refresher.set()
+            self._refresher = None
+    
+    def _loadtoken(self):
+        try:
+            with open(self.token_file, 'rb') as f:
+                d = json.load(f)
+        except (IOError, ValueError):
+            return
+        if (d.get('username') == self.__username and
+            d.get('expires', 0) - self.auth_margin > time()):
+            self.auth = d['token']
+            self.auth_expires = d['expires']
+    
+    def _savetoken(self):
+        """Atomically writes the token file, readable by the owner only"""
+        with _atomicfile(self.token_file, perms=0600) as f:
+            json.dump({'username':self.__username, 'token':self.auth,
+                       'expires':self.auth_expires}, f)
     
     """
     Loaders
@@ -663,14 +1482,20 @@ class ZenConnection(object):
                          params=PackParams(int(photoset)))
     
     def AddPhotoToCollection(self, photo, collection):
-        return self.call('CollectionAddPhoto',
-                         params=PackParams(int(collection), int(photo)))
+        result = self.call('CollectionAddPhoto',
+                           params=PackParams(int(collection), int(photo)))
+        if self.index is not None:
+            self.index.addPhoto(photo, collection)
+        return result
 
     
 
     def RemovePhotoFromCollection(self, photo, collection):
-        return self.call('CollectionRemovePhoto',
-                         params=PackParams(int(collection), int(photo)))
+        result = self.call('CollectionRemovePhoto',
+                           params=PackParams(int(collection), int(photo)))
+        if self.index is not None:
+            self.index.removePhoto(photo, collection)
+        return result
 
 
     def CreateGroup(self, parent, updater=None):
@@ -678,8 +1503,11 @@ class ZenConnection(object):
             updater = GroupUpdater()
         assert isinstance(updater, GroupUpdater)
         
-        return self.call('CreateGroup',
-                         params = PackParams(int(parent), updater))
+        result = self.call('CreateGroup',
+                           params = PackParams(int(parent), updater))
+        if self.index is not None:
+            self.index.add(result, parent)
+        return result
 
 
     def CreatePhotoset(self, parent, photoset_type=None, updater=None):
@@ -690,20 +1518,32 @@ class ZenConnection(object):
             updater = PhotoSetUpdater()
         assert isinstance(updater, PhotoSetUpdater)
 
-        return self.call('CreatePhotoSet',
-                         params=PackParams(int(parent), photoset_type, updater))
+        result = self.call('CreatePhotoSet',
+                           params=PackParams(int(parent), photoset_type, updater))
+        if self.index is not None:
+            self.index.add(result, parent)
+        return result
 
 
     def DeleteGroup(self, group):
-        return self.call('DeleteGroup', params=PackParams(int(group)))
+        result = self.call('DeleteGroup', params=PackParams(int(group)))
+        if self.index is not None:
+            self.index.remove(group)
+        return result
 
 
     def DeletePhoto(self, photo):
-        return self.call('DeletePhoto', params=PackParams(int(photo)))
+        result = self.call('DeletePhoto', params=PackParams(int(photo)))
+        if self.index is not None:
+            self.index.removePhoto(photo)
+        return result
 
 
     def DeletePhotoset(self, photoset):
-        return self.call('DeletePhotoSet', params=PackParams(int(photoset)))
+        result = self.call('DeletePhotoSet', params=PackParams(int(photoset)))
+        if self.index is not None:
+            self.index.remove(photoset)
+        return result
 
 
 
@@ -772,18 +1612,27 @@ class ZenConnection(object):
 
 
     def MoveGroup(self, group, dest_group, index):
-        return self.call('MoveGroup',
-                         params=PackParams(int(group), int(dest_group), index))
+        result = self.call('MoveGroup',
+                           params=PackParams(int(group), int(dest_group), index))
+        if self.index is not None:
+            self.index.move(group, dest_group, index)
+        return result
 
 
     def MovePhoto(self, src_set, photo, dest_set, index):
-        return self.call('MovePhoto',
+        result = self.call('MovePhoto',
                     params=PackParams(int(src_set), int(photo), int(dest_set), index))
+        if self.index is not None:
+            self.index.movePhoto(photo, src_set, dest_set, index)
+        return result
 
 
     def MovePhotoSet(self, photoset, dest_group, index):
-        return self.call('MovePhotoSet',
-                         params=PackParams(int(photoset), int(dest_group), index))
+        result = self.call('MovePhotoSet',
+                           params=PackParams(int(photoset), int(dest_group), index))
+        if self.index is not None:
+            self.index.move(photoset, dest_group, index)
+        return result
 
 
     def ReorderGroup(self, group, group_shift_order):
@@ -918,20 +1767,48 @@ class ZenConnection(object):
 
     def UpdateGroup(self, group, updater):
         assert isinstance(updater, GroupUpdater)
-        return self.call('UpdateGroup', params=PackParams(group, updater))
+        result = self.call('UpdateGroup',
+                           params=PackParams(int(group), updater))
+        if self.index is not None:
+            self.index.update(result)
+        return result
 
 
     def UpdatePhoto(self, photo, updater):
         assert isinstance(updater, PhotoUpdater)
 
-        return self.call('UpdatePhoto',
-                         params=PackParams(int(photo), updater))
+        result = self.call('UpdatePhoto',
+                           params=PackParams(int(photo), updater))
+        if self.index is not None:
+            self.index.update(result)
+        return result
 
     def UpdatePhotoSet(self, photoset, updater):
         assert isinstance(updater, PhotoSetUpdater)
 
-        return self.call('UpdatePhotoSet',
-                         params=PackParams(int(photoset), updater))
+        result = self.call('UpdatePhotoSet',
+                           params=PackParams(int(photoset), updater))
+        if self.index is not None:
+            self.index.update(result)
+        return result
+    
+    def save_changes(self, obj):
+        """Saves the fields changed on a Group, PhotoSet or Photo snapshot
+        
+        Sends only the changed fields (see ResponseObject.updater) with
+        UpdateGroup/UpdatePhotoSet/UpdatePhoto, and makes no call at all
+        when nothing updatable changed.  The saved fields are then no longer
+        counted as changed.
+        
+        returns the updated snapshot from the server, or obj itself if
+        nothing was sent
+        """
+        updater = obj.updater()
+        if updater is None:
+            return obj
+        result = getattr(self, 'Update' + obj.__class__.__name__)(obj, updater)
+        obj.clear_changes(*[k for k, v in updater._items() if v is not None])
+        return result
     
     def UpdateGroupAccess(self, group, updater):
         assert isinstance(updater, AccessUpdater)
@@ -959,19 +1836,34 @@ class ZenConnection(object):
         """
         return photo.download(fn=fn, path=path, auth=self.auth, skip_existing=skip_existing, set_mtime=set_mtime, size=size)
         
-    def download_photoset(self, photoset, skip_existing=False, path=None, set_mtime=False, size=Photo.Original, auto_auth=False):
+    def download_photoset(self, photoset, skip_existing=False, path=None, set_mtime=False, size=Photo.Original, auto_auth=False,
+                          workers=None, per_host=4, progress=None):
         """Download a PhotoSet to local disk
         
         params:
         photoset: a PhotoSet snapshot
         skip_existing: passed to download (doesn't overwrite existing photos on disk)
         path: parent folder in which to place PhotoSet (creates folder PhotoSet.Title underneath)
-        auto_auth: if True, (re) authenticates before downloading to ensure access
+        auto_auth: if True, makes sure a valid token is held before
+        downloading (authenticating only if needed, see ensure_auth)
         size: photo size to download
+        workers: if given, downloads this many photos concurrently (see
+        DownloadEngine) and returns a TransferSummary
+        per_host: with workers, the limit of concurrent transfers per image host
+        progress: with workers, called as progress(event, photo, path, error)
+        for every photo
         """
         
         if auto_auth:
-            self.Authenticate()
+            self.ensure_auth()
+        if workers:
+            from ._transfers import DownloadEngine
+            engine = DownloadEngine(self, workers=workers, per_host=per_host,
+                                    progress=progress, size=size,
+                                    skip_existing=skip_existing,
+                                    set_mtime=set_mtime)
+            engine.add_photoset(photoset, os.curdir if path is None else path)
+            return engine.join()
         logging.info('Downloading %s...'%photoset)
         if not photoset.Photos:
             photoset = self.LoadPhotoSet(photoset, level=InformationLevel.Level2,
@@ -987,29 +1879,36 @@ class ZenConnection(object):
                 logging.info(' + %s'%photo)                
             
     def download_group(self, group, skip_existing=False, path=None, set_mtime=False,
-                       size=Photo.Original, auto_auth=False):
+                       size=Photo.Original, auto_auth=False, workers=None,
+                       per_host=4, progress=None):
         """Download a group and all child groups/photosets to disk
         
         params:
         group: Group snapshot or id
         path: parent directory in which to place group 
         (creates folder group.Title underneath).
+        workers, per_host, progress: as in download_photoset.  With workers,
+        photoset listings are loaded while earlier photos are still
+        transferring, and a TransferSummary is returned
         """
+        if auto_auth:
+            self.ensure_auth()
+        if workers:
+            from ._transfers import DownloadEngine
+            engine = DownloadEngine(self, workers=workers, per_host=per_host,
+                                    progress=progress, size=size,
+                                    skip_existing=skip_existing,
+                                    set_mtime=set_mtime)
+            engine.add_group(group, os.curdir if path is None else path)
+            return engine.join()
         if (not isinstance(group, Group)) or (not group.Elements):
             group = self.LoadGroup(group, level=InformationLevel.Level2, includeChildren=True)
         
         if path is None:
             path=os.curdir
             
-        mypath = os.path.join(path, group.Title)
-        
-        for element in group.Elements:
+        for element, p in _grouplayout(group, path):
             if isinstance(element, PhotoSet):
-                # Put photoset in this directory if title matches
-                if element.Title == group.Title:
-                    p = path # One level up
-                else:
-                    p = mypath
                 self.download_photoset(
                     element, set_mtime=set_mtime,
                     skip_existing=skip_existing,
@@ -1017,10 +1916,200 @@ class ZenConnection(object):
             elif isinstance(element, Group):
                 self.download_group(element, set_mtime=set_mtime,
                                     skip_existing=skip_existing, auto_auth=auto_auth,
-                                    path=mypath, size=size)
+                                    path=p, size=size)
             else:
                 raise TypeError('Unknown element type %s'%element.__class__.__name__)
             
+    def sync(self, element, path=None, manifest=None, delete=True,
+             quick=False, workers=4, per_host=4, size=Photo.Original,
+             set_mtime=True, progress=None):
+        """Incrementally mirrors a Group or PhotoSet to local disk
+        
+        A manifest of synced photos (keyed by photo Id, recording Sequence,
+        Size, UploadedOn and local path) is kept under path, so that a re-sync
+        only transfers new or replaced photos, moves renamed ones and deletes
+        photos removed from Zenfolio.  Every photoset is loaded and each of
+        its photos checked against the manifest.
+        
+        params:
+        element: a Group, PhotoSet or group id
+        path: parent directory, laid out as in download_group
+        manifest: manifest filename.  Defaults to .zenapi-sync-<Id>.json in path
+        delete: if False, never removes local files
+        quick: if True, photosets whose ModifiedOn and PhotoCount match the
+        manifest are not loaded; photos replaced or renamed in them without
+        changing either are then missed
+        workers, per_host, progress: as in download_photoset (workers also
+        bounds the concurrent LoadPhotoSet calls)
+        
+        returns: a SyncSummary
+        """
+        from ._sync import Sync, SyncManifest
+        if path is None:
+            path = os.curdir
+        if manifest is None:
+            manifest = SyncManifest.default_filename(path, element)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return Sync(self, path, SyncManifest(manifest), delete=delete,
+                    quick=quick, workers=workers, per_host=per_host,
+                    size=size, set_mtime=set_mtime,
+                    progress=progress).run(element)
+    
+    def load_photos(self, photos, level=InformationLevel.Level1, workers=8):
+        """Loads many photos (snapshots or Ids) concurrently
+        
+        Returns a list in the order of photos holding each Photo, or the
+        exception raised while loading it.  Repeated Ids are loaded once, at
+        most workers calls are made at a time, and calls which are already
+        in flight from other threads are joined rather than repeated.
+        """
+        return self._loadmany(self.LoadPhoto, photos, workers, level)
+    
+    def load_photosets(self, photosets, level=InformationLevel.Level1,
+                       includePhotos=False, workers=8):
+        """Loads many photosets (snapshots or Ids) concurrently; see
+        load_photos"""
+        return self._loadmany(self.LoadPhotoSet, photosets, workers, level,
+                              includePhotos)
+    
+    def _loadmany(self, load, objs, workers, *args):
+        ids = [int(o) for o in objs]
+        pool = Executor(max_workers=workers, name='zenapi-load')
+        try:
+            fs = {}
+            for i in ids:
+                if i not in fs:
+                    fs[i] = pool.submit(load, i, *args)
+            results = []
+            for i in ids:
+                e = fs[i].exception()
+                results.append(fs[i].result() if e is None else e)
+            return results
+        finally:
+            pool.shutdown(wait=False)
+    
+    def loadFullGroupHierarchy(self, level=InformationLevel.Level1, workers=8,
+                               filter=None, callback=None, root=None):
+        """Loads the group hierarchy with every photoset's Photos
+        
+        The groups come from one LoadGroupHierarchy call; the photosets in
+        it are then loaded with LoadPhotoSet(includePhotos=True) by up to
+        workers concurrent calls, requested breadth first (top-level
+        photosets first), and their fields and Photos are copied onto the
+        photoset snapshots already in the tree.  Photosets which fail to
+        load are logged and keep Photos as None; passing the returned tree
+        back as root loads just those.
+        
+        params:
+        level: InformationLevel of the photosets and photos
+        workers: most LoadPhotoSet calls in flight at once
+        filter: None, or filter(element) -> False to leave out a Group
+        (with everything below it) or PhotoSet
+        callback: called as callback(photoset) with each photoset as soon
+        as its photos are attached (in the calling thread), so that work can
+        start before the whole hierarchy is in
+        root: a Group tree to complete instead of loading a new one; only
+        its photosets whose Photos is None are loaded
+        
+        returns: the root Group
+        """
+        if root is None:
+            root = self.LoadGroupHierarchy()
+        pool = Executor(max_workers=workers, name='zenapi-hierarchy')
+        try:
+            pending = {}
+            groups = deque([root])
+            while groups:
+                for e in groups.popleft().Elements or ():
+                    if filter is not None and not filter(e):
+                        continue
+                    if isinstance(e, Group):
+                        groups.append(e)
+                    elif isinstance(e, PhotoSet) and e.Photos is None:
+                        f = pool.submit(self.LoadPhotoSet, e, level, True)
+                        pending[f] = e
+            for f in as_completed(pending):
+                photoset = pending.pop(f)
+                error = f.exception()
+                if error is not None:
+                    logging.warning('Loading photoset %s failed: %s',
+                                    photoset.Id, error)
+                    continue
+                loaded = f.result()
+                fields = [(k, v) for k, v in loaded._items() if v is not None]
+                for k, v in fields:
+                    photoset._dict[k] = v
+                photoset.clear_changes(*[k for k, v in fields])
+                if callback is not None:
+                    callback(photoset)
+        finally:
+            pool.shutdown(wait=False, cancel_pending=True)
+        return root
+    
+    def update_many(self, items, workers=8, checkpoint=None, progress=None):
+        """Applies many metadata updates concurrently
+        
+        >>> report = zen.update_many(((p, PhotoUpdater(Keywords=['x']))
+        ...                           for p in photos), checkpoint='kw.log')
+        >>> report.failed
+        
+        params:
+        items: (target, updater) pairs.  The updater's class picks the call
+        (UpdatePhoto, UpdatePhotoSet or UpdateGroup; for an AccessUpdater
+        the target must be a snapshot, whose class picks Update*Access).
+        The target is a snapshot or an id.  An updater of None sends the
+        target snapshot's own changes (see save_changes)
+        workers: number of concurrent calls
+        checkpoint: None, or a file recording each update made, so that
+        running the same updates again skips those already done
+        progress: called as progress(result) with each finished
+        UpdateResult (from worker threads)
+        
+        returns: an UpdateReport listing a result for every item, in order;
+        failures do not stop the other items
+        """
+        from ._bulk import BulkUpdater
+        return BulkUpdater(self, workers=workers, checkpoint=checkpoint,
+                           progress=progress).run(items)
+    
+    def iterate(self, method, page_size=100, prefetch=1, max_items=None,
+                **kwargs):
+        """Yields every item of a paged call across all of its pages
+        
+        Works with the Search*, GetRecent* and GetPopular* calls.  Pages are
+        requested with offset/limit, loading up to prefetch pages ahead in
+        the background while the current one is consumed, and iteration
+        stops cleanly after the last page.  Search* pages share one searchId
+        (a new one unless given) so the server pages through a single
+        result set.
+        
+        >>> for photo in zen.iterate('SearchPhotoByText', query='sunset',
+        ...                          sort_order='Date'):
+        ...     print photo.Title
+        
+        params:
+        method: name of the paged call, e.g. 'GetRecentSets'
+        page_size: items per call
+        prefetch: pages requested ahead of the one being consumed
+        max_items: stop after this many items
+        kwargs: the call's other arguments (not offset or limit)
+        """
+        from ._paging import iterpages, new_search_id
+        fn = getattr(self, method)
+        if method.startswith('Search') and kwargs.get('searchId') is None:
+            kwargs['searchId'] = new_search_id()
+        def fetch(offset, limit):
+            return fn(offset=offset, limit=limit, **kwargs)
+        return iterpages(fetch, page_size=page_size, prefetch=prefetch,
+                         max_items=max_items)
+    
+    def mirror(self, filename, level=InformationLevel.Level2):
+        """Opens (creating if needed) a LocalMirror of this account in a
+        SQLite database; call its refresh() to bring it up to date"""
+        from ._mirror import LocalMirror
+        return LocalMirror(self, filename, level=level)
+    
     def upload(self, photoset, file_name, autoFillUpdater=True, updater=None, 
                filenameStripRoot=True):
         """Uploads a photo
@@ -1036,17 +2125,61 @@ class ZenConnection(object):
             relative path from a directory (ie C:\My Documents\Me\Awesome.jpg 
             with a root C:\My Documents will become Me\Awesome.jpg)
         """
-        import email.Utils
-
         if not photoset.Type == 'Gallery':
             raise TypeError('Photoset must be a gallery to support uploads')
+        
+        try:
+            photo_id, zfilename = self._uploadfile(photoset, file_name,
+                                                   filenameStripRoot)
+            #result = self.LoadPhoto(Photo({'Id':result}))
+            updater = self._uploadupdater(file_name, zfilename,
+                                          autoFillUpdater, updater)
+            result = self.UpdatePhoto(Photo({'Id':photo_id}), updater)
+            #LOG.debug ("RESPONSE: --\n%s\n--\n" % data)
+            #result = json.loads(data)
+            # TBD : check for erorr by checking the status of the HTTP message
+        except Exception, e:
+            print e
+            raise RuntimeError
 
-        f = open(file_name, "rb")
-        data = f.read()
-        f.close()
+        if self.index is not None:
+            self.index.addPhoto(result, photoset)
+        return result
+    
+    def _uploadfile(self, photoset, file_name, filenameStripRoot=True,
+                    callback=None):
+        """Sends the bytes of a photo to photoset.UploadUrl
+        
+        callback: called with the size of each block sent
+        returns: (new photo id, filename as recorded on Zenfolio)
+        """
+        url, headers, zfilename = self._uploadrequest(photoset, file_name,
+                                                      filenameStripRoot)
+        size = headers['Content-Length']
+        m = _metrics.registry
+        t0 = time()
+        try:
+            with open(file_name, "rb") as f:
+                resp = PostFile(url, f, headers=headers, callback=callback)
+                result = _codec.codec.loads(resp.read())
+        except Exception, e:
+            if m is not None:
+                m.record_transfer('upload', time() - t0, 0, e)
+            raise
+        if m is not None:
+            m.record_transfer('upload', time() - t0, size)
+        if self.cache is not None:
+            self.cache.invalidate([int(photoset)])
+        return result, zfilename
+    
+    def _uploadrequest(self, photoset, file_name, filenameStripRoot=True):
+        """The url and headers to POST file_name to photoset.UploadUrl
         
-        size = len(data)
-        #f.seek(0)
+        returns: (url, headers, filename as recorded on Zenfolio)
+        """
+        import email.Utils
+
+        size = os.path.getsize(file_name)
         #if date_modified:
             #modified = email.Utils.formatdate (time.mktime (date_modified.timetuple()))
         #else:
@@ -1058,7 +2191,7 @@ class ZenConnection(object):
                    'X-Zenfolio-User-Agent': 'PyZenfolio Library'}
         
         headers['Content-Type'] = 'image/jpeg'
-        headers['Content-Length'] = len(data)
+        headers['Content-Length'] = size
         
         assert self.auth is not None
         headers['X-Zenfolio-Token'] = self.auth
@@ -1072,28 +2205,76 @@ class ZenConnection(object):
             zfilename = file_name
             
         url = upload_url + '?' + urllib.urlencode ([("filename", zfilename)])#, ("modified", modified)])
-        req = urllib2.Request(upload_url, data=data, headers=headers)
-        opener = urllib2.build_opener(urllib2.HTTPHandler(debuglevel=0))
+        return url, headers, zfilename
+    
+    @staticmethod
+    def _uploadupdater(file_name, zfilename, autoFillUpdater=True, updater=None):
+        if updater is None:
+            updater = PhotoUpdater()
+        assert isinstance(updater, PhotoUpdater)
+        if autoFillUpdater:
+            updater.setIfNone('Title', os.path.basename(file_name))
+            updater.setIfNone('FileName', zfilename)
+        return updater
+    
+    def upload_directory(self, photoset, source, workers=4, update_workers=2,
+                         max_bytes_per_sec=None, recursive=False,
+                         extensions=None, autoFillUpdater=True, updater=None,
+                         filenameStripRoot=True, progress=None):
+        """Uploads many photos into a gallery concurrently
         
-        try:
-            result = json.loads(opener.open(req).read())
-            #result = self.LoadPhoto(Photo({'Id':result}))
-            if updater is None:
-                updater = PhotoUpdater()
-            assert isinstance(updater, PhotoUpdater)
-            if autoFillUpdater:
-                updater.setIfNone('Title', os.path.basename(file_name))
-                updater.setIfNone('FileName', zfilename)
-            result = self.UpdatePhoto(Photo({'Id':result}), updater)
-            #LOG.debug ("RESPONSE: --\n%s\n--\n" % data)
-            #result = json.loads(data)
-            # TBD : check for erorr by checking the status of the HTTP message
-        except Exception, e:
-            print e
-            raise RuntimeError
-
-        return result
-
+        Byte transfers run on their own pool of workers; each finished
+        transfer hands its UpdatePhoto call to a separate (smaller) pool, so
+        metadata round trips never hold up the uploads.
+        
+        params:
+        photoset: the Gallery photoset object that will be the parent
+        source: a directory, or an iterable of file paths
+        workers: number of concurrent uploads
+        update_workers: number of concurrent UpdatePhoto calls
+        max_bytes_per_sec: if given, caps the combined upload bandwidth
+        recursive: with a directory source, also uploads subdirectories
+        extensions: with a directory source, only files with these (lower
+        case) extensions are uploaded, e.g. ('.jpg', '.mov').  Hidden files
+        are always skipped
+        updater: None, or a callable updater(path) returning the PhotoUpdater
+        for that file
+        autoFillUpdater, filenameStripRoot: as in upload
+        progress: called as progress(result) with each finished UploadResult
+        (from worker threads)
+        
+        returns: an UploadReport listing a result for every file, in order
+        """
+        from ._transfers import UploadEngine, listfiles
+        if isinstance(source, basestring):
+            source = listfiles(source, recursive=recursive,
+                               extensions=extensions)
+        engine = UploadEngine(self, photoset, workers=workers,
+                              update_workers=update_workers,
+                              max_bytes_per_sec=max_bytes_per_sec,
+                              autoFillUpdater=autoFillUpdater,
+                              updater=updater,
+                              filenameStripRoot=filenameStripRoot,
+                              progress=progress)
+        return engine.run(source)
+
+# ZenConnection's Zenfolio API calls, plus the helpers which do nothing
+# but chain them; the futures-based clients offer these as Futures
+API_METHODS = (
+    'GetChallenge', 'AuthenticatePlain', 'Authenticate',
+    'AddPhotoToCollection', 'RemovePhotoFromCollection', 'CreateGroup',
+    'CreatePhotoset', 'DeleteGroup', 'DeletePhoto', 'DeletePhotoset',
+    'GetCategories', 'GetDownloadOriginalKey', 'GetPopularPhotos',
+    'GetPopularSets', 'GetRecentPhotos', 'GetRecentSets',
+    'KeyringAddKeyPlain', 'LoadGroup', 'LoadGroupHierarchy', 'LoadPhoto',
+    'LoadPhotoSet', 'LoadPrivateProfile', 'LoadPublicProfile', 'MoveGroup',
+    'MovePhoto', 'MovePhotoSet', 'ReorderGroup', 'ReorderPhotoSet',
+    'ReplacePhoto', 'RotatePhoto', 'SearchPhotoByCategory',
+    'SearchPhotoByText', 'SearchSetByCategory', 'SearchSetByText',
+    'SetGroupTitlePhoto', 'SetPhotoSetFeaturedIndex', 'SetPhotoSetTitlePhoto',
+    'UpdateGroup', 'UpdatePhoto', 'UpdatePhotoSet', 'save_changes',
+    'UpdateGroupAccess', 'UpdatePhotoAccess', 'UpdatePhotoSetAccess',
+)
 
 if __name__ == '__main__':
     # some simple testing